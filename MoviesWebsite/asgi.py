@@ -9,8 +9,9 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from backend.asgi import get_pooled_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MoviesWebsite.settings')
 
-application = get_asgi_application()
+# Runs the synchronous views on bounded read and write thread pools, see backend.asgi.
+application = get_pooled_asgi_application()
@@ -65,6 +65,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.instrumentation.InstrumentationMiddleware',
+    'backend.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -125,6 +127,21 @@ DATABASES = {
     # }
 }
 
+# Read replicas of the primary as DB_REPLICAS=host=weight,other-host=weight, with the primary's credentials.
+# Safe requests read from one of them, picked by weight, see backend.routers.
+REPLICA_DATABASES = {}
+for number, (replica_host, weight) in enumerate(sorted(env.dict('DB_REPLICAS', default={}).items())):
+    alias = 'replica_%d' % number
+    DATABASES[alias] = dict(DATABASES['default'], HOST=replica_host, TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES[alias] = int(weight)
+DATABASE_ROUTERS = ['backend.routers.ReplicaRouter']
+# Seconds a client reads from the primary after a write, and a failing replica is left out.
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=5)
+# Required with replicas: a cache from CACHES that every worker shares (not local memory), e.g. 'default'
+# with CACHE_URL=redis://... or memcache://...
+REPLICA_PIN_CACHE_ALIAS = env.str('REPLICA_PIN_CACHE_ALIAS', default=None)
+REPLICA_RETRY_INTERVAL = env.int('REPLICA_RETRY_INTERVAL', default=30)
+
 # 'ENGINE': 'django.db.backends.postgresql',
 # 'NAME': 'yuwthjwb',
 # 'USER': 'yuwthjwb',
@@ -162,6 +179,34 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Caches list responses until a write bumps one of the version counters they depend on.
+RESPONSE_CACHE_ENABLED = env.bool('RESPONSE_CACHE_ENABLED', default=False)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = None
+
+# Token -> user lookups of CachedTokenAuthentication, kept in a process local LRU unless an alias is given.
+TOKEN_CACHE_SIZE = env.int('TOKEN_CACHE_SIZE', default=10000)
+TOKEN_CACHE_TIMEOUT = env.int('TOKEN_CACHE_TIMEOUT', default=60)
+TOKEN_CACHE_ALIAS = env.str('TOKEN_CACHE_ALIAS', default=None)
+# Holds the revocation counter process local entries are checked against on every request. A local memory
+# cache can't be shared by the workers, the counter is then a database row.
+TOKEN_REVOCATION_CACHE_ALIAS = env.str('TOKEN_REVOCATION_CACHE_ALIAS', default='default')
+
+# Thread pools of the ASGI handler, each thread holds a database connection.
+ASGI_READ_THREADS = env.int('ASGI_READ_THREADS', default=32)
+ASGI_WRITE_THREADS = env.int('ASGI_WRITE_THREADS', default=8)
+
+# Per-request query, serialization and render figures, exported on /metrics and in a Server-Timing header.
+INSTRUMENTATION_ENABLED = env.bool('INSTRUMENTATION_ENABLED', default=True)
+SERVER_TIMING_ENABLED = env.bool('SERVER_TIMING_ENABLED', default=True)
+# Share of requests whose queries slower than the threshold are logged to backend.slow_queries.
+SLOW_QUERY_SAMPLE_RATE = env.float('SLOW_QUERY_SAMPLE_RATE', default=0.0)
+SLOW_QUERY_THRESHOLD_MS = env.float('SLOW_QUERY_THRESHOLD_MS', default=100)
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -183,6 +228,42 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = '/static/'
 
 TAGGIT_CASE_INSENSITIVE = True
+
+# Answers ?tags= queries from an in-memory inverted index built when the server starts.
+TAG_INDEX_ENABLED = env.bool('TAG_INDEX_ENABLED', default=False)
+# Seconds between checks for tagging changes made by other processes, 0 checks on every query.
+TAG_INDEX_CHECK_INTERVAL = env.float('TAG_INDEX_CHECK_INTERVAL', default=0)
+
+# backend.search.DatabaseSearchBackend uses the database's full-text index,
+# backend.search.LocalSearchBackend an in-memory token index built when the server starts.
+SEARCH_BACKEND = env('SEARCH_BACKEND', default='backend.search.DatabaseSearchBackend')
+SEARCH_INDEX_CHECK_INTERVAL = env.float('SEARCH_INDEX_CHECK_INTERVAL', default=0)
+# Answers /api/tags/complete/ from an in-memory index built when the server starts instead of the database.
+# Every tag and tagging write then bumps the shared tag counters, which serializes them.
+TAG_COMPLETION_INDEX_ENABLED = env.bool('TAG_COMPLETION_INDEX_ENABLED', default=False)
+TAG_COMPLETION_CHECK_INTERVAL = env.float('TAG_COMPLETION_CHECK_INTERVAL', default=0)
+# Versions of changes kept for the in-memory indexes of other processes to catch up, a process further
+# behind reloads its indexes.
+VERSION_CHANGES_KEPT = env.int('VERSION_CHANGES_KEPT', default=10000)
+# Stores the tag names of every element on the element, element lists and pages then skip the taggings.
+# Run python manage.py check_tag_names --repair after turning it on.
+ELEMENT_TAG_NAMES_ENABLED = env.bool('ELEMENT_TAG_NAMES_ENABLED', default=False)
+# Tag name -> id lookups cached per process, 0 turns the cache off. Tags created or deleted by other
+# workers are seen after TAG_ID_CACHE_NEGATIVE_TIMEOUT and TAG_ID_CACHE_TIMEOUT seconds.
+TAG_ID_CACHE_SIZE = env.int('TAG_ID_CACHE_SIZE', default=100000)
+TAG_ID_CACHE_TIMEOUT = env.float('TAG_ID_CACHE_TIMEOUT', default=300)
+TAG_ID_CACHE_NEGATIVE_TIMEOUT = env.float('TAG_ID_CACHE_NEGATIVE_TIMEOUT', default=5)
+# /api/elements/{id}/similar/: with SIMILAR_INDEX_ENABLED, elements sharing one of SIMILAR_BANDS bands of
+# SIMILAR_ROWS MinHash values are candidates (bands * rows <= 32), found by an in-memory index built when the
+# server starts. Without it, elements sharing tags found by the database are. The SIMILAR_MAX_CANDIDATES
+# sharing the most are ranked exactly. Run python manage.py rebuild_similar_index after turning it on.
+SIMILAR_INDEX_ENABLED = env.bool('SIMILAR_INDEX_ENABLED', default=False)
+SIMILAR_BANDS = env.int('SIMILAR_BANDS', default=16)
+SIMILAR_ROWS = env.int('SIMILAR_ROWS', default=2)
+SIMILAR_MAX_CANDIDATES = env.int('SIMILAR_MAX_CANDIDATES', default=200)
+SIMILAR_INDEX_CHECK_INTERVAL = env.float('SIMILAR_INDEX_CHECK_INTERVAL', default=0)
+# Most operations accepted by one /api/elements/batch/ request.
+ELEMENT_BATCH_MAX_OPERATIONS = env.int('ELEMENT_BATCH_MAX_OPERATIONS', default=500)
 LOGIN_REDIRECT_URL = 'home'
 
 ACCOUNT_AUTHENTICATION_METHOD = 'USERNAME'
@@ -191,12 +272,26 @@ ACCOUNT_USERNAME_REQUIRED = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.LimitOffsetOrCursorPagination',
     'PAGE_SIZE': 100,
     'MAX_PAGE_SIZE': 1000,
 }
 
+# Default ?count= mode of limit/offset pages per view basename (element, tags, user), for example
+# PAGINATION_COUNT_MODES=element=estimate. Views not listed count exactly.
+PAGINATION_COUNT_MODES = env.dict('PAGINATION_COUNT_MODES', default={})
+COUNT_CACHE_ALIAS = 'default'
+COUNT_CACHE_TIMEOUT = env.int('COUNT_CACHE_TIMEOUT', default=60)
+# ?count=estimate counts up to COUNT_ESTIMATE_EXACT_LIMIT rows exactly, then extrapolates from the
+# latest COUNT_ESTIMATE_SAMPLE_SIZE rows.
+COUNT_ESTIMATE_EXACT_LIMIT = env.int('COUNT_ESTIMATE_EXACT_LIMIT', default=1000)
+COUNT_ESTIMATE_SAMPLE_SIZE = env.int('COUNT_ESTIMATE_SAMPLE_SIZE', default=10000)
+
 if not DEBUG:
     django_heroku.settings(locals())
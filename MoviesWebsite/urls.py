@@ -19,8 +19,11 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from backend.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^api-auth/', include('rest_auth.urls')),
     url(r'api/', include('backend.urls')),
+    path('metrics', metrics, name='metrics'),
 ]  + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
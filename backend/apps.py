@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BackendConfig(AppConfig):
     name = 'backend'
+
+    def ready(self):
+        from backend import authentication, autocomplete, cache, related, search, signals, similar  # noqa: F401
+        from backend import tag_cache, tag_index, tag_names  # noqa: F401
@@ -0,0 +1,71 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.urls import reverse
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class PooledASGIHandler(ASGIHandler):
+    """
+    Django 3.0 has neither async views nor an async ORM, so the views stay synchronous and this handler
+    runs them off the event loop on two bounded thread pools: reads (safe methods and the token lookup
+    of /api/me/) on ASGI_READ_THREADS, everything else on ASGI_WRITE_THREADS. A process then serves as
+    many slow reads at once as it has read threads, and they can't starve writes. Every thread keeps its
+    own database connection, so the pools also bound the connections a process opens.
+    """
+
+    def __init__(self):
+        super(PooledASGIHandler, self).__init__()
+        self.read_executor = ThreadPoolExecutor(
+            getattr(settings, "ASGI_READ_THREADS", 32), thread_name_prefix="asgi-read"
+        )
+        self.write_executor = ThreadPoolExecutor(
+            getattr(settings, "ASGI_WRITE_THREADS", 8), thread_name_prefix="asgi-write"
+        )
+
+    def is_read(self, request):
+        return request.method in SAFE_METHODS or request.path == reverse("me-list")
+
+    async def get_response(self, request):
+        executor = self.read_executor if self.is_read(request) else self.write_executor
+        return await asyncio.get_event_loop().run_in_executor(executor, self.get_response_in_thread, request)
+
+    def get_response_in_thread(self, request):
+        # request_started runs in another thread under ASGI, the connection of this one is checked here.
+        close_old_connections()
+        return super(PooledASGIHandler, self).get_response(request)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super(PooledASGIHandler, self).send_response(response, send)
+            return
+        # Streaming bodies (exports) query the database while they are iterated, which can't happen on the loop.
+        headers = [
+            (header.encode("ascii") if isinstance(header, str) else bytes(header),
+             value.encode("latin1") if isinstance(value, str) else bytes(value))
+            for header, value in response.items()
+        ]
+        headers += [(b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+                    for cookie in response.cookies.values()]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        loop = asyncio.get_event_loop()
+        parts = iter(response)
+        while True:
+            part = await loop.run_in_executor(self.read_executor, next, parts, None)
+            if part is None:
+                break
+            for chunk, last in self.chunk_bytes(part):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+        await loop.run_in_executor(self.read_executor, response.close)
+
+
+def get_pooled_asgi_application():
+    """Same as django.core.asgi.get_asgi_application(), with the PooledASGIHandler."""
+    django.setup(set_prefix=False)
+    return PooledASGIHandler()
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from backend.routers import use_primary
+from backend.versions import TOKENS, bump_version, get_version, track_versions
+
+
+def clone(instance):
+    """Copy of the model instance sharing no state with it, as if loaded from the database again."""
+    fields = instance._meta.concrete_fields
+    return type(instance).from_db(
+        instance._state.db, [field.attname for field in fields], [getattr(instance, field.attname) for field in fields]
+    )
+
+
+class TokenCache:
+    """
+    Bounded LRU of token key -> Token with its user, entries expire after TOKEN_CACHE_TIMEOUT seconds.
+    Revocations bump a revocation counter and process local entries are only trusted while it has the
+    value they were read at, so every worker stops accepting a revoked token at once. The counter lives in
+    the TOKEN_REVOCATION_CACHE_ALIAS cache, one cache read per request, unless that cache is local to the
+    process: it is then the TOKENS version, one database row. With TOKEN_CACHE_ALIAS set the entries live
+    in that shared cache instead, where invalidations delete them, and no counter is read.
+    """
+    counter_key = "auth-token-revocations"
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def size(self):
+        return getattr(settings, "TOKEN_CACHE_SIZE", 10000)
+
+    @property
+    def timeout(self):
+        return getattr(settings, "TOKEN_CACHE_TIMEOUT", 60)
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "TOKEN_CACHE_ALIAS", None)
+        return caches[alias] if alias else None
+
+    @property
+    def counter(self):
+        """The cache holding the revocation counter, None when it is the TOKENS version."""
+        cache = caches[getattr(settings, "TOKEN_REVOCATION_CACHE_ALIAS", "default")]
+        return None if isinstance(cache, (LocMemCache, DummyCache)) else cache
+
+    def version(self):
+        """The revocation counter local entries are checked against, None with a shared cache."""
+        if self.shared is not None:
+            return None
+        counter = self.counter
+        if counter is None:
+            # The primary, a revocation must be seen before the replicas catch up.
+            with use_primary():
+                return get_version(TOKENS)
+        version = counter.get(self.counter_key)
+        if version is None:
+            self.restart_counter(counter)
+            version = counter.get(self.counter_key)
+        return version
+
+    def restart_counter(self, counter):
+        # A missing counter was evicted or never set, starting from the clock puts it above any value it had.
+        counter.add(self.counter_key, time.time_ns(), None)
+
+    def revoke(self):
+        counter = self.counter
+        if counter is None:
+            bump_version(TOKENS)
+            return
+        try:
+            counter.incr(self.counter_key)
+        except ValueError:
+            self.restart_counter(counter)
+
+    def detached(self, token):
+        # Requests must not share the cached instances, copies would still share their field caches.
+        detached = clone(token)
+        detached.user = clone(token.user)
+        return detached
+
+    def cache_key(self, key):
+        return "auth-token:" + key
+
+    def get(self, key, version=None):
+        if self.shared is not None:
+            return self.shared.get(self.cache_key(key))
+        if version is None:
+            version = self.version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            token, expires, read_at = entry
+            if expires < time.monotonic() or read_at != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return self.detached(token)
+
+    def set(self, token, version):
+        """Caches the token read from the database at the TOKENS version."""
+        if self.shared is not None:
+            self.shared.set(self.cache_key(token.key), token, self.timeout)
+            return
+        with self.lock:
+            self.entries[token.key] = (self.detached(token), time.monotonic() + self.timeout, version)
+            self.entries.move_to_end(token.key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        if self.shared is not None:
+            self.shared.delete_many([self.cache_key(key) for key in keys])
+            return
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def invalidate_on_commit(self, *keys):
+        """
+        Drops the keys now and once more after commit, a request may cache the old row in between.
+        The revocation reaches the entries of the other workers, a counter in a cache is bumped after
+        commit too as it doesn't wait for the transaction.
+        """
+        self.invalidate(*keys)
+        self.revoke()
+
+        def after_commit():
+            self.invalidate(*keys)
+            if self.shared is None and self.counter is not None:
+                self.revoke()
+
+        transaction.on_commit(after_commit)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+track_versions(lambda: token_cache.shared is None and token_cache.counter is None, TOKENS)
+
+
+def get_token(key):
+    """Returns the Token (with its user) of the key from the token cache or the database, None if there is none."""
+    # Read before the token, a revocation committing in between leaves the entry behind the version.
+    version = token_cache.version()
+    token = token_cache.get(key, version)
+    if token is None:
+        # Always the primary: a token created or revoked a moment ago may not have reached the replicas.
+        token = Token.objects.using(DEFAULT_DB_ALIAS).select_related("user").filter(key=key).first()
+        if token is not None:
+            token_cache.set(token, version)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """DRF's TokenAuthentication answered from the token cache."""
+
+    def authenticate_credentials(self, key):
+        token = get_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return token.user, token
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate_on_commit(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Password changes and deactivation save the user, the cached copy must not outlive them.
+    # Logins only save last_login, which no token check reads.
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list("key", flat=True))
+    if keys:
+        token_cache.invalidate_on_commit(*keys)
@@ -0,0 +1,190 @@
+import heapq
+from bisect import bisect_left
+from itertools import groupby
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from backend.models import Tag
+from backend.routers import use_primary
+from backend.signals import logged_tags, logged_taggings_changes, taggings_changed, tags_created
+from backend.versions import TAGGINGS, TAGS, VersionedIndex
+
+END = "\U0010ffff"
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 900
+
+
+class TagPrefixIndex(VersionedIndex):
+    """
+    Process local sorted array of lowercased tag names for prefix lookups ranked by element count.
+    Prefixes up to `cached_prefix_length` characters match too many tags to rank on every request,
+    so their best `cached_top` tags are precomputed and kept sorted as counts change. A list is `partial`
+    when its prefix has more tags than it holds, a tag that drops out of it is only ranked back in
+    once the list runs shorter than a request's limit. Element counts follow the TAGGINGS changes.
+    Only used with TAG_COMPLETION_INDEX_ENABLED, keeping it makes every tag and tagging write bump the
+    shared TAGS and TAGGINGS counters.
+    """
+    version_name = TAGS
+    followed_version_names = (TAGGINGS,)
+    check_interval_setting = "TAG_COMPLETION_CHECK_INTERVAL"
+    cached_prefix_length = 2
+    cached_top = 50
+
+    def is_enabled(self):
+        return getattr(settings, "TAG_COMPLETION_INDEX_ENABLED", False)
+
+    def reset(self):
+        self.keys = []
+        self.ids = []
+        self.names = {}
+        self.counts = {}
+        self.top = {}
+        self.partial = set()
+
+    def load(self):
+        tags = Tag.objects.order_by().values_list("id", "name", "element_count")
+        rows = sorted((name.lower(), tag_id, name, count) for tag_id, name, count in tags.iterator(chunk_size=10000))
+        self.keys = [row[0] for row in rows]
+        self.ids = [row[1] for row in rows]
+        self.names = {row[1]: row[2] for row in rows}
+        self.counts = {row[1]: row[3] for row in rows}
+        self.load_top()
+
+    def load_top(self):
+        groups = {}
+        for prefix, positions in groupby(range(len(self.keys)), key=lambda i: self.keys[i][:self.cached_prefix_length]):
+            groups[prefix] = [self.ids[i] for i in positions]
+        for length in range(self.cached_prefix_length, -1, -1):
+            parents = {}
+            for prefix, ids in groups.items():
+                top = self.top[prefix] = self.rank(ids, self.cached_top)
+                if len(top) < len(ids) or prefix in self.partial:
+                    self.partial.add(prefix)
+                    self.partial.add(prefix[:length - 1] if length else prefix)
+                parents.setdefault(prefix[:length - 1], []).extend(top)
+            groups = parents if length else {}
+
+    def score(self, tag_id):
+        return self.counts[tag_id], -tag_id
+
+    def rank(self, ids, limit):
+        return heapq.nlargest(limit, ids, key=self.score)
+
+    def prefixes(self, key):
+        return [key[:length] for length in range(min(len(key), self.cached_prefix_length) + 1)]
+
+    def range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + END)
+
+    def add(self, tags):
+        for tag_id, name in tags.items():
+            if tag_id in self.names:
+                continue
+            key = name.lower()
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.ids.insert(i, tag_id)
+            self.names[tag_id] = name
+            self.counts[tag_id] = 0
+            self.reposition(tag_id)
+
+    def replay(self, name, changes):
+        if name == TAGS:
+            for change in changes:
+                self.add(logged_tags(change))
+        else:
+            self.refresh_counts(changed_tag_ids(logged_taggings_changes(change) for change in changes))
+
+    def refresh_counts(self, tag_ids):
+        """
+        Reads the element counts of the tags again. Unlike adding up the changes it doesn't count twice
+        a change that was also loaded by a rebuild.
+        """
+        tag_ids = sorted(tag_id for tag_id in tag_ids if tag_id in self.counts)
+        with self.lock, use_primary():
+            for start in range(0, len(tag_ids), BATCH_SIZE):
+                counts = Tag.objects.filter(id__in=tag_ids[start:start + BATCH_SIZE]).values_list("id", "element_count")
+                for tag_id, count in counts:
+                    if tag_id in self.counts and count != self.counts[tag_id]:
+                        decreased = count < self.counts[tag_id]
+                        self.counts[tag_id] = count
+                        self.reposition(tag_id, decreased=decreased)
+
+    def adjust_counts(self, deltas):
+        with self.lock:
+            for tag_id, delta in deltas.items():
+                if delta and tag_id in self.counts:
+                    self.counts[tag_id] += delta
+                    self.reposition(tag_id, decreased=delta < 0)
+
+    def reposition(self, tag_id, decreased=False):
+        for prefix in self.prefixes(self.names[tag_id].lower()):
+            top = self.top.get(prefix)
+            if top is None:
+                continue
+            if tag_id in top:
+                top.remove(tag_id)
+                if decreased and prefix in self.partial and top and self.score(tag_id) < self.score(top[-1]):
+                    # A tag outside of the list may outrank it now.
+                    continue
+            elif prefix in self.partial and (not top or self.score(tag_id) <= self.score(top[-1])):
+                continue
+            top.append(tag_id)
+            top.sort(key=self.score, reverse=True)
+            if len(top) > self.cached_top:
+                del top[self.cached_top:]
+                self.partial.add(prefix)
+
+    def complete(self, prefix, limit):
+        """Returns up to `limit` (name, element count) pairs of tags starting with prefix, most used first."""
+        self.ensure_fresh()
+        prefix = prefix.lower()
+        with self.lock:
+            if len(prefix) <= self.cached_prefix_length and limit <= self.cached_top:
+                top = self.top.get(prefix)
+                if top is None or (prefix in self.partial and len(top) < limit):
+                    start, end = self.range(prefix)
+                    top = self.top[prefix] = self.rank(self.ids[start:end], self.cached_top)
+                    if end - start > len(top):
+                        self.partial.add(prefix)
+                ids = top[:limit]
+            else:
+                start, end = self.range(prefix)
+                ids = self.rank(self.ids[start:end], limit)
+            return [(self.names[tag_id], self.counts[tag_id]) for tag_id in ids]
+
+
+tag_prefix_index = TagPrefixIndex()
+
+
+def complete_tags(prefix, limit):
+    """
+    Returns up to `limit` (name, element count) pairs of tags starting with prefix (any case), most used
+    first, from the index with TAG_COMPLETION_INDEX_ENABLED, else from the database.
+    """
+    if tag_prefix_index.is_enabled():
+        return tag_prefix_index.complete(prefix, limit)
+    tags = Tag.objects.filter(name__istartswith=prefix).order_by("-element_count", "id")
+    return list(tags.values_list("name", "element_count")[:limit])
+
+
+def warm_up():
+    if tag_prefix_index.is_enabled():
+        tag_prefix_index.build()
+
+
+@receiver(tags_created)
+def add_created_tags(sender, tags, version, **kwargs):
+    tag_prefix_index.apply_on_commit(version, tag_prefix_index.add, tags)
+
+
+def changed_tag_ids(change_lists):
+    """Ids of the tags added to or removed from elements by lists of taggings_changed changes."""
+    return {tag_id for changes in change_lists for element_id, before, after in changes for tag_id in before ^ after}
+
+
+@receiver(taggings_changed)
+def update_tag_usage(sender, changes, version, **kwargs):
+    tag_prefix_index.apply_on_commit(version, tag_prefix_index.refresh_counts, changed_tag_ids([changes]),
+                                     name=TAGGINGS)
@@ -0,0 +1,197 @@
+from django.db import transaction
+from rest_framework import status
+
+from backend.importer import insert_elements
+from backend.models import Element, Tag, Tagging
+from backend.serializers import ELEMENT_ROW_FIELDS, ElementRowSerializer, ElementSerializer
+from backend.signals import notify_elements_changed, notify_many_taggings_changed, notifying_in_bulk
+from backend.tag_names import initial_tag_names
+from backend.tagging import resolve_or_create_tags, split_tag_changes
+
+OPERATIONS = ("create", "update", "delete")
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 900
+
+
+class Operation:
+    def __init__(self, index, op, element_id=None, data=None):
+        self.index = index
+        self.op = op
+        self.element_id = element_id
+        self.data = data or {}
+        self.element = None
+        self.status = None
+        self.errors = None
+
+    def fail(self, code, errors):
+        self.status = code
+        self.errors = errors
+
+    def result(self, rows=None):
+        result = {"op": self.op, "status": self.status}
+        if self.element_id is not None:
+            result["id"] = self.element_id
+        if self.errors is not None:
+            result["errors"] = self.errors
+        elif rows is not None and self.element_id in rows:
+            result["element"] = rows[self.element_id]
+        return result
+
+
+def parse_operation(index, raw, context):
+    """Returns an Operation with its validated data, failed when the operation or its data is invalid."""
+    if not isinstance(raw, dict) or raw.get("op") not in OPERATIONS:
+        operation = Operation(index, raw.get("op") if isinstance(raw, dict) else None)
+        operation.fail(status.HTTP_400_BAD_REQUEST, {"op": ["Must be one of: " + ", ".join(OPERATIONS)]})
+        return operation
+    op = raw["op"]
+    operation = Operation(index, op)
+    if op != "create":
+        element_id = raw.get("id")
+        if not isinstance(element_id, int) or isinstance(element_id, bool):
+            operation.fail(status.HTTP_400_BAD_REQUEST, {"id": ["A valid integer is required."]})
+            return operation
+        operation.element_id = element_id
+    if op == "delete":
+        return operation
+    serializer = ElementSerializer(data=raw.get("data", {}), partial=op == "update", context=context)
+    if serializer.is_valid():
+        operation.data = serializer.validated_data
+    else:
+        operation.fail(status.HTTP_400_BAD_REQUEST, serializer.errors)
+    return operation
+
+
+def check_elements(operations, user):
+    """Loads the updated and deleted elements, failing operations on missing elements or of other users."""
+    targets = [operation for operation in operations if operation.element_id is not None and operation.errors is None]
+    elements = {}
+    ids = sorted({operation.element_id for operation in targets})
+    for start in range(0, len(ids), BATCH_SIZE):
+        elements.update(Element.objects.in_bulk(ids[start:start + BATCH_SIZE]))
+    seen = set()
+    for operation in targets:
+        operation.element = elements.get(operation.element_id)
+        if operation.element_id in seen:
+            operation.fail(status.HTTP_400_BAD_REQUEST, {"id": ["The element appears in more than one operation."]})
+        elif operation.element is None:
+            operation.fail(status.HTTP_404_NOT_FOUND, {"detail": "Not found."})
+        # The check of ElementSerializer.update, which applies to deletions here as well.
+        elif operation.element.user_id != user.id:
+            operation.fail(status.HTTP_403_FORBIDDEN, {"detail": "You don't have permission to %s it!" % operation.op})
+        seen.add(operation.element_id)
+
+
+def current_taggings(element_ids):
+    """Returns {element id: {tag id: tagging id}}."""
+    taggings = {element_id: {} for element_id in element_ids}
+    for start in range(0, len(element_ids), BATCH_SIZE):
+        rows = Tagging.objects.filter(element_id__in=element_ids[start:start + BATCH_SIZE])
+        for tagging_id, element_id, tag_id in rows.values_list("id", "element_id", "tag_id"):
+            taggings[element_id][tag_id] = tagging_id
+    return taggings
+
+
+def apply_operations(operations, user):
+    """
+    Writes the valid operations in the current transaction with a number of queries that depends on
+    the kinds of operations, not on their number: tags are resolved once for the whole batch, elements
+    and taggings are inserted, updated and deleted in bulk, and the taggings_changed receivers run once.
+    """
+    creates = [operation for operation in operations if operation.op == "create"]
+    updates = [operation for operation in operations if operation.op == "update"]
+    deletes = [operation for operation in operations if operation.op == "delete"]
+    tag_changes = {}
+    for operation in creates:
+        tag_changes[operation.index] = ([tag["name"] for tag in operation.data.get("tags") or ()], [])
+    for operation in updates:
+        if operation.data.get("tags"):
+            tag_changes[operation.index] = split_tag_changes(operation.data["tags"])
+    added_names = {name for added, removed in tag_changes.values() for name in added}
+    removed_names = {name for added, removed in tag_changes.values() for name in removed}
+    tag_ids = Tag.objects.ids_for_names(added_names | removed_names) if tag_changes else {}
+    tag_ids = resolve_or_create_tags(added_names, known=tag_ids) if added_names else tag_ids
+
+    taggings = current_taggings(sorted(
+        {operation.element_id for operation in updates if operation.index in tag_changes}
+        | {operation.element_id for operation in deletes}
+    ))
+    tag_names = initial_tag_names()
+    elements = [Element(user=user, tag_names=tag_names,
+                        **{field: value for field, value in operation.data.items() if field != "tags"})
+                for operation in creates]
+    insert_elements(elements)
+    for operation, element in zip(creates, elements):
+        operation.element, operation.element_id = element, element.pk
+        taggings[element.pk] = {}
+
+    fields = set()
+    for operation in updates:
+        for field, value in operation.data.items():
+            if field != "tags":
+                setattr(operation.element, field, value)
+                fields.add(field)
+    if fields:
+        Element.objects.bulk_update([operation.element for operation in updates], sorted(fields))
+
+    changes = []
+    removed_taggings = []
+    new_taggings = []
+    for operation in creates + updates:
+        if operation.index not in tag_changes:
+            continue
+        added, removed = tag_changes[operation.index]
+        current = taggings[operation.element_id]
+        before = frozenset(current)
+        removed = {tag_ids[name] for name in removed if name in tag_ids} & before
+        added = {tag_ids[name] for name in added}
+        removed_taggings += [current[tag_id] for tag_id in removed]
+        new_taggings += [Tagging(element_id=operation.element_id, tag_id=tag_id) for tag_id in added - before]
+        changes.append((operation.element_id, before, (before - removed) | added))
+    for operation in deletes:
+        current = taggings[operation.element_id]
+        removed_taggings += current.values()
+        changes.append((operation.element_id, frozenset(current), frozenset()))
+    with notifying_in_bulk():
+        for start in range(0, len(removed_taggings), BATCH_SIZE):
+            Tagging.objects.filter(id__in=removed_taggings[start:start + BATCH_SIZE]).delete()
+    Tagging.objects.bulk_create(new_taggings)
+    # Also removes the signatures of the deleted elements, before the elements themselves.
+    notify_many_taggings_changed(changes)
+
+    notify_elements_changed([operation.element for operation in creates + updates])
+    notify_elements_changed([operation.element for operation in deletes], deleted=True)
+    deleted = [operation.element_id for operation in deletes]
+    # The notifications above did the work of the per element delete receivers for the whole batch.
+    with notifying_in_bulk():
+        for start in range(0, len(deleted), BATCH_SIZE):
+            Element.objects.filter(pk__in=deleted[start:start + BATCH_SIZE]).delete()
+
+
+def apply_batch(raw_operations, user, context=None):
+    """
+    Applies a list of {"op": "create" | "update" | "delete", "id": element id, "data": element fields}
+    operations for the user in one transaction and returns (status code, per operation results). Updates
+    take the same data as a PATCH of the element, tags included. Any failing operation rolls the batch
+    back, the other operations are then reported as 424 Failed Dependency.
+    """
+    operations = [parse_operation(index, raw, context) for index, raw in enumerate(raw_operations)]
+    with transaction.atomic():
+        check_elements(operations, user)
+        failed = [operation for operation in operations if operation.errors is not None]
+        if not failed and operations:
+            apply_operations(operations, user)
+    if failed:
+        for operation in operations:
+            if operation.errors is None:
+                operation.status = status.HTTP_424_FAILED_DEPENDENCY
+        return status.HTTP_400_BAD_REQUEST, [operation.result() for operation in operations]
+    written = [operation.element_id for operation in operations if operation.op != "delete"]
+    rows = {}
+    for start in range(0, len(written), BATCH_SIZE):
+        queryset = Element.objects.filter(pk__in=written[start:start + BATCH_SIZE])
+        rows.update((row["id"], row) for row in ElementRowSerializer(list(queryset.values(*ELEMENT_ROW_FIELDS))).data)
+    codes = {"create": status.HTTP_201_CREATED, "update": status.HTTP_200_OK, "delete": status.HTTP_204_NO_CONTENT}
+    for operation in operations:
+        operation.status = codes[operation.op]
+    return status.HTTP_200_OK, [operation.result(rows) for operation in operations]
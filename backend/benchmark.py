@@ -0,0 +1,111 @@
+import random
+from contextlib import contextmanager
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework.authtoken.models import Token
+
+from backend.models import Element, Tag, Tagging
+from backend.related import rebuild_tag_cooccurrences
+from backend.similar import rebuild_signatures
+from backend.tag_names import refresh_tag_names
+
+PASSWORD = "Benchmark1234!"
+WORDS = (
+    "action drama comedy thriller classic remake sequel director actor score scene story plot hero villain "
+    "night city love war space future past family friend journey secret dream music dance ocean mountain "
+    "road train island forest winter summer light dark fire water gold silver stone machine ghost king"
+).split()
+
+
+@contextmanager
+def throwaway_database():
+    """Runs the block on a freshly migrated test database of the configured backend, dropped afterwards."""
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def zipf_weights(count, exponent=1.0):
+    """Cumulative weights of ranks 1..count under a Zipf distribution, for random.choices(cum_weights=...)."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def percentile(ordered, share):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(share / 100 * len(ordered))) - 1))]
+
+
+class SyntheticDataset:
+    """
+    Reproducible users, elements and tags: tag popularity follows a Zipf distribution and descriptions
+    have a uniformly drawn number of words. The same seed and sizes always produce the same rows.
+    """
+
+    def __init__(self, users=100, elements=10000, tags=1000, tags_per_element=5, zipf_exponent=1.0,
+                 description_words=(0, 200), seed=0):
+        self.users = users
+        self.elements = elements
+        self.tags = tags
+        self.tags_per_element = tags_per_element
+        self.zipf_exponent = zipf_exponent
+        self.description_words = description_words
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.tag_weights = zipf_weights(tags, zipf_exponent)
+
+    def describe(self):
+        return {
+            "users": self.users, "elements": self.elements, "tags": self.tags,
+            "tags_per_element": self.tags_per_element, "zipf_exponent": self.zipf_exponent,
+            "description_words": list(self.description_words), "seed": self.seed,
+        }
+
+    def tag_name(self, rank):
+        return "tag %d" % rank
+
+    def tag_names(self, count):
+        """Draws up to count distinct tag names, popular ones more often."""
+        ranks = self.random.choices(range(self.tags), cum_weights=self.tag_weights, k=count)
+        return [self.tag_name(rank) for rank in dict.fromkeys(ranks)]
+
+    def description(self):
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(*self.description_words)))
+
+    def generate(self):
+        User = get_user_model()
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([User(username="user%d" % i, password=password) for i in range(self.users)])
+        users = list(User.objects.order_by("id").values_list("id", flat=True))
+        Token.objects.bulk_create([Token(key=Token().generate_key(), user_id=user_id) for user_id in users])
+        Tag.objects.bulk_create([Tag(name=self.tag_name(rank)) for rank in range(self.tags)])
+        tag_ids = dict(Tag.objects.values_list("name", "id"))
+        Element.objects.bulk_create(
+            Element(user_id=self.random.choice(users), title=" ".join(self.random.choices(WORDS, k=3)),
+                    description=self.description())
+            for _ in range(self.elements)
+        )
+        taggings = []
+        for element_id in Element.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=10000):
+            taggings += [Tagging(element_id=element_id, tag_id=tag_ids[name])
+                         for name in self.tag_names(self.tags_per_element)]
+            if len(taggings) >= 10000:
+                Tagging.objects.bulk_create(taggings)
+                taggings = []
+        Tagging.objects.bulk_create(taggings)
+        counts = Tagging.objects.filter(tag=OuterRef("pk")).order_by().values("tag").annotate(
+            count=Count("element")).values("count")
+        Tag.objects.update(element_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+        rebuild_tag_cooccurrences()
+        rebuild_signatures()
+        # Only read with ELEMENT_TAG_NAMES_ENABLED, as the element list scenarios that compare both paths do.
+        refresh_tag_names(Element.objects.values_list("id", flat=True))
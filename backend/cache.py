@@ -0,0 +1,95 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from backend.versions import ELEMENTS, TAGGINGS, TAGS, USERS, get_versions, track_versions
+
+HITS = "response-cache:hits"
+MISSES = "response-cache:misses"
+
+
+def normalize_names(value):
+    groups = [sorted(set(group.split("|"))) for group in value.split(",") if group]
+    return ",".join(sorted("|".join(group) for group in groups))
+
+
+NORMALIZERS = {"tags": normalize_names, "not": normalize_names}
+
+
+def normalized_params(request, excluded=()):
+    """Sorted (name, value) pairs of the query string, with equivalent tag expressions written the same way."""
+    return sorted(
+        (param, NORMALIZERS.get(param, str)(value))
+        for param, values in request.query_params.lists() if param not in excluded for value in values
+    )
+
+
+class ResponseCache:
+    """
+    Caches the data of list responses under the normalized query string and the current values of the
+    version counters the response depends on. Writes bump those counters in the database, so stale
+    entries are never read again whichever worker wrote, and expire with the cache's own eviction.
+    """
+    def is_enabled(self):
+        return getattr(settings, "RESPONSE_CACHE_ENABLED", False)
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "RESPONSE_CACHE_ALIAS", "default")]
+
+    def key(self, name, version_names, request):
+        versions = get_versions(version_names)
+        params = normalized_params(request)
+        parts = [name, request.get_host(), repr([versions[version] for version in version_names]), repr(params)]
+        return "response:" + hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self.count(MISSES if data is None else HITS)
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, getattr(settings, "RESPONSE_CACHE_TIMEOUT", None))
+
+    def count(self, counter):
+        try:
+            self.cache.incr(counter)
+        except ValueError:
+            self.cache.add(counter, 1, None)
+
+    def stats(self):
+        counts = self.cache.get_many([HITS, MISSES])
+        return {"hits": counts.get(HITS, 0), "misses": counts.get(MISSES, 0)}
+
+    def reset_stats(self):
+        self.cache.delete_many([HITS, MISSES])
+
+
+response_cache = ResponseCache()
+track_versions(response_cache.is_enabled, ELEMENTS, TAGGINGS, TAGS, USERS)
+
+
+def cache_response(*version_names):
+    """Serves a list action from the response cache, the cached data is rendered anew for every request."""
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not response_cache.is_enabled():
+                return method(self, request, *args, **kwargs)
+            key = response_cache.key(self.basename + "-" + method.__name__, version_names, request)
+            data = response_cache.get(key)
+            if data is not None:
+                return Response(data, headers={"X-Cache": "HIT"})
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(key, response.data)
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
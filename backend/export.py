@@ -0,0 +1,53 @@
+import csv
+import json
+
+from backend.models import Tagging
+
+FIELDS = ["id", "title", "description", "user", "tags"]
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def iter_elements(queryset, chunk_size=2000):
+    """
+    Yields element dicts in id order. Rows are read in keyset chunks (WHERE id > last id) and the tags of a
+    chunk are loaded in one query, so memory stays flat and every chunk costs the same however far in it is.
+    """
+    rows = queryset.select_related(None).prefetch_related(None).order_by("pk")
+    rows = rows.values_list("id", "title", "description", "user_id")
+    last = 0
+    while True:
+        chunk = list(rows.filter(pk__gt=last)[:chunk_size])
+        if not chunk:
+            return
+        tags = {}
+        taggings = Tagging.objects.filter(element_id__in=[row[0] for row in chunk]).order_by("tag_id")
+        for element_id, name in taggings.values_list("element_id", "tag__name"):
+            tags.setdefault(element_id, []).append(name)
+        for element_id, title, description, user_id in chunk:
+            yield {"id": element_id, "title": title, "description": description, "user": user_id,
+                   "tags": tags.get(element_id, [])}
+        last = chunk[-1][0]
+
+
+def ndjson_lines(elements):
+    for element in elements:
+        yield json.dumps(element, ensure_ascii=False) + "\n"
+
+
+class Line:
+    def write(self, value):
+        return value
+
+
+def csv_lines(elements):
+    """CSV with a header row, the tags of an element are joined with |."""
+    writer = csv.writer(Line())
+    yield writer.writerow(FIELDS)
+    for element in elements:
+        yield writer.writerow([element["id"], element["title"], element["description"], element["user"],
+                               "|".join(element["tags"])])
+
+
+def export_lines(queryset, export_format):
+    elements = iter_elements(queryset)
+    return csv_lines(elements) if export_format == "csv" else ndjson_lines(elements)
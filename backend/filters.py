@@ -0,0 +1,101 @@
+import django_filters
+from django.db.models import Count, Q
+from rest_framework.filters import BaseFilterBackend
+
+from backend.models import Element, Tag, Tagging
+from backend.tag_cache import ids_for_names
+
+
+class TagExpression:
+    """
+    Tag filter taken from the query string: ``tags=a|b,c`` means (a OR b) AND c,
+    ``or=true`` turns every comma into an OR and ``not=d,e`` excludes elements tagged d or e.
+    """
+
+    def __init__(self, groups, excluded):
+        self.groups = groups
+        self.excluded = excluded
+
+    @classmethod
+    def from_params(cls, params):
+        names = split_names(params.get("tags", ""), ",")
+        if params.get("or", False):
+            groups = [[name for part in names for name in split_names(part, "|")]] if names else []
+        else:
+            groups = [split_names(part, "|") for part in names]
+        return cls([group for group in groups if group], split_names(params.get("not", ""), ","))
+
+    def __bool__(self):
+        return bool(self.groups or self.excluded)
+
+    def names(self):
+        return {name for group in self.groups for name in group} | set(self.excluded)
+
+    def resolve(self):
+        ids = ids_for_names(self.names())
+        groups = [{ids[name] for name in group if name in ids} for group in self.groups]
+        excluded = {ids[name] for name in self.excluded if name in ids}
+        return groups, excluded
+
+
+def split_names(value, separator):
+    return [name for name in str(value).split(separator) if name]
+
+
+def matching_element_ids(groups):
+    tag_ids = set().union(*groups)
+    taggings = Tagging.objects.filter(tag_id__in=tag_ids).values("element_id")
+    if all(len(group) == 1 for group in groups):
+        taggings = taggings.annotate(matched=Count("tag_id")).filter(matched=len(tag_ids))
+    else:
+        matches = {
+            "group_%d" % i: Count("tag_id", filter=Q(tag_id__in=group)) for i, group in enumerate(groups)
+        }
+        taggings = taggings.annotate(**matches).filter(**{name + "__gt": 0 for name in matches})
+    return taggings.values("element_id")
+
+
+def filter_by_tags(queryset, expression):
+    groups, excluded = expression.resolve()
+    if not all(groups):
+        return queryset.none()
+    if groups:
+        queryset = queryset.filter(id__in=matching_element_ids(groups))
+    if excluded:
+        queryset = queryset.exclude(id__in=Tagging.objects.filter(tag_id__in=excluded).values("element_id"))
+    return queryset
+
+
+def tag_facets(elements, limit):
+    """Counts how many of the given elements carry each tag, most used first, in one query."""
+    taggings = Tagging.objects.filter(element_id__in=elements.order_by().values("pk"))
+    counts = taggings.values("tag__name").annotate(count=Count("element_id")).order_by("-count", "tag__name")
+    return [{"name": row["tag__name"], "count": row["count"]} for row in counts[:limit]]
+
+
+def all_tag_facets(limit):
+    counts = Tag.objects.filter(element_count__gt=0).order_by("-element_count", "name")
+    return [{"name": name, "count": count} for name, count in counts.values_list("name", "element_count")[:limit]]
+
+
+class TagExpressionFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        expression = TagExpression.from_params(request.query_params)
+        if not expression:
+            return queryset
+        return filter_by_tags(queryset, expression)
+
+
+class ElementFilterSet(django_filters.FilterSet):
+    # Resolved through the tag id cache, like the other tag filters.
+    tags__name = django_filters.CharFilter(method="filter_tag_name")
+
+    class Meta:
+        model = Element
+        fields = ["tags__name", "user", "title"]
+
+    def filter_tag_name(self, queryset, name, value):
+        tag_id = ids_for_names([value]).get(value)
+        if tag_id is None:
+            return queryset.none()
+        return queryset.filter(id__in=Tagging.objects.filter(tag_id=tag_id).values("element_id"))
@@ -0,0 +1,123 @@
+import json
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from backend.models import Element, Tag, Tagging
+from backend.signals import notify_elements_changed, notify_many_taggings_changed
+from backend.tag_names import initial_tag_names
+from backend.tagging import resolve_or_create_tags
+
+TITLE_LENGTH = Element._meta.get_field("title").max_length
+DESCRIPTION_LENGTH = Element._meta.get_field("description").max_length
+NAME_LENGTH = Tag._meta.get_field("name").max_length
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 900
+
+
+def validate_record(record):
+    """Returns (title, description, tag names) of an NDJSON element record and a dict of field errors."""
+    if not isinstance(record, dict):
+        return None, {"non_field_errors": ["Expected a JSON object."]}
+    errors = {}
+    values = {}
+    for field, length in (("title", TITLE_LENGTH), ("description", DESCRIPTION_LENGTH)):
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            errors[field] = ["Not a valid string."]
+        elif value is not None and len(value) > length:
+            errors[field] = ["Ensure this field has no more than %d characters." % length]
+        values[field] = value
+    names = []
+    tags = record.get("tags") or []
+    if not isinstance(tags, list):
+        errors["tags"] = ["Expected a list of tags."]
+        tags = []
+    for tag in tags:
+        name = tag.get("name") if isinstance(tag, dict) else tag
+        # Trimmed like TagSerializer's name field does.
+        name = name.strip() if isinstance(name, str) else name
+        if not isinstance(name, str) or not name or len(name) > NAME_LENGTH:
+            errors["tags"] = ["Every tag needs a name of 1 to %d characters." % NAME_LENGTH]
+            break
+        names.append(name)
+    if errors:
+        return None, errors
+    return (values["title"], values["description"], names), {}
+
+
+def insert_elements(elements):
+    """
+    Bulk inserts the elements and sets their ids. Databases that can't return ids from a bulk insert get
+    the new rows back by a marker unique to the batch and the element, written in their tag_names and
+    replaced with the real value before commit, so ids taken by other transactions in between don't matter.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Element.objects.bulk_create(elements)
+        return
+    # Every id handed out from now on is above it, the read back only scans the new rows.
+    last = Element.objects.aggregate(last=Max("id"))["last"] or 0
+    prefix = "import:%s:" % uuid.uuid4().hex
+    tag_names = {}
+    for index, element in enumerate(elements):
+        tag_names.setdefault(element.tag_names, []).append(element)
+        element.tag_names = prefix + str(index)
+    Element.objects.bulk_create(elements)
+    markers = Element.objects.filter(pk__gt=last, tag_names__startswith=prefix).values_list("id", "tag_names")
+    for element_id, marker in markers:
+        elements[int(marker[len(prefix):])].pk = element_id
+    for value, named in tag_names.items():
+        ids = [element.pk for element in named]
+        for start in range(0, len(ids), BATCH_SIZE):
+            Element.objects.filter(pk__in=ids[start:start + BATCH_SIZE]).update(tag_names=value)
+        for element in named:
+            element.tag_names = value
+
+
+def import_batch(records, user):
+    """Creates the elements of one batch of valid records in a single transaction, returns how many."""
+    with transaction.atomic():
+        tag_ids = resolve_or_create_tags({name for title, description, names in records for name in names})
+        tag_names = initial_tag_names()
+        elements = [Element(user=user, title=title, description=description, tag_names=tag_names)
+                    for title, description, names in records]
+        insert_elements(elements)
+        changes = []
+        taggings = []
+        for element, (title, description, names) in zip(elements, records):
+            element_tags = frozenset(tag_ids[name] for name in names)
+            taggings += [Tagging(element_id=element.pk, tag_id=tag_id) for tag_id in element_tags]
+            changes.append((element.pk, frozenset(), element_tags))
+        Tagging.objects.bulk_create(taggings)
+        notify_elements_changed(elements)
+        notify_many_taggings_changed(changes)
+    return len(elements)
+
+
+def import_elements(lines, user, batch_size=1000):
+    """
+    Imports NDJSON element records ({"title", "description", "tags": [names or {"name"}]}) for the user in
+    transactional batches. Invalid records are reported with their line number and don't stop the import.
+    """
+    result = {"created": 0, "errors": []}
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record, errors = validate_record(json.loads(line))
+        except ValueError as e:
+            record, errors = None, {"non_field_errors": ["Invalid JSON: %s" % e]}
+        if errors:
+            result["errors"].append({"line": number, "errors": errors})
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            result["created"] += import_batch(batch, user)
+            batch = []
+    if batch:
+        result["created"] += import_batch(batch, user)
+    return result
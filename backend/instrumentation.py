@@ -0,0 +1,200 @@
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger("backend.slow_queries")
+
+current_metrics = ContextVar("current_metrics", default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """Prometheus histogram of observations per label values, cumulative buckets are computed on export."""
+
+    def __init__(self, name, documentation, buckets, labels=("view",)):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0, "count": 0}
+            series["buckets"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def export(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s histogram" % self.name]
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                labels = ",".join('%s="%s"' % (label, escape(value)) for label, value in zip(self.labels, label_values))
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], series["buckets"]):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, labels, bound, cumulative))
+                lines.append("%s_sum{%s} %s" % (self.name, labels, repr(float(series["sum"]))))
+                lines.append("%s_count{%s} %d" % (self.name, labels, series["count"]))
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time spent handling the request.", DURATION_BUCKETS,
+                             labels=("view", "method", "status"))
+DB_QUERIES = Histogram("db_queries_per_request", "Database queries run by the request.", QUERY_BUCKETS)
+DB_DURATION = Histogram("db_duration_seconds", "Time spent in database queries per request.", DURATION_BUCKETS)
+SERIALIZE_DURATION = Histogram("serialize_duration_seconds", "Time spent serializing data per request.",
+                               DURATION_BUCKETS)
+RENDER_DURATION = Histogram("render_duration_seconds", "Time spent rendering the response.", DURATION_BUCKETS)
+RESPONSE_SIZE = Histogram("response_size_bytes", "Size of non streaming response bodies.", SIZE_BUCKETS)
+HISTOGRAMS = [REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZE_DURATION, RENDER_DURATION, RESPONSE_SIZE]
+
+
+def export_metrics():
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.export()) + "\n"
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+class RequestMetrics:
+    """Work done by one request. Only sampled requests keep the SQL of their slow queries."""
+
+    def __init__(self, sampled=False, slow_query_threshold=0.1):
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = {}
+        self.depth = {}
+        self.sampled = sampled
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_queries = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            if self.sampled and duration >= self.slow_query_threshold:
+                self.slow_queries.append((duration, sql))
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+
+@contextmanager
+def timed(name):
+    """Adds the duration of the block to the current request's `name` timing, nested blocks count once."""
+    metrics = current_metrics.get()
+    if metrics is None or metrics.depth.get(name):
+        yield
+        return
+    metrics.depth[name] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.depth[name] = 0
+        metrics.add(name, time.perf_counter() - started)
+
+
+class TimedSerializerMixin:
+    """Counts the time spent building `.data` (queries run meanwhile included) as serialization time."""
+
+    @property
+    def data(self):
+        with timed("serialize"):
+            return super(TimedSerializerMixin, self).data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class InstrumentationMiddleware:
+    """
+    Measures every request: database queries and their time through an execute wrapper on every
+    connection, serialization and render time and the response size. The figures go into the histograms
+    exported on /metrics (per process) and, with SERVER_TIMING_ENABLED, into a Server-Timing header.
+    A SLOW_QUERY_SAMPLE_RATE share of requests logs its queries slower than SLOW_QUERY_THRESHOLD_MS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", True):
+            return self.get_response(request)
+        sample_rate = getattr(settings, "SLOW_QUERY_SAMPLE_RATE", 0.0)
+        metrics = RequestMetrics(
+            sampled=bool(sample_rate) and random.random() < sample_rate,
+            slow_query_threshold=getattr(settings, "SLOW_QUERY_THRESHOLD_MS", 100) / 1000,
+        )
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            # DRF responses are rendered right after the template response hooks ran.
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: metrics.add("render", time.perf_counter() - started))
+        return response
+
+    def report(self, request, response, metrics, duration):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        REQUEST_DURATION.observe(duration, view, request.method, str(response.status_code))
+        DB_QUERIES.observe(metrics.queries, view)
+        DB_DURATION.observe(metrics.db_time, view)
+        for name, histogram in (("serialize", SERIALIZE_DURATION), ("render", RENDER_DURATION)):
+            if name in metrics.timings:
+                histogram.observe(metrics.timings[name], view)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view)
+        if getattr(settings, "SERVER_TIMING_ENABLED", True):
+            response["Server-Timing"] = server_timing(metrics, duration)
+        for query_duration, sql in sorted(metrics.slow_queries, reverse=True)[:5]:
+            logger.warning("Slow query in %s (%.1f ms): %s", view, query_duration * 1000, sql)
+
+
+def server_timing(metrics, duration):
+    entries = ['db;dur=%.2f;desc="%d queries"' % (metrics.db_time * 1000, metrics.queries)]
+    entries += ["%s;dur=%.2f" % (name, value * 1000) for name, value in sorted(metrics.timings.items())]
+    entries.append("total;dur=%.2f" % (duration * 1000))
+    return ", ".join(entries)
@@ -0,0 +1,165 @@
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.benchmark import SyntheticDataset, percentile, throwaway_database
+from backend.models import Element
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the API endpoints against a synthetic dataset on a throwaway test database and reports "
+        "latency percentiles, throughput and query counts per scenario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--elements", type=int, default=10000)
+        parser.add_argument("--tags", type=int, default=1000)
+        parser.add_argument("--tags-per-element", type=int, default=5)
+        parser.add_argument("--zipf-exponent", type=float, default=1.0)
+        parser.add_argument("--min-description-words", type=int, default=0)
+        parser.add_argument("--max-description-words", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--requests", type=int, default=100, help="Timed requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per scenario.")
+        parser.add_argument("--scenario", action="append", dest="scenarios",
+                            help="Only run this scenario, may be repeated.")
+        parser.add_argument("--output", help="Writes the results as JSON to this file.")
+        parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        scenarios = self.scenarios()
+        names = options["scenarios"] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError("Unknown scenarios: %s. Choose from %s." % (", ".join(sorted(unknown)), ", ".join(scenarios)))
+        dataset = SyntheticDataset(
+            users=options["users"], elements=options["elements"], tags=options["tags"],
+            tags_per_element=options["tags_per_element"], zipf_exponent=options["zipf_exponent"],
+            description_words=(options["min_description_words"], options["max_description_words"]),
+            seed=options["seed"],
+        )
+        with throwaway_database(), override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"]):
+            started = time.perf_counter()
+            dataset.generate()
+            self.stdout.write("Generated the dataset in %.1f s" % (time.perf_counter() - started))
+            self.dataset = dataset
+            self.client = APIClient()
+            self.token = Token.objects.order_by("user_id").first()
+            self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+            self.own_elements = list(Element.objects.filter(user_id=self.token.user_id).values_list("id", flat=True))
+            results = {name: self.run(scenarios[name], options["requests"], options["warmup"]) for name in names}
+        report = {
+            "dataset": dataset.describe(),
+            "environment": {
+                "database": connection.vendor, "django": django.get_version(), "python": platform.python_version(),
+            },
+            "requests": options["requests"],
+            "scenarios": results,
+        }
+        self.print_report(results, self.load(options["compare"]) if options["compare"] else None)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2)
+
+    def scenarios(self):
+        """Name -> function of the request number that makes one request."""
+        return {
+            "element_list": lambda i: self.client.get(reverse("element-list")),
+            "element_list_tag_names": lambda i: self.with_tag_names(lambda: self.client.get(reverse("element-list"))),
+            "element_list_cursor": lambda i: self.client.get(reverse("element-list") + "?cursor="),
+            "tags_and": lambda i: self.client.get(reverse("element-list"), {"tags": ",".join(self.popular_tags(i, 2))}),
+            "tags_or": lambda i: self.client.get(reverse("element-list"), {"tags": "|".join(self.popular_tags(i, 3))}),
+            "tags_and_tag_names": lambda i: self.with_tag_names(lambda: self.client.get(reverse("element-list"), {
+                "tags": ",".join(self.popular_tags(i, 2))})),
+            "tags_and_count_none": lambda i: self.client.get(reverse("element-list"), {
+                "tags": ",".join(self.popular_tags(i, 2)), "count": "none"}),
+            "search": lambda i: self.client.get(reverse("element-list"), {"search": self.dataset.random.choice(
+                self.search_words)}),
+            "search_count_estimate": lambda i: self.client.get(reverse("element-list"), {
+                "search": self.dataset.random.choice(self.search_words), "count": "estimate"}),
+            "tag_list": lambda i: self.client.get(reverse("tags-list")),
+            "similar": lambda i: self.client.get(reverse("element-similar", kwargs={
+                "pk": self.own_elements[i % len(self.own_elements)]})),
+            "related_tags": lambda i: self.client.get(reverse("tags-related", kwargs={"pk": self.popular_tags(i, 1)[0]})),
+            "create_many_tags": lambda i: self.client.post(reverse("element-list"), {
+                "title": "benchmark %d" % i, "description": self.dataset.description(),
+                "tags": [{"name": name} for name in self.dataset.tag_names(30)],
+            }, format="json"),
+            "update_many_tags": lambda i: self.client.patch(
+                reverse("element-detail", kwargs={"pk": self.own_elements[i % len(self.own_elements)]}),
+                {"tags": [{"name": name} for name in self.dataset.tag_names(30)]}, format="json",
+            ),
+            "batch_update": lambda i: self.client.post(reverse("element-batch"), [
+                {"op": "update", "id": self.own_elements[(i * 20 + offset) % len(self.own_elements)], "data": {
+                    "tags": [{"name": name} for name in self.dataset.tag_names(3)]}}
+                for offset in range(min(20, len(self.own_elements)))
+            ], format="json"),
+            "me": lambda i: self.client.post(reverse("me-list"), {"key": self.token.key}),
+        }
+
+    search_words = ["action", "love", "space future", "night city"]
+
+    def with_tag_names(self, request):
+        # The same request rendered from the tag names stored on the elements instead of the taggings.
+        with override_settings(ELEMENT_TAG_NAMES_ENABLED=True):
+            return request()
+
+    def popular_tags(self, i, count):
+        # Rotates through the twenty most used tags so the scenario doesn't measure a single query plan.
+        return [self.dataset.tag_name((i + offset * 7) % min(20, self.dataset.tags)) for offset in range(count)]
+
+    def run(self, scenario, requests, warmup):
+        for i in range(warmup):
+            scenario(i)
+        timings = []
+        queries = []
+        errors = 0
+        started = time.perf_counter()
+        for i in range(warmup, warmup + requests):
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                response = scenario(i)
+                timings.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(context.captured_queries))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        return {
+            "p50_ms": percentile(timings, 50),
+            "p95_ms": percentile(timings, 95),
+            "p99_ms": percentile(timings, 99),
+            "mean_ms": sum(timings) / len(timings),
+            "throughput_rps": requests / elapsed,
+            "queries_mean": sum(queries) / len(queries),
+            "queries_max": max(queries),
+            "errors": errors,
+        }
+
+    def load(self, path):
+        with open(path) as results:
+            return json.load(results)["scenarios"]
+
+    def print_report(self, results, baseline):
+        header = "%-22s %9s %9s %9s %10s %8s %7s" % ("scenario", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries", "errors")
+        if baseline:
+            header += " %12s" % "p50 change"
+        self.stdout.write(header)
+        for name, result in results.items():
+            line = "%-22s %9.2f %9.2f %9.2f %10.1f %8.1f %7d" % (
+                name, result["p50_ms"], result["p95_ms"], result["p99_ms"], result["throughput_rps"],
+                result["queries_mean"], result["errors"],
+            )
+            if baseline and name in baseline:
+                line += " %+11.1f%%" % ((result["p50_ms"] / baseline[name]["p50_ms"] - 1) * 100)
+            self.stdout.write(line)
@@ -0,0 +1,87 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from backend.benchmark import SyntheticDataset, percentile, throwaway_database
+from backend.models import Tagging
+from backend.similar import by_score, jaccard, similar_elements, similarity_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares /api/elements/{id}/similar/ lookups with exact Jaccard similarity over every element, "
+        "on a synthetic dataset in a throwaway test database, for several LSH settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--elements", type=int, default=20000)
+        parser.add_argument("--tags", type=int, default=1000)
+        parser.add_argument("--tags-per-element", type=int, default=5)
+        parser.add_argument("--zipf-exponent", type=float, default=1.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--queries", type=int, default=200, help="Elements to look up per setting.")
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--max-candidates", type=int, default=200)
+        parser.add_argument("--lsh", action="append", help="BANDSxROWS, may be repeated (default 8x4, 16x2, 32x1).")
+
+    def handle(self, *args, **options):
+        lsh = []
+        for setting in options["lsh"] or ["8x4", "16x2", "32x1"]:
+            try:
+                bands, rows = (int(part) for part in setting.split("x"))
+            except ValueError:
+                raise CommandError("--lsh is written BANDSxROWS, like 16x2.")
+            lsh.append((bands, rows))
+        dataset = SyntheticDataset(
+            users=1, elements=options["elements"], tags=options["tags"], tags_per_element=options["tags_per_element"],
+            zipf_exponent=options["zipf_exponent"], description_words=(0, 0), seed=options["seed"],
+        )
+        limit = options["limit"]
+        with throwaway_database():
+            dataset.generate()
+            tag_sets = {}
+            for element_id, tag_id in Tagging.objects.values_list("element_id", "tag_id").iterator(chunk_size=10000):
+                tag_sets.setdefault(element_id, set()).add(tag_id)
+            queries = dataset.random.sample(sorted(tag_sets), min(options["queries"], len(tag_sets)))
+            exact, exact_ms = self.exact(queries, tag_sets, limit)
+            self.stdout.write("%-10s %10s %9s %9s %9s" % ("setting", "build s", "p50 ms", "p95 ms", "recall"))
+            self.stdout.write("%-10s %10s %9.2f %9.2f %9.3f" % (
+                "exact", "-", percentile(exact_ms, 50), percentile(exact_ms, 95), 1.0))
+            for bands, rows in lsh:
+                with override_settings(SIMILAR_INDEX_ENABLED=True, SIMILAR_BANDS=bands, SIMILAR_ROWS=rows,
+                                       SIMILAR_MAX_CANDIDATES=options["max_candidates"]):
+                    started = time.perf_counter()
+                    similarity_index.build()
+                    built = time.perf_counter() - started
+                    timings, recalls = [], []
+                    for element_id in queries:
+                        started = time.perf_counter()
+                        found = similar_elements(element_id, limit)
+                        timings.append((time.perf_counter() - started) * 1000)
+                        recalls.append(self.recall(found, exact[element_id]))
+                timings.sort()
+                self.stdout.write("%-10s %10.2f %9.2f %9.2f %9.3f" % (
+                    "%dx%d" % (bands, rows), built, percentile(timings, 50), percentile(timings, 95),
+                    sum(recalls) / len(recalls)))
+            similarity_index.clear()
+
+    def exact(self, queries, tag_sets, limit):
+        """Top limit elements by Jaccard similarity, comparing each query with every element."""
+        results, timings = {}, []
+        for element_id in queries:
+            started = time.perf_counter()
+            tags = tag_sets[element_id]
+            scores = [(other_id, jaccard(tags, other_tags)) for other_id, other_tags in tag_sets.items()
+                      if other_id != element_id]
+            results[element_id] = sorted((item for item in scores if item[1] > 0), key=by_score)[:limit]
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return results, timings
+
+    def recall(self, found, expected):
+        """Share of the exact results matched by a result at least as similar, ties are interchangeable."""
+        if not expected:
+            return 1.0
+        threshold = expected[-1][1]
+        return min(len(expected), sum(1 for element_id, score in found if score >= threshold)) / len(expected)
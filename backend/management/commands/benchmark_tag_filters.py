@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from backend.benchmark import throwaway_database, zipf_weights
+from backend.filters import matching_element_ids
+from backend.models import Tagging
+
+BEFORE = ("backend", "0009_tag_element_count")
+AFTER = ("backend", "0010_tagging_unique_indexes")
+
+
+class Command(BaseCommand):
+    help = (
+        "Times tag filter queries on a throwaway test database filled with synthetic taggings, "
+        "before and after the Tagging indexes of migration 0010."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--taggings", type=int, default=10 ** 6)
+        parser.add_argument("--tags", type=int, default=1000)
+        parser.add_argument("--tags-per-element", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--duplicates", type=float, default=0.01,
+                            help="Share of taggings inserted twice, for the migration to clean up.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        with throwaway_database():
+            self.models = self.migrate(BEFORE)
+            self.fill(options["taggings"], options["tags"], options["tags_per_element"], options["duplicates"])
+            queries = self.queries(options["tags"])
+            before = self.measure(queries, options["repeat"])
+            started = time.perf_counter()
+            self.migrate(AFTER)
+            self.stdout.write("Migration 0010 took %.1f s, %d taggings are left" % (
+                time.perf_counter() - started, Tagging.objects.count()))
+            after = self.measure(queries, options["repeat"])
+        self.stdout.write("%-28s %12s %12s %8s" % ("query (median)", "before ms", "after ms", "speedup"))
+        for name in queries:
+            self.stdout.write("%-28s %12.2f %12.2f %7.1fx" % (name, before[name], after[name], before[name] / after[name]))
+
+    def migrate(self, target):
+        """Migrates to the target and returns its historical models, the current ones may have more columns."""
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def fill(self, taggings, tags, tags_per_element, duplicates):
+        """Tag popularity follows a Zipf distribution, like real tag usage does."""
+        Tag = self.models.get_model("backend", "Tag")
+        Element = self.models.get_model("backend", "Element")
+        Tagging = self.models.get_model("backend", "Tagging")
+        Tag.objects.bulk_create([Tag(name="tag %d" % i) for i in range(tags)])
+        tag_ids = list(Tag.objects.order_by("id").values_list("id", flat=True))
+        weights = zipf_weights(tags)
+        elements = taggings // tags_per_element
+        Element.objects.bulk_create([Element(title="element %d" % i) for i in range(elements)])
+        element_ids = Element.objects.order_by("id").values_list("id", flat=True)
+        batch = []
+        for element_id in element_ids.iterator(chunk_size=10000):
+            for tag_id in set(self.random.choices(tag_ids, cum_weights=weights, k=tags_per_element)):
+                batch.append(Tagging(element_id=element_id, tag_id=tag_id))
+                if self.random.random() < duplicates:
+                    batch.append(Tagging(element_id=element_id, tag_id=tag_id))
+            if len(batch) >= 10000:
+                Tagging.objects.bulk_create(batch)
+                batch = []
+        Tagging.objects.bulk_create(batch)
+        self.stdout.write("Created %d elements and %d taggings" % (elements, Tagging.objects.count()))
+
+    def queries(self, tags):
+        ids = list(self.models.get_model("backend", "Tag").objects.order_by("id").values_list("id", flat=True))
+        popular, common, rare = ids[0], ids[min(9, tags - 1)], ids[min(tags // 2, tags - 1)]
+        return {
+            "single popular tag": [{popular}],
+            "single rare tag": [{rare}],
+            "popular AND common": [{popular}, {common}],
+            "popular AND rare": [{popular}, {rare}],
+            "(common OR rare) AND popular": [{common, rare}, {popular}],
+        }
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, groups in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(matching_element_ids(groups).values_list("element_id", flat=True))
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+        return results
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.tag_names import check_tag_names
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the tag names stored on every element (ELEMENT_TAG_NAMES_ENABLED) with its taggings, "
+        "--repair rewrites the ones that differ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=900)
+
+    def handle(self, *args, **options):
+        if not 0 < options["batch_size"] <= 900:
+            raise CommandError("--batch-size must be between 1 and 900.")
+        checked, inconsistent = check_tag_names(repair=options["repair"], batch_size=options["batch_size"])
+        if options["repair"]:
+            self.stdout.write("Checked %d elements, repaired %d." % (checked, inconsistent))
+        elif inconsistent:
+            raise CommandError("%d of %d elements have stale tag names, run with --repair." % (inconsistent, checked))
+        else:
+            self.stdout.write("Checked %d elements, all consistent." % checked)
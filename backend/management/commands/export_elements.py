@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.http import HttpRequest, QueryDict
+from rest_framework.request import Request
+
+from backend.export import CONTENT_TYPES, export_lines
+from backend.views import ElementViewSet
+
+FILTERS = ["tags", "or", "not", "search", "user", "title", "tags__name"]
+
+
+def filtered_elements(params):
+    """Runs the params through ElementViewSet's filter backends, exactly as /api/elements/ would."""
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict(mutable=True)
+    request.GET.update(params)
+    view = ElementViewSet(request=Request(request), format_kwarg=None, action="list", args=(), kwargs={})
+    return view.filter_queryset(view.get_queryset())
+
+
+class Command(BaseCommand):
+    help = "Streams elements with their user id and tag names as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(CONTENT_TYPES), default="ndjson")
+        parser.add_argument("--output", help="File to write to, standard output by default.")
+        for name in FILTERS:
+            parser.add_argument("--" + name.replace("_", "-"), dest=name, help="Same as ?%s= on /api/elements/." % name)
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in FILTERS if options[name] is not None}
+        lines = export_lines(filtered_elements(params), options["format"])
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        with open(options["output"], "w", encoding="utf-8", newline="") as output:
+            for line in lines:
+                output.write(line)
@@ -0,0 +1,30 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.importer import import_elements
+
+
+class Command(BaseCommand):
+    help = "Bulk imports NDJSON element records in transactional batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file to read, - for standard input.")
+        parser.add_argument("--user", required=True, help="Username that will own the elements.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError("There is no user called %s." % options["user"])
+        if options["path"] == "-":
+            result = import_elements(sys.stdin, user, options["batch_size"])
+        else:
+            with open(options["path"], encoding="utf-8") as lines:
+                result = import_elements(lines, user, options["batch_size"])
+        for error in result["errors"]:
+            self.stderr.write("line %d: %s" % (error["line"], json.dumps(error["errors"])))
+        self.stdout.write("Created %d elements, skipped %d records." % (result["created"], len(result["errors"])))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from backend.similar import rebuild_signatures
+
+
+class Command(BaseCommand):
+    help = "Recomputes the MinHash signatures behind /api/elements/{id}/similar/ from the taggings."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Stored the signatures of %d elements." % rebuild_signatures())
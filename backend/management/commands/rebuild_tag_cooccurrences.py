@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from backend.related import rebuild_tag_cooccurrences
+
+
+class Command(BaseCommand):
+    help = "Recomputes the tag co-occurrence counts behind /api/tags/{name}/related/ from the taggings."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Stored %d tag pairs." % rebuild_tag_cooccurrences())
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.6 on 2026-10-18 10:27
+
+from django.db import migrations
+
+INDEXES = {
+    'mysql': (
+        'CREATE FULLTEXT INDEX backend_element_fulltext ON backend_element (title, description)',
+        'DROP INDEX backend_element_fulltext ON backend_element',
+    ),
+    'postgresql': (
+        "CREATE INDEX backend_element_fulltext ON backend_element USING GIN "
+        "((to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))))",
+        'DROP INDEX backend_element_fulltext',
+    ),
+}
+
+
+def create_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute(INDEXES[schema_editor.connection.vendor][0])
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute(INDEXES[schema_editor.connection.vendor][1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.6 on 2026-10-18 10:31
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_tag_elements(apps, schema_editor):
+    Tag = apps.get_model('backend', 'Tag')
+    Tagging = apps.get_model('backend', 'Tagging')
+    counts = Tagging.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(count=Count('element')).values('count')
+    Tag.objects.update(element_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_element_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='element_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(count_tag_elements, migrations.RunPython.noop),
+    ]
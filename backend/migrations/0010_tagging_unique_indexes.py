@@ -0,0 +1,66 @@
+# Generated by Django 3.0.6 on 2026-10-18 14:05
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def delete_duplicate_taggings(apps, schema_editor):
+    """Keeps the oldest row of every (element, tag) pair, deleting the others in short transactions."""
+    Tag = apps.get_model('backend', 'Tag')
+    Tagging = apps.get_model('backend', 'Tagging')
+    duplicates = (
+        Tagging.objects.order_by().values('element_id', 'tag_id')
+        .annotate(rows=Count('id')).filter(rows__gt=1).values_list('element_id', 'tag_id')
+    )
+    duplicates = list(duplicates)
+    element_ids = sorted({element_id for element_id, tag_id in duplicates})
+    for start in range(0, len(element_ids), BATCH_SIZE):
+        with transaction.atomic():
+            rows = Tagging.objects.filter(element_id__in=element_ids[start:start + BATCH_SIZE]).order_by('id')
+            seen = set()
+            extra = []
+            for tagging_id, element_id, tag_id in rows.values_list('id', 'element_id', 'tag_id'):
+                if (element_id, tag_id) in seen:
+                    extra.append(tagging_id)
+                seen.add((element_id, tag_id))
+            Tagging.objects.filter(id__in=extra).delete()
+    counts = Tagging.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(count=Count('element')).values('count')
+    Tag.objects.filter(id__in={tag_id for element_id, tag_id in duplicates}).update(
+        element_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+    # Every batch of duplicates commits on its own instead of locking the table for the whole run. Running
+    # servers can write new duplicates until AddConstraint, which then fails before changing the schema:
+    # migrating again deletes them too, stopping the writers first closes the window.
+    atomic = False
+
+    dependencies = [
+        ('backend', '0009_tag_element_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_taggings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tagging',
+            constraint=models.UniqueConstraint(fields=('element', 'tag'), name='backend_tagging_element_tag_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='tagging',
+            index=models.Index(fields=['tag', 'element'], name='backend_tagging_tag_element'),
+        ),
+        migrations.AlterField(
+            model_name='tagging',
+            name='element',
+            field=models.ForeignKey(db_index=False, on_delete=models.deletion.CASCADE, to='backend.Element'),
+        ),
+        migrations.AlterField(
+            model_name='tagging',
+            name='tag',
+            field=models.ForeignKey(db_index=False, on_delete=models.deletion.CASCADE, to='backend.Tag'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.6 on 2026-10-18 11:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_cooccurrences(apps, schema_editor):
+    TagCooccurrence = apps.get_model('backend', 'TagCooccurrence')
+    Tagging = apps.get_model('backend', 'Tagging')
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        'INSERT INTO %s (tag_id, other_id, %s, %s) '
+        'SELECT a.tag_id, b.tag_id, a.tag_id * 4294967296 + b.tag_id, COUNT(*) '
+        'FROM %s a INNER JOIN %s b ON a.element_id = b.element_id AND a.tag_id <> b.tag_id '
+        'GROUP BY a.tag_id, b.tag_id' % (
+            quote(TagCooccurrence._meta.db_table), quote('key'), quote('count'),
+            quote(Tagging._meta.db_table), quote(Tagging._meta.db_table),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_tagging_unique_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCooccurrence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.Tag')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.Tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagcooccurrence',
+            index=models.Index(fields=['tag', '-count', 'other'], name='backend_tagco_tag_count'),
+        ),
+        migrations.RunPython(count_cooccurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.0.6 on 2026-10-18 11:23
+
+import random
+import struct
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Copies of backend.similar as of this migration, so the signatures it writes don't follow later changes there.
+SIGNATURE_SIZE = 32
+PRIME = 2 ** 61 - 1
+
+
+def hash_parameters(count, seed=0):
+    generator = random.Random(seed)
+    return [(generator.randrange(1, PRIME), generator.randrange(PRIME)) for _ in range(count)]
+
+
+HASHES = hash_parameters(SIGNATURE_SIZE)
+
+
+def signature(tag_ids):
+    return tuple(min((a * tag_id + b) % PRIME for tag_id in tag_ids) for a, b in HASHES)
+
+
+def pack(minhashes):
+    return struct.pack("<%dq" % len(minhashes), *minhashes)
+
+
+def compute_signatures(apps, schema_editor):
+    ElementSignature = apps.get_model('backend', 'ElementSignature')
+    Tagging = apps.get_model('backend', 'Tagging')
+    taggings = Tagging.objects.order_by('element_id').values_list('element_id', 'tag_id').iterator(chunk_size=10000)
+    signatures = []
+    for element_id, rows in groupby(taggings, key=itemgetter(0)):
+        minhashes = signature({tag_id for tagged_id, tag_id in rows})
+        signatures.append(ElementSignature(element_id=element_id, minhashes=pack(minhashes)))
+        if len(signatures) >= 10000:
+            ElementSignature.objects.bulk_create(signatures)
+            signatures = []
+    ElementSignature.objects.bulk_create(signatures)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_tag_cooccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElementSignature',
+            fields=[
+                ('element', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='backend.Element')),
+                ('minhashes', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(compute_signatures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,133 @@
+# Generated by Django 3.0.6 on 2026-10-18 12:05
+
+import random
+import struct
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 500
+
+# Copies of backend.similar as of this migration, so the signatures it writes don't follow later changes there.
+SIGNATURE_SIZE = 32
+PRIME = 2 ** 61 - 1
+
+
+def hash_parameters(count, seed=0):
+    generator = random.Random(seed)
+    return [(generator.randrange(1, PRIME), generator.randrange(PRIME)) for _ in range(count)]
+
+
+HASHES = hash_parameters(SIGNATURE_SIZE)
+
+
+def signature(tag_ids):
+    return tuple(min((a * tag_id + b) % PRIME for tag_id in tag_ids) for a, b in HASHES)
+
+
+def pack(minhashes):
+    return struct.pack("<%dq" % len(minhashes), *minhashes)
+
+
+# Copy of backend.models.normalize_tag_name as of this migration.
+def normalize_tag_name(name):
+    return name.casefold() if getattr(settings, "TAGGIT_CASE_INSENSITIVE", False) else name
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """
+    Keys every tag and merges tags whose names only differ in case into the oldest of them: the taggings
+    move over unless the element already has that tag, then the counts, pairs and signatures are recomputed.
+    The taggings and signatures are rewritten in short transactions.
+    """
+    Tag = apps.get_model('backend', 'Tag')
+    Tagging = apps.get_model('backend', 'Tagging')
+    TagCooccurrence = apps.get_model('backend', 'TagCooccurrence')
+    ElementSignature = apps.get_model('backend', 'ElementSignature')
+    Version = apps.get_model('backend', 'Version')
+    keepers = {}
+    merged = {}
+    for tag_id, name in Tag.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=10000):
+        key = normalize_tag_name(name)
+        if key in keepers:
+            merged[tag_id] = keepers[key]
+        else:
+            keepers[key] = tag_id
+    elements = set()
+    for duplicate, keeper in merged.items():
+        duplicate_elements = list(Tagging.objects.filter(tag_id=duplicate).values_list('element_id', flat=True))
+        elements.update(duplicate_elements)
+        for start in range(0, len(duplicate_elements), BATCH_SIZE):
+            batch = duplicate_elements[start:start + BATCH_SIZE]
+            with transaction.atomic():
+                # Read first: MySQL refuses a DELETE whose subquery reads the table it deletes from.
+                tagged = Tagging.objects.filter(tag_id=keeper, element_id__in=batch)
+                tagged = list(tagged.values_list('element_id', flat=True))
+                Tagging.objects.filter(tag_id=duplicate, element_id__in=tagged).delete()
+                Tagging.objects.filter(tag_id=duplicate, element_id__in=batch).update(tag_id=keeper)
+    if merged:
+        TagCooccurrence.objects.all().delete()
+        duplicates = list(merged)
+        for start in range(0, len(duplicates), BATCH_SIZE):
+            Tag.objects.filter(id__in=duplicates[start:start + BATCH_SIZE]).delete()
+    tags = [Tag(id=tag_id, key=key) for key, tag_id in keepers.items()]
+    for start in range(0, len(tags), BATCH_SIZE):
+        Tag.objects.bulk_update(tags[start:start + BATCH_SIZE], ['key'])
+    if not merged:
+        return
+    counts = Tagging.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(count=Count('element')).values('count')
+    keeper_ids = sorted(set(merged.values()))
+    for start in range(0, len(keeper_ids), BATCH_SIZE):
+        Tag.objects.filter(id__in=keeper_ids[start:start + BATCH_SIZE]).update(
+            element_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+        )
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        'INSERT INTO %s (tag_id, other_id, %s, %s) '
+        'SELECT a.tag_id, b.tag_id, a.tag_id * 4294967296 + b.tag_id, COUNT(*) '
+        'FROM %s a INNER JOIN %s b ON a.element_id = b.element_id AND a.tag_id <> b.tag_id '
+        'GROUP BY a.tag_id, b.tag_id' % (
+            quote(TagCooccurrence._meta.db_table), quote('key'), quote('count'),
+            quote(Tagging._meta.db_table), quote(Tagging._meta.db_table),
+        )
+    )
+    elements = sorted(elements)
+    for start in range(0, len(elements), BATCH_SIZE):
+        batch = elements[start:start + BATCH_SIZE]
+        tag_ids = {}
+        for element_id, tag_id in Tagging.objects.filter(element_id__in=batch).values_list('element_id', 'tag_id'):
+            tag_ids.setdefault(element_id, set()).add(tag_id)
+        with transaction.atomic():
+            ElementSignature.objects.filter(element_id__in=batch).delete()
+            ElementSignature.objects.bulk_create(
+                ElementSignature(element_id=element_id, minhashes=pack(signature(tags)))
+                for element_id, tags in tag_ids.items()
+            )
+    # Cached responses and the process local indexes of running servers hold the merged tags.
+    Version.objects.filter(name__in=['tags', 'taggings']).update(value=F('value') + 1)
+
+
+class Migration(migrations.Migration):
+    # Every batch of merged taggings commits on its own instead of locking the tables for the whole run.
+    atomic = False
+
+    dependencies = [
+        ('backend', '0012_element_signature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='key',
+            field=models.CharField(max_length=765, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='key',
+            field=models.CharField(max_length=765, unique=True),
+        ),
+    ]
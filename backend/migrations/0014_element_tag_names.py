@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_tag_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='element',
+            name='tag_names',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.6 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_element_tag_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('version', models.BigIntegerField()),
+                ('data', models.TextField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='versionchange',
+            constraint=models.UniqueConstraint(fields=('name', 'version'), name='backend_versionchange_name_version_uniq'),
+        ),
+    ]
@@ -2,20 +2,107 @@ from django.db import models
 from django.conf import settings
 
 
+def normalize_tag_name(name):
+    """The key tags are matched on: names differing only in case are the same tag with TAGGIT_CASE_INSENSITIVE."""
+    return name.casefold() if getattr(settings, "TAGGIT_CASE_INSENSITIVE", False) else name
+
+
+class TagQuerySet(models.QuerySet):
+    def ids_for_names(self, names):
+        """
+        Returns {name: tag id} for the names matching a tag through its key, missing names are left out.
+        Always queries, backend.tag_cache.ids_for_names answers from the process' cache first.
+        """
+        keys = {name: normalize_tag_name(name) for name in set(names)}
+        ids = self.ids_for_keys(keys.values())
+        return {name: ids[key] for name, key in keys.items() if key in ids}
+
+    def ids_for_keys(self, keys):
+        """Returns {key: tag id} of the normalized keys that have a tag."""
+        return dict(self.filter(key__in=set(keys)).values_list("key", "id"))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for tag in objs:
+            tag.key = normalize_tag_name(tag.name)
+        return super(TagQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=255, unique=True)
+    # normalize_tag_name(name), casefold() makes a name up to three times longer.
+    key = models.CharField(max_length=765, unique=True)
+    element_count = models.IntegerField(default=0, db_index=True)
+
+    objects = TagQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.key = normalize_tag_name(self.name)
+        super(Tag, self).save(*args, **kwargs)
+
 
 class Element(models.Model):
     description = models.CharField(null=True, blank=True, max_length=10000)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="elements", null=True)
     title = models.CharField(null=True, blank=True, max_length=500)
     tags = models.ManyToManyField('Tag', through="Tagging")
+    # JSON array of the tag names in name order, kept by backend.tag_names with ELEMENT_TAG_NAMES_ENABLED.
+    # None when unknown, readers then fall back to the taggings.
+    tag_names = models.TextField(null=True, blank=True)
 
 
 class Tagging(models.Model):
-    element = models.ForeignKey('Element', on_delete=models.CASCADE)
-    tag = models.ForeignKey('Tag', on_delete=models.CASCADE)
+    # Both columns are covered by the composite indexes below, which also serve the foreign keys.
+    element = models.ForeignKey('Element', on_delete=models.CASCADE, db_index=False)
+    tag = models.ForeignKey('Tag', on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['element', 'tag'], name='backend_tagging_element_tag_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'element'], name='backend_tagging_tag_element'),
+        ]
+
+
+class TagCooccurrence(models.Model):
+    """How many elements carry both tag and other, stored in both directions."""
+    tag = models.ForeignKey('Tag', on_delete=models.CASCADE, related_name='+', db_index=False)
+    other = models.ForeignKey('Tag', on_delete=models.CASCADE, related_name='+')
+    # tag_id * 2**32 + other_id, one indexed column that inserts ignoring conflicts and updates can match on.
+    key = models.BigIntegerField(unique=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tag', '-count', 'other'], name='backend_tagco_tag_count'),
+        ]
+
+
+class ElementSignature(models.Model):
+    """MinHash signature of the element's tag ids, see backend.similar. Elements without tags have none."""
+    element = models.OneToOneField('Element', on_delete=models.CASCADE, primary_key=True, related_name='+')
+    minhashes = models.BinaryField()
+
+
+class Version(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "%s@%d" % (self.name, self.value)
+
+
+class VersionChange(models.Model):
+    """JSON description of what changed with one value of a Version counter, see backend.versions."""
+    name = models.CharField(max_length=64)
+    version = models.BigIntegerField()
+    data = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'version'], name='backend_versionchange_name_version_uniq'),
+        ]
@@ -0,0 +1,148 @@
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max, Min, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from backend.cache import normalized_params
+
+COUNT_MODES = ("exact", "none", "cached", "estimate")
+
+
+def estimate_count(queryset, exact_limit, sample_size):
+    """
+    Returns (count, approximate). Counts up to exact_limit rows exactly, beyond that counts the matches
+    among the sample_size latest rows by primary key and scales them to the whole id range. Every query
+    reads a bounded number of rows, unless few rows match and the capped count has to look at them all.
+    """
+    queryset = queryset.order_by()
+    count = queryset.values("pk")[:exact_limit + 1].count()
+    if count <= exact_limit:
+        return count, False
+    ids = queryset.model._default_manager.order_by("-pk").values_list("pk", flat=True)
+    boundary = list(ids[sample_size - 1:sample_size])
+    if not boundary:
+        return queryset.count(), False
+    bounds = queryset.model._default_manager.aggregate(first=Min("pk"), last=Max("pk"))
+    matches = queryset.filter(pk__gte=boundary[0]).count()
+    scale = (bounds["last"] - bounds["first"] + 1) / (bounds["last"] - boundary[0] + 1)
+    return max(exact_limit + 1, int(round(matches * scale))), True
+
+
+class KeysetPagination(CursorPagination):
+    """Pages with WHERE key > cursor on the view's `cursor_ordering`, so deep pages cost as much as the first one."""
+    ordering = "id"
+    page_size_query_param = "limit"
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, "filter_backends", []):
+            if issubclass(backend, OrderingFilter) and backend.ordering_param in request.query_params:
+                return super(KeysetPagination, self).get_ordering(request, queryset, view)
+        ordering = getattr(view, "cursor_ordering", self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination unless the client sends ?cursor= (empty for the first page) to use keyset paging.
+
+    ?count= picks how the total is found: exact counts every matching row, none skips the count, cached
+    reuses a count of the same filters for COUNT_CACHE_TIMEOUT seconds and estimate extrapolates from a
+    sample (see estimate_count). The last two add an approximate flag. The default is the view's
+    count_mode, or the PAGINATION_COUNT_MODES setting for the view's basename. Except for exact, the
+    page is read with one more row to know whether there is a next one, and the last page gives the
+    exact count for free.
+    """
+    cursor_query_param = KeysetPagination.cursor_query_param
+    count_query_param = "count"
+    keyset_pagination = None
+    count_mode = "exact"
+    approximate = False
+
+    def uses_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def get_count_mode(self, request, view):
+        mode = request.query_params.get(self.count_query_param)
+        if mode is None:
+            default = getattr(view, "count_mode", "exact")
+            return getattr(settings, "PAGINATION_COUNT_MODES", {}).get(getattr(view, "basename", None), default)
+        if mode not in COUNT_MODES:
+            raise ValidationError(detail="Count must be one of: " + ", ".join(COUNT_MODES))
+        return mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.uses_cursor(request):
+            self.keyset_pagination = KeysetPagination()
+            return self.keyset_pagination.paginate_queryset(queryset, request, view)
+        self.count_mode = self.get_count_mode(request, view)
+        # Lists are counted for free.
+        if self.count_mode == "exact" or not isinstance(queryset, QuerySet):
+            self.count_mode = "exact"
+            return super(LimitOffsetOrCursorPagination, self).paginate_queryset(queryset, request, view)
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.request = request
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        if self.count_mode == "none":
+            self.count = None
+        elif not self.has_next and (page or self.offset == 0):
+            self.count = self.offset + len(page)
+        elif self.count_mode == "cached":
+            self.count, self.approximate = self.cached_count(queryset, request, view)
+        else:
+            self.count, self.approximate = estimate_count(
+                queryset, getattr(settings, "COUNT_ESTIMATE_EXACT_LIMIT", 1000),
+                getattr(settings, "COUNT_ESTIMATE_SAMPLE_SIZE", 10000),
+            )
+        return page
+
+    def cached_count(self, queryset, request, view):
+        """Returns (count, approximate), approximate when the count comes from the cache and may be stale."""
+        cache = caches[getattr(settings, "COUNT_CACHE_ALIAS", "default")]
+        params = normalized_params(request, excluded={
+            self.limit_query_param, self.offset_query_param, self.count_query_param, "format",
+        })
+        parts = [getattr(view, "basename", ""), request.path, repr(params)]
+        key = "count:" + hashlib.sha1("\n".join(parts).encode()).hexdigest()
+        count = cache.get(key)
+        if count is not None:
+            return count, True
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, "COUNT_CACHE_TIMEOUT", 60))
+        return count, False
+
+    def get_next_link(self):
+        if self.count_mode == "exact":
+            return super(LimitOffsetOrCursorPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        if self.keyset_pagination:
+            return self.keyset_pagination.get_paginated_response(data)
+        if self.count_mode == "exact":
+            return super(LimitOffsetOrCursorPagination, self).get_paginated_response(data)
+        fields = [("count", self.count)]
+        if self.count_mode != "none":
+            fields.append(("approximate", self.approximate))
+        fields += [("next", self.get_next_link()), ("previous", self.get_previous_link()), ("results", data)]
+        return Response(OrderedDict(fields))
+
+    def to_html(self):
+        if self.keyset_pagination:
+            return self.keyset_pagination.to_html()
+        return super(LimitOffsetOrCursorPagination, self).to_html()
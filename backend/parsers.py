@@ -0,0 +1,9 @@
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Hands the view an iterator over the request body's lines instead of reading it all at once."""
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return iter(stream) if stream is not None else iter(())
@@ -0,0 +1,129 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.dispatch import receiver
+
+from backend.models import TagCooccurrence, Tagging
+from backend.signals import taggings_changed
+
+KEY_SHIFT = 2 ** 32
+# Every element id is passed twice, this keeps a statement below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 400
+# Added taggings are passed four times along with their elements.
+ADDED_BATCH_SIZE = 150
+KEYS_BATCH_SIZE = 900
+
+PAIRS_SQL = """
+FROM {tagging} a INNER JOIN {tagging} b ON a.element_id = b.element_id AND a.tag_id <> b.tag_id
+WHERE a.element_id IN ({elements}){added}
+"""
+INSERT_SQL = """
+{insert} {cooccurrence} (tag_id, other_id, {key}, {count})
+SELECT DISTINCT a.tag_id, b.tag_id, a.tag_id * {shift} + b.tag_id, 0 {pairs} {suffix}
+"""
+INCREMENT_SQL = """
+UPDATE {cooccurrence} SET {count} = {count} + (
+    SELECT COUNT(*) {pairs} AND a.tag_id = {cooccurrence}.tag_id AND b.tag_id = {cooccurrence}.other_id
+)
+WHERE {key} IN (SELECT a.tag_id * {shift} + b.tag_id {pairs})
+"""
+REBUILD_SQL = """
+INSERT INTO {cooccurrence} (tag_id, other_id, {key}, {count})
+SELECT a.tag_id, b.tag_id, a.tag_id * {shift} + b.tag_id, COUNT(*)
+FROM {tagging} a INNER JOIN {tagging} b ON a.element_id = b.element_id AND a.tag_id <> b.tag_id
+GROUP BY a.tag_id, b.tag_id
+"""
+
+
+def format_sql(sql, **kwargs):
+    quote = connection.ops.quote_name
+    return sql.format(
+        cooccurrence=quote(TagCooccurrence._meta.db_table), tagging=quote(Tagging._meta.db_table),
+        key=quote("key"), count=quote("count"), shift=KEY_SHIFT, **kwargs
+    )
+
+
+def add_pairs(element_ids, added=None):
+    """
+    Counts the pairs of the current taggings of the elements, only those involving one of the added
+    (element id, tag id) taggings when added is given: missing rows are inserted first, ignoring
+    conflicts with concurrent writers.
+    """
+    params = list(element_ids)
+    condition = ""
+    if added is not None:
+        keys = [element_id * KEY_SHIFT + tag_id for element_id, tag_id in added]
+        condition = (
+            " AND (a.element_id * {shift} + a.tag_id IN ({keys}) OR b.element_id * {shift} + b.tag_id IN ({keys}))"
+        ).format(shift=KEY_SHIFT, keys=", ".join(["%s"] * len(keys)))
+        params += keys * 2
+    pairs = format_sql(PAIRS_SQL, elements=", ".join(["%s"] * len(element_ids)), added=condition)
+    with connection.cursor() as cursor:
+        cursor.execute(format_sql(
+            INSERT_SQL, pairs=pairs, insert=connection.ops.insert_statement(ignore_conflicts=True),
+            suffix=connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+        ), params)
+        cursor.execute(format_sql(INCREMENT_SQL, pairs=pairs), params * 2)
+
+
+def lost_pairs(changes):
+    """Returns {pair key: number of elements that no longer have both tags} for taggings_changed changes."""
+    lost = Counter()
+    for element_id, before, after in changes:
+        removed = before - after
+        for tag_id in removed:
+            for other_id in before - {tag_id}:
+                lost[tag_id * KEY_SHIFT + other_id] += 1
+                # Pairs of two removed tags are counted from both sides already.
+                if other_id not in removed:
+                    lost[other_id * KEY_SHIFT + tag_id] += 1
+    return lost
+
+
+def remove_pairs(lost):
+    keys_by_count = {}
+    for key, count in lost.items():
+        keys_by_count.setdefault(count, []).append(key)
+    for count, keys in keys_by_count.items():
+        for start in range(0, len(keys), KEYS_BATCH_SIZE):
+            TagCooccurrence.objects.filter(key__in=keys[start:start + KEYS_BATCH_SIZE]).update(count=F("count") - count)
+
+
+@receiver(taggings_changed)
+def update_tag_cooccurrences(sender, changes, **kwargs):
+    """
+    Applies the changes in the writing transaction, with statements whose number depends on the
+    changed elements and taggings but hardly on the number of tags of an element: new elements are
+    counted in batches, the taggings added to other elements too, and the lost pairs are decremented
+    by key. Pairs dropping to zero stay until the next rebuild, queries skip them.
+    """
+    created = [element_id for element_id, before, after in changes if not before]
+    for start in range(0, len(created), BATCH_SIZE):
+        add_pairs(created[start:start + BATCH_SIZE])
+    added = [(element_id, tag_id) for element_id, before, after in changes if before for tag_id in after - before]
+    for start in range(0, len(added), ADDED_BATCH_SIZE):
+        batch = added[start:start + ADDED_BATCH_SIZE]
+        add_pairs(sorted({element_id for element_id, tag_id in batch}), batch)
+    remove_pairs(lost_pairs(changes))
+
+
+def rebuild_tag_cooccurrences():
+    """Recomputes every pair from the taggings with one INSERT ... SELECT, returns the number of pairs."""
+    with transaction.atomic():
+        TagCooccurrence.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(format_sql(REBUILD_SQL))
+        return TagCooccurrence.objects.count()
+
+
+def related_tags(tag, limit):
+    """Returns the tags most often used together with tag: name, shared elements and their share of tag's elements."""
+    rows = (
+        TagCooccurrence.objects.filter(tag=tag, count__gt=0).order_by("-count", "other_id")
+        .values_list("other__name", "count")[:limit]
+    )
+    return [
+        {"name": name, "count": count, "score": round(count / tag.element_count, 4) if tag.element_count else 0.0}
+        for name, count in rows
+    ]
@@ -0,0 +1,30 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, without it this is DRF's renderer.
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Writes compact JSON with orjson when it is installed, producing the same bytes as JSONRenderer:
+    non ASCII characters unescaped except U+2028 and U+2029, and every type orjson doesn't handle the
+    same way (datetimes, decimals, lazy strings...) goes through DRF's encoder. Indented output and
+    integers beyond 64 bits are left to JSONRenderer. Floats are the exception: orjson writes 1.5e-7 where
+    json writes 1.5e-07, and NaN as null where strict JSONRenderer fails. The only floats, related tag
+    scores, are rounded to four decimals and never written with an exponent.
+    """
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+               if orjson else 0)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
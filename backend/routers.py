@@ -0,0 +1,170 @@
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+# Alias the ORM reads from in the current request, None reads from the primary.
+read_alias = ContextVar("read_alias", default=None)
+
+
+@contextmanager
+def use_database(alias):
+    token = read_alias.set(alias)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def use_primary():
+    return use_database(None)
+
+
+class ReplicaRouter:
+    """Reads go to the database picked for the request by ReplicaMiddleware, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+class ReplicaHealth:
+    """Replicas failing to connect or to answer are left out for REPLICA_RETRY_INTERVAL seconds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.down_until = {}
+
+    def is_up(self, alias):
+        with self.lock:
+            return self.down_until.get(alias, 0) <= time.monotonic()
+
+    def mark_down(self, alias):
+        with self.lock:
+            self.down_until[alias] = time.monotonic() + getattr(settings, "REPLICA_RETRY_INTERVAL", 30)
+
+    def reset(self):
+        with self.lock:
+            self.down_until = {}
+
+
+replica_health = ReplicaHealth()
+
+
+def choose_replica():
+    """
+    Picks one of the REPLICA_DATABASES ({alias: weight}) at random in proportion to its weight, among
+    those that are up and accept a connection. Returns None when there is none, reads then go to the primary.
+    """
+    replicas = {alias: weight for alias, weight in getattr(settings, "REPLICA_DATABASES", {}).items()
+                if weight > 0 and replica_health.is_up(alias)}
+    while replicas:
+        alias = random.choices(list(replicas), weights=list(replicas.values()))[0]
+        try:
+            connections[alias].ensure_connection()
+            return alias
+        except DatabaseError:
+            replica_health.mark_down(alias)
+            del replicas[alias]
+    return None
+
+
+class ReplicaPins:
+    """
+    Clients that just wrote read from the primary for REPLICA_PIN_SECONDS, so they see their writes
+    whatever the replication lag. A client is its Authorization header, else its session, else its address.
+    Pins live in the REPLICA_PIN_CACHE_ALIAS cache, which has to be shared for pins to hold across processes.
+    """
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "REPLICA_PIN_CACHE_ALIAS", None) or "default"]
+
+    def check(self):
+        alias = getattr(settings, "REPLICA_PIN_CACHE_ALIAS", None)
+        if not alias:
+            raise ImproperlyConfigured("Read replicas need REPLICA_PIN_CACHE_ALIAS, a cache shared by the workers.")
+        if isinstance(caches[alias], (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured(
+                "The REPLICA_PIN_CACHE_ALIAS cache %r isn't shared by the workers, pins would only hold in the "
+                "worker that served the write." % alias
+            )
+
+    def key(self, request):
+        client = (request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                  or request.META.get("REMOTE_ADDR", ""))
+        return "replica-pin:" + hashlib.sha1(client.encode()).hexdigest()
+
+    def pin(self, request):
+        self.cache.set(self.key(request), True, getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+    def is_pinned(self, request):
+        return self.cache.get(self.key(request)) is not None
+
+
+replica_pins = ReplicaPins()
+
+
+class ReplicaMiddleware:
+    """
+    Serves safe methods from a replica chosen per request, unless the client is pinned to the primary.
+    Other methods run on the primary and pin the client. A safe request losing its replica's connection
+    marks the replica down and runs again on the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if getattr(settings, "REPLICA_DATABASES", None):
+            replica_pins.check()
+
+    def __call__(self, request):
+        if not getattr(settings, "REPLICA_DATABASES", None):
+            return self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            try:
+                return self.get_response(request)
+            finally:
+                replica_pins.pin(request)
+        alias = None if replica_pins.is_pinned(request) else choose_replica()
+        request.read_alias = alias
+        with use_database(alias):
+            response = self.get_response(request)
+        if alias and response.streaming:
+            response.streaming_content = self.stream_from(alias, response.streaming_content)
+        return response
+
+    def stream_from(self, alias, content):
+        # Streaming bodies query the database while they are sent, after the request returned, maybe from
+        # other threads: every part is read with the alias set around that read only.
+        parts = iter(content)
+        while True:
+            with use_database(alias):
+                part = next(parts, None)
+            if part is None:
+                return
+            yield part
+
+    def process_exception(self, request, exception):
+        alias = getattr(request, "read_alias", None)
+        if alias is None or not isinstance(exception, (InterfaceError, OperationalError)):
+            return None
+        replica_health.mark_down(alias)
+        request.read_alias = None
+        with use_primary():
+            return self.get_response(request)
@@ -0,0 +1,201 @@
+import math
+import re
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+from backend.models import Element
+from backend.signals import element_changed, element_changes
+from backend.versions import ELEMENTS, VersionedIndex
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def element_text(title, description):
+    return (title or "") + " " + (description or "")
+
+
+def order_by_ids(queryset, ids):
+    if not ids:
+        return queryset.none()
+    ranking = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(ranking)
+
+
+def contains_all(queryset, terms):
+    return queryset.filter(reduce(lambda q, term: q & (Q(title__icontains=term) | Q(description__icontains=term)),
+                                  terms, Q()))
+
+
+class DatabaseSearchBackend:
+    """
+    Uses the database's own full-text index (see migration 0008): MATCH ... AGAINST on MySQL and
+    tsvector on PostgreSQL, every term has to match and results come most relevant first.
+    Other databases fall back to icontains.
+    """
+    mysql_min_token_size = 3
+    postgresql_document = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+    def search(self, queryset, terms):
+        tokens = [token for term in terms for token in tokenize(term)]
+        if not tokens:
+            return contains_all(queryset, terms)
+        if connection.vendor == "mysql":
+            return self.search_mysql(queryset, tokens)
+        if connection.vendor == "postgresql":
+            return self.search_postgresql(queryset, tokens)
+        return contains_all(queryset, terms)
+
+    def search_mysql(self, queryset, tokens):
+        short = [token for token in tokens if len(token) < self.mysql_min_token_size]
+        indexed = [token for token in tokens if len(token) >= self.mysql_min_token_size]
+        if short:
+            queryset = contains_all(queryset, short)
+        if not indexed:
+            return queryset
+        match = "MATCH (backend_element.title, backend_element.description) AGAINST (%s IN BOOLEAN MODE)"
+        query = " ".join("+" + token for token in indexed)
+        return queryset.extra(
+            select={"relevance": match}, select_params=[query], where=[match], params=[query], order_by=["-relevance"]
+        )
+
+    def search_postgresql(self, queryset, tokens):
+        query = " & ".join(tokens)
+        return queryset.extra(
+            select={"relevance": "ts_rank(" + self.postgresql_document + ", to_tsquery('simple', %s))"},
+            select_params=[query],
+            where=[self.postgresql_document + " @@ to_tsquery('simple', %s)"],
+            params=[query],
+            order_by=["-relevance"],
+        )
+
+
+class TokenIndex(VersionedIndex):
+    """Process local inverted index of token -> {element id: term frequency}, ranked with BM25."""
+    version_name = ELEMENTS
+    check_interval_setting = "SEARCH_INDEX_CHECK_INTERVAL"
+    k1 = 1.2
+    b = 0.75
+
+    def is_enabled(self):
+        return uses_local_index()
+
+    def reset(self):
+        self.postings = {}
+        self.tokens = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def load(self):
+        elements = Element.objects.order_by().values_list("id", "title", "description")
+        for element_id, title, description in elements.iterator(chunk_size=2000):
+            self.add(element_id, element_text(title, description))
+
+    def add(self, element_id, text):
+        tokens = tokenize(text)
+        for token in tokens:
+            frequencies = self.postings.setdefault(token, {})
+            frequencies[element_id] = frequencies.get(element_id, 0) + 1
+        self.tokens[element_id] = set(tokens)
+        self.lengths[element_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, element_id):
+        if element_id not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(element_id)
+        for token in self.tokens.pop(element_id):
+            frequencies = self.postings[token]
+            del frequencies[element_id]
+            if not frequencies:
+                del self.postings[token]
+
+    def change(self, element_id, text):
+        self.remove(element_id)
+        if text is not None:
+            self.add(element_id, text)
+
+    def replay(self, name, changes):
+        for change in changes:
+            self.change_texts(change)
+
+    def change_texts(self, change):
+        """Applies element_changes() of the signals, [[element id, title, description] or [element id]]."""
+        for element_id, *texts in change:
+            self.change(element_id, element_text(*texts) if texts else None)
+
+    def rank(self, tokens):
+        self.ensure_fresh()
+        with self.lock:
+            postings = [self.postings.get(token, {}) for token in set(tokens)]
+            if not postings or not all(postings):
+                return []
+            postings.sort(key=len)
+            matches = [element_id for element_id in postings[0] if all(element_id in other for other in postings[1:])]
+            documents = len(self.lengths)
+            average_length = self.total_length / documents if documents else 0
+            scores = {}
+            for frequencies in postings:
+                idf = math.log(1 + (documents - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+                for element_id in matches:
+                    frequency = frequencies[element_id]
+                    norm = 1 - self.b + self.b * self.lengths[element_id] / average_length if average_length else 1
+                    scores[element_id] = scores.get(element_id, 0) + idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * norm)
+            return sorted(matches, key=lambda element_id: (-scores[element_id], element_id))
+
+
+token_index = TokenIndex()
+
+
+class LocalSearchBackend:
+    """Answers searches from the in-process TokenIndex, every term has to match and results come most relevant first."""
+    index = token_index
+
+    def search(self, queryset, terms):
+        tokens = [token for term in terms for token in tokenize(term)]
+        if not tokens:
+            return contains_all(queryset, terms)
+        return order_by_ids(queryset, self.index.rank(tokens))
+
+
+def get_search_backend_class():
+    return import_string(getattr(settings, "SEARCH_BACKEND", "backend.search.DatabaseSearchBackend"))
+
+
+def get_search_backend():
+    return get_search_backend_class()()
+
+
+def uses_local_index():
+    return issubclass(get_search_backend_class(), LocalSearchBackend)
+
+
+def warm_up():
+    if uses_local_index():
+        token_index.build()
+
+
+@receiver(element_changed)
+def update_token_index(sender, elements, deleted, version, **kwargs):
+    if uses_local_index():
+        token_index.apply_on_commit(version, token_index.change_texts, element_changes(elements, deleted))
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """Same ?search= parameter as DRF's SearchFilter, answered by the configured SEARCH_BACKEND."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_search_backend().search(queryset, terms)
@@ -1,24 +1,35 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from backend.models import Element, Tag, Tagging
+from backend.instrumentation import TimedListSerializer, TimedSerializerMixin, timed
+from backend.models import Element, Tag
+from backend.tag_names import element_tag_names, initial_tag_names, stored_tag_names
+from backend.tagging import set_element_tags, split_tag_changes
 
 User = get_user_model()
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     to_delete = serializers.BooleanField(required=False, default=False)
 
     class Meta:
         model = Tag
         fields = ['name', 'to_delete']
+        list_serializer_class = TimedListSerializer
         extra_kwargs = {
             'name': {'required': True, 'validators': []}
         }
 
 
-class AbstractModelSerializer(serializers.ModelSerializer):
+class TagDetailSerializer(TagSerializer):
+    class Meta(TagSerializer.Meta):
+        fields = ['name', 'to_delete', 'element_count']
+        read_only_fields = ['element_count']
+
+
+class AbstractModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     def get_user_from_request(self):
         request = self.context.get("request", None)
         return request.user if request and request.user.is_authenticated else None
@@ -30,6 +41,7 @@ class UserSerializer(AbstractModelSerializer):
     class Meta:
         model = User
         fields = ['password', 'username', 'id', 'tags']
+        list_serializer_class = TimedListSerializer
         extra_kwargs = {
             'id': {'read_only': True},
             'password': {'write_only': True, 'required': True},
@@ -55,6 +67,12 @@ class UserSerializer(AbstractModelSerializer):
             raise ValidationError(detail="You are trying to update another person's profile!")
 
 
+# Element fields an update writes. Not tag_names, which set_element_tags just rewrote behind the instance.
+ELEMENT_UPDATE_FIELDS = [
+    field.name for field in Element._meta.concrete_fields if not field.primary_key and field.name != "tag_names"
+]
+
+
 class ElementSerializer(AbstractModelSerializer):
     tags = TagSerializer(many=True, required=False)
     user = UserSerializer(read_only=True)
@@ -62,6 +80,7 @@ class ElementSerializer(AbstractModelSerializer):
     class Meta:
         model = Element
         fields = ["description", "user", "title", "tags", "id"]
+        list_serializer_class = TimedListSerializer
         extra_kwargs = {
             'user': {'read_only': True}
         }
@@ -69,27 +88,53 @@ class ElementSerializer(AbstractModelSerializer):
     def create(self, validated_data):
         user = self.get_user_from_request()
         tags_data = validated_data.pop("tags", None)
-        element = Element.objects.create(user=user, **validated_data)
-        if tags_data:
-            for tag in tags_data:
-                tag_with_name, created = Tag.objects.get_or_create(name=tag['name'])
-                tp, created = Tagging.objects.get_or_create(element=element, tag=tag_with_name)
-                tp.save()
+        with transaction.atomic():
+            element = Element.objects.create(user=user, tag_names=initial_tag_names(), **validated_data)
+            if tags_data:
+                set_element_tags(element, [tag["name"] for tag in tags_data], before=frozenset())
         return element
 
     def update(self, instance, validated_data):
         user = self.get_user_from_request()
         if not user or user.id == instance.user.id:
             tags_data = validated_data.pop("tags", None)
-            if tags_data:
-                for tag in tags_data:
-                    if 'to_delete' in tag and tag['to_delete']:
-                        tag_with_name = Tag.objects.filter(name=tag['name'])
-                        if tag_with_name.count() == 1:
-                            Tagging.objects.filter(tag=tag_with_name[0], element=instance).delete()
-                    else:
-                        tag_with_name, created = Tag.objects.get_or_create(name=tag['name'])
-                        tp, created = Tagging.objects.get_or_create(element=instance, tag=tag_with_name)
-                        tp.save()
-            return super(ElementSerializer, self).update(instance, validated_data)
+            with transaction.atomic():
+                if tags_data:
+                    set_element_tags(instance, *split_tag_changes(tags_data))
+                for attr, value in validated_data.items():
+                    setattr(instance, attr, value)
+                instance.save(update_fields=ELEMENT_UPDATE_FIELDS)
+                return instance
         raise ValidationError(detail="You don't have permission to update it!")
+
+
+ELEMENT_ROW_FIELDS = ("id", "description", "title", "user_id", "user__username", "tag_names")
+
+
+class ElementRowSerializer:
+    """
+    Read only twin of ElementSerializer(many=True) for element lists: builds the same representation
+    from ELEMENT_ROW_FIELDS value rows without instantiating models or fields. The tags come from the
+    rows' stored tag names when they can be trusted, else from a single tag query.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @property
+    def data(self):
+        tag_names = stored_tag_names(self.rows)
+        missing = [row["id"] for row in self.rows if row["id"] not in tag_names]
+        if missing:
+            tag_names.update(element_tag_names(missing))
+        with timed("serialize"):
+            return [
+                {
+                    "description": row["description"],
+                    "user": None if row["user_id"] is None else {"username": row["user__username"], "id": row["user_id"]},
+                    "title": row["title"],
+                    "tags": [{"name": name, "to_delete": False} for name in tag_names.get(row["id"], ())],
+                    "id": row["id"],
+                }
+                for row in self.rows
+            ]
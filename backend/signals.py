@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import pre_delete, post_delete, post_init, post_save
+from django.dispatch import Signal, receiver
+
+from backend.models import Element, Tag, Tagging
+from backend.versions import ELEMENTS, TAGGINGS, TAGS, USERS, bump_version
+
+# Sent inside the writing transaction with changes, a list of (element id, tag ids before, tag ids after)
+# frozenset triples, and version.
+taggings_changed = Signal()
+# Sent inside the writing transaction with elements (a list), deleted and version whenever elements are saved
+# or deleted.
+element_changed = Signal()
+# Sent inside the writing transaction with tags (a {tag id: name} dict of new tags) and version.
+tags_created = Signal()
+# Set while a bulk writer notifies the changes of its elements itself, the per element receivers stand aside.
+bulk_notifying = ContextVar("bulk_notifying", default=False)
+
+
+@contextmanager
+def notifying_in_bulk():
+    token = bulk_notifying.set(True)
+    try:
+        yield
+    finally:
+        bulk_notifying.reset(token)
+
+
+def notify_taggings_changed(element_id, before, after):
+    notify_many_taggings_changed([(element_id, before, after)])
+
+
+def notify_many_taggings_changed(changes):
+    changes = [change for change in changes if change[1] != change[2]]
+    if changes:
+        logged = [[element_id, sorted(before), sorted(after)] for element_id, before, after in changes]
+        taggings_changed.send(sender=Element, changes=changes, version=bump_version(TAGGINGS, logged))
+
+
+def logged_taggings_changes(change):
+    """The taggings_changed changes of a TAGGINGS version change."""
+    return [(element_id, frozenset(before), frozenset(after)) for element_id, before, after in change]
+
+
+def notify_tags_created(tags):
+    if tags:
+        version = bump_version(TAGS, [[tag_id, name] for tag_id, name in tags.items()])
+        tags_created.send(sender=Tag, tags=tags, version=version)
+
+
+def logged_tags(change):
+    """The tags_created tags of a TAGS version change."""
+    return {tag_id: name for tag_id, name in change}
+
+
+def element_changes(elements, deleted):
+    """[[element id, title, description]] of saved elements, [[element id]] of deleted ones."""
+    return [[element.pk] if deleted else [element.pk, element.title, element.description] for element in elements]
+
+
+def notify_elements_changed(elements, deleted=False):
+    """Sends element_changed once for the saved or deleted elements, with a single version."""
+    if elements:
+        version = bump_version(ELEMENTS, element_changes(elements, deleted))
+        element_changed.send(sender=Element, elements=elements, deleted=deleted, version=version)
+
+
+def count_changes(changes):
+    """Returns {tag id: change in element count} for a list of taggings_changed changes."""
+    deltas = {}
+    for element_id, before, after in changes:
+        for tag_id in after - before:
+            deltas[tag_id] = deltas.get(tag_id, 0) + 1
+        for tag_id in before - after:
+            deltas[tag_id] = deltas.get(tag_id, 0) - 1
+    return deltas
+
+
+@receiver(taggings_changed)
+def update_tag_counts(sender, changes, **kwargs):
+    tags_by_delta = {}
+    for tag_id, delta in count_changes(changes).items():
+        if delta:
+            tags_by_delta.setdefault(delta, []).append(tag_id)
+    for delta, tag_ids in tags_by_delta.items():
+        Tag.objects.filter(id__in=tag_ids).update(element_count=F("element_count") + delta)
+
+
+@receiver(post_save, sender=Tagging)
+def notify_created_tagging(sender, instance, created, raw=False, **kwargs):
+    # Taggings written through backend.tagging are bulk written and notify on their own.
+    if created and not raw:
+        after = frozenset(Tagging.objects.filter(element_id=instance.element_id).values_list("tag_id", flat=True))
+        notify_taggings_changed(instance.element_id, after - {instance.tag_id}, after)
+
+
+@receiver(pre_delete, sender=Tagging)
+def remember_element_tags(sender, instance, **kwargs):
+    # Every pre_delete of a delete is sent before its rows go, the element's taggings are all still there.
+    if not bulk_notifying.get():
+        tag_ids = Tagging.objects.filter(element_id=instance.element_id).values_list("tag_id", flat=True)
+        instance.element_tag_ids = frozenset(tag_ids)
+
+
+@receiver(post_delete, sender=Tagging)
+def notify_deleted_tagging(sender, instance, **kwargs):
+    # Covers the taggings deleted one by one, with their element or tag, or by the admin. A delete of several
+    # taggings of the element is notified once, by the tagging of its smallest removed tag id.
+    if bulk_notifying.get() or not hasattr(instance, "element_tag_ids"):
+        return
+    after = frozenset(Tagging.objects.filter(element_id=instance.element_id).values_list("tag_id", flat=True))
+    if instance.tag_id == min(instance.element_tag_ids - after):
+        notify_taggings_changed(instance.element_id, instance.element_tag_ids, after)
+
+
+@receiver(post_save, sender=Element)
+def notify_saved_element(sender, instance, **kwargs):
+    if not bulk_notifying.get():
+        notify_elements_changed([instance])
+
+
+@receiver(post_delete, sender=Element)
+def notify_deleted_element(sender, instance, **kwargs):
+    # The element's taggings were deleted first, notify_deleted_tagging reported them.
+    if not bulk_notifying.get():
+        notify_elements_changed([instance], deleted=True)
+
+
+@receiver(post_save, sender=Tag)
+def notify_saved_tag(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notify_tags_created({instance.id: instance.name})
+    else:
+        bump_version(TAGS)
+
+
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_username(sender, instance, **kwargs):
+    instance.saved_username = instance.__dict__.get("username")
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def bump_users_version(sender, instance, created, update_fields=None, **kwargs):
+    # Usernames are the only user field responses show, logins save last_login only. New users have no elements.
+    if created or (update_fields is not None and "username" not in update_fields):
+        return
+    if instance.username != instance.saved_username:
+        bump_version(USERS)
+    instance.saved_username = instance.username
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def bump_users_version_on_delete(sender, **kwargs):
+    bump_version(USERS)
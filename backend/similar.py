@@ -0,0 +1,227 @@
+import heapq
+import random
+import struct
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count
+from django.dispatch import receiver
+
+from backend.models import ElementSignature, Tagging
+from backend.signals import logged_taggings_changes, taggings_changed
+from backend.versions import TAGGINGS, VersionedIndex, bump_version
+
+# Number of MinHash values stored per element, bands * rows of the index can use up to this many.
+SIGNATURE_SIZE = 32
+# The hashes (a * tag id + b) mod PRIME, with the Mersenne prime 2**61 - 1, are a universal family.
+PRIME = 2 ** 61 - 1
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 900
+
+
+def hash_parameters(count, seed=0):
+    generator = random.Random(seed)
+    return [(generator.randrange(1, PRIME), generator.randrange(PRIME)) for _ in range(count)]
+
+
+HASHES = hash_parameters(SIGNATURE_SIZE)
+
+
+def signature(tag_ids):
+    """MinHash signature of a non empty set of tag ids: the smallest value of every hash over the set."""
+    return tuple(min((a * tag_id + b) % PRIME for tag_id in tag_ids) for a, b in HASHES)
+
+
+def pack(minhashes):
+    return struct.pack("<%dq" % len(minhashes), *minhashes)
+
+
+def unpack(data):
+    data = bytes(data)
+    return struct.unpack("<%dq" % (len(data) // 8), data)
+
+
+def by_score(item):
+    return -item[1], item[0]
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second) if first or second else 0.0
+
+
+def element_signatures(element_ids):
+    """Returns {element id: signature} computed from the taggings, elements without tags are left out."""
+    tag_ids = {}
+    for start in range(0, len(element_ids), BATCH_SIZE):
+        taggings = Tagging.objects.filter(element_id__in=element_ids[start:start + BATCH_SIZE])
+        for element_id, tag_id in taggings.values_list("element_id", "tag_id"):
+            tag_ids.setdefault(element_id, set()).add(tag_id)
+    return {element_id: signature(tags) for element_id, tags in tag_ids.items()}
+
+
+class SimilarityIndex(VersionedIndex):
+    """
+    Process local LSH index over the persisted MinHash signatures. The first SIMILAR_BANDS * SIMILAR_ROWS
+    values of a signature are cut into bands of SIMILAR_ROWS values, and elements with an identical band
+    are candidates: two tag sets with Jaccard similarity s share a band with probability
+    1 - (1 - s ** rows) ** bands. More bands find more of the similar elements, more rows keep the
+    buckets of popular tags small. Both can change without recomputing the signatures.
+    Only the band keys of an element are kept, one 64 bit integer per band.
+    """
+    version_name = TAGGINGS
+    check_interval_setting = "SIMILAR_INDEX_CHECK_INTERVAL"
+
+    def is_enabled(self):
+        return getattr(settings, "SIMILAR_INDEX_ENABLED", False)
+
+    def reset(self):
+        self.bands = getattr(settings, "SIMILAR_BANDS", 16)
+        self.rows = getattr(settings, "SIMILAR_ROWS", 2)
+        if self.bands * self.rows > SIGNATURE_SIZE:
+            raise ImproperlyConfigured("SIMILAR_BANDS * SIMILAR_ROWS can't exceed %d." % SIGNATURE_SIZE)
+        self.keys = {}
+        self.buckets = {}
+
+    def band_keys(self, minhashes):
+        rows = self.rows
+        return array("q", (hash((band,) + minhashes[band * rows:(band + 1) * rows]) for band in range(self.bands)))
+
+    def load(self):
+        signatures = ElementSignature.objects.values_list("element_id", "minhashes")
+        for element_id, minhashes in signatures.iterator(chunk_size=10000):
+            self.add(element_id, unpack(minhashes))
+
+    def add(self, element_id, minhashes):
+        keys = self.keys[element_id] = self.band_keys(minhashes)
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(element_id)
+
+    def remove(self, element_id):
+        keys = self.keys.pop(element_id, None)
+        if keys is None:
+            return
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(element_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def change(self, signatures):
+        for element_id, minhashes in signatures.items():
+            self.remove(element_id)
+            if minhashes is not None:
+                self.add(element_id, minhashes)
+
+    def replay(self, name, changes):
+        for change in changes:
+            self.change(changed_signatures(logged_taggings_changes(change)))
+
+    def candidates(self, element_id, count):
+        """Returns up to count ids of elements sharing bands with the element, those sharing the most first."""
+        self.ensure_fresh()
+        with self.lock:
+            keys = self.keys.get(element_id)
+            if keys is None:
+                return []
+            shared = Counter()
+            for key in keys:
+                shared.update(self.buckets.get(key, ()))
+        del shared[element_id]
+        return [candidate for candidate, bands in heapq.nsmallest(count, shared.items(), key=by_score)]
+
+
+similarity_index = SimilarityIndex()
+
+
+def shared_tag_candidates(element_id, count):
+    """Returns up to count ids of elements sharing tags with the element, those sharing the most first."""
+    tag_ids = Tagging.objects.filter(element_id=element_id).values("tag_id")
+    shared = (
+        Tagging.objects.filter(tag_id__in=tag_ids).exclude(element_id=element_id).values("element_id")
+        .annotate(shared=Count("tag_id")).order_by("-shared", "element_id").values_list("element_id", flat=True)
+    )
+    return list(shared[:count])
+
+
+def similar_elements(element_id, limit):
+    """
+    Returns [(element id, Jaccard similarity)] of up to limit elements whose tag sets are most similar to
+    the element's, most similar first. The SIMILAR_MAX_CANDIDATES candidates found by the index, or without
+    SIMILAR_INDEX_ENABLED by the database, are ranked by their exact similarity, so results are never wrong,
+    only similar elements can be missed.
+    """
+    count = getattr(settings, "SIMILAR_MAX_CANDIDATES", 200)
+    if similarity_index.is_enabled():
+        candidates = similarity_index.candidates(element_id, count)
+    else:
+        candidates = shared_tag_candidates(element_id, count)
+    if not candidates:
+        return []
+    tag_ids = {}
+    for tagged_id, tag_id in Tagging.objects.filter(element_id__in=[element_id] + candidates).values_list(
+            "element_id", "tag_id"):
+        tag_ids.setdefault(tagged_id, set()).add(tag_id)
+    tags = tag_ids.get(element_id, set())
+    scores = [(candidate, jaccard(tags, tag_ids.get(candidate, set()))) for candidate in candidates]
+    return heapq.nsmallest(limit, [item for item in scores if item[1] > 0], key=by_score)
+
+
+def rebuild_signatures(batch_size=10000):
+    """Recomputes the signatures of every element from the taggings, returns how many elements have one."""
+    with transaction.atomic():
+        ElementSignature.objects.all().delete()
+        created = 0
+        element_ids = Tagging.objects.order_by("element_id").values_list("element_id", flat=True).distinct()
+        batch = []
+        for element_id in element_ids.iterator(chunk_size=batch_size):
+            batch.append(element_id)
+            if len(batch) == batch_size:
+                created += save_signatures(batch)
+                batch = []
+        created += save_signatures(batch)
+        # Makes every process reload its index.
+        bump_version(TAGGINGS)
+    return created
+
+
+def save_signatures(element_ids):
+    signatures = element_signatures(element_ids)
+    ElementSignature.objects.bulk_create(
+        ElementSignature(element_id=element_id, minhashes=pack(minhashes))
+        for element_id, minhashes in signatures.items()
+    )
+    return len(signatures)
+
+
+def warm_up():
+    if similarity_index.is_enabled():
+        similarity_index.build()
+
+
+def changed_signatures(changes):
+    """Returns {element id: signature, None without tags} of the elements of taggings_changed changes."""
+    return {element_id: signature(after) if after else None for element_id, before, after in changes}
+
+
+@receiver(taggings_changed)
+def update_signatures(sender, changes, version, **kwargs):
+    """
+    Writes the new signatures in the transaction that changed the taggings, the index follows on commit.
+    Without SIMILAR_INDEX_ENABLED nothing reads them, rebuild_signatures catches up when it's turned on.
+    """
+    if not similarity_index.is_enabled():
+        return
+    signatures = changed_signatures(changes)
+    # Elements without tags before have no signature to replace, imports don't need to look.
+    replaced = [element_id for element_id, before, after in changes if before]
+    for start in range(0, len(replaced), BATCH_SIZE):
+        ElementSignature.objects.filter(element_id__in=replaced[start:start + BATCH_SIZE]).delete()
+    ElementSignature.objects.bulk_create(
+        ElementSignature(element_id=element_id, minhashes=pack(minhashes))
+        for element_id, minhashes in signatures.items() if minhashes is not None
+    )
+    similarity_index.apply_on_commit(version, similarity_index.change, signatures)
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.models import Tag, normalize_tag_name
+from backend.signals import tags_created
+
+
+class TagIdCache:
+    """
+    Bounded LRU of normalized tag key -> tag id shared by the threads of the process, with None for keys
+    that have no tag. Tags created, renamed or deleted by this process drop their entries at once and again
+    on commit. Other workers see those changes once the entries expire: after TAG_ID_CACHE_TIMEOUT seconds,
+    TAG_ID_CACHE_NEGATIVE_TIMEOUT for missing tags. Only reads use it: an id cached here may be of a tag
+    another worker deleted since, so writes resolve their tags with Tag.objects.ids_for_names.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def size(self):
+        return getattr(settings, "TAG_ID_CACHE_SIZE", 100000)
+
+    def expiry(self, tag_id):
+        if tag_id is None:
+            return time.monotonic() + getattr(settings, "TAG_ID_CACHE_NEGATIVE_TIMEOUT", 5)
+        return time.monotonic() + getattr(settings, "TAG_ID_CACHE_TIMEOUT", 300)
+
+    def get_many(self, keys):
+        """Returns {key: tag id or None} of the keys that are cached."""
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[0]
+            self.hits += sum(tag_id is not None for tag_id in found.values())
+            self.negative_hits += sum(tag_id is None for tag_id in found.values())
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, ids):
+        size = self.size
+        with self.lock:
+            for key, tag_id in ids.items():
+                self.entries[key] = (tag_id, self.expiry(tag_id))
+                self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def invalidate_on_commit(self, *keys):
+        """Drops the keys now and once more after commit, a request may cache the old row in between."""
+        self.invalidate(*keys)
+        transaction.on_commit(lambda: self.invalidate(*keys))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self.entries), "hits": self.hits, "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.negative_hits = 0
+            self.misses = 0
+
+
+tag_id_cache = TagIdCache()
+
+
+def ids_for_names(names):
+    """
+    Returns {name: tag id} for the names matching a tag through its key, missing names are left out.
+    Cached keys cost no query, the others are read in one and cached, missing ones included.
+    """
+    keys = {name: normalize_tag_name(name) for name in set(names)}
+    if tag_id_cache.size <= 0:
+        ids = Tag.objects.ids_for_keys(set(keys.values()))
+    else:
+        ids = tag_id_cache.get_many(set(keys.values()))
+        missing = set(keys.values()) - set(ids)
+        if missing:
+            found = Tag.objects.ids_for_keys(missing)
+            fetched = {key: found.get(key) for key in missing}
+            tag_id_cache.set_many(fetched)
+            ids.update(fetched)
+    return {name: ids[key] for name, key in keys.items() if ids.get(key) is not None}
+
+
+@receiver(tags_created)
+def forget_created_tags(sender, tags, **kwargs):
+    tag_id_cache.invalidate_on_commit(*{normalize_tag_name(name) for name in tags.values()})
+
+
+@receiver(post_save, sender=Tag)
+def forget_saved_tag(sender, instance, created, raw=False, **kwargs):
+    # Covers the tags created outside of tags_created: Tag.objects.create, the admin, fixtures. Any other
+    # save may be a rename whose old key is unknown here.
+    if created:
+        tag_id_cache.invalidate_on_commit(instance.key)
+    else:
+        tag_id_cache.clear()
+        transaction.on_commit(tag_id_cache.clear)
+
+
+@receiver(post_delete, sender=Tag)
+def forget_deleted_tag(sender, instance, **kwargs):
+    tag_id_cache.invalidate_on_commit(instance.key)
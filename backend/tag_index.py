@@ -0,0 +1,91 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from backend.models import Tagging
+from backend.signals import logged_taggings_changes, taggings_changed
+from backend.versions import TAGGINGS, VersionedIndex
+
+
+def contains(postings, element_id):
+    i = bisect_left(postings, element_id)
+    return i < len(postings) and postings[i] == element_id
+
+
+def union(postings):
+    if len(postings) == 1:
+        return postings[0]
+    return array("q", sorted(set().union(*postings)))
+
+
+def intersect(postings):
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        result = array("q", (element_id for element_id in result if contains(other, element_id)))
+        if not result:
+            break
+    return result
+
+
+class TagIndex(VersionedIndex):
+    """Process local inverted index of tag id -> sorted array of element ids."""
+    version_name = TAGGINGS
+    check_interval_setting = "TAG_INDEX_CHECK_INTERVAL"
+
+    def is_enabled(self):
+        return getattr(settings, "TAG_INDEX_ENABLED", False)
+
+    def reset(self):
+        self.postings = {}
+
+    def load(self):
+        taggings = Tagging.objects.order_by("tag_id", "element_id").values_list("tag_id", "element_id")
+        for tag_id, element_id in taggings.iterator(chunk_size=10000):
+            tag_postings = self.postings.get(tag_id)
+            if tag_postings is None:
+                tag_postings = self.postings[tag_id] = array("q")
+            if not tag_postings or tag_postings[-1] != element_id:
+                tag_postings.append(element_id)
+
+    def change(self, changes):
+        for element_id, before, after in changes:
+            for tag_id in before - after:
+                tag_postings = self.postings.get(tag_id)
+                if tag_postings is not None and contains(tag_postings, element_id):
+                    del tag_postings[bisect_left(tag_postings, element_id)]
+            for tag_id in after - before:
+                tag_postings = self.postings.setdefault(tag_id, array("q"))
+                if not contains(tag_postings, element_id):
+                    tag_postings.insert(bisect_left(tag_postings, element_id), element_id)
+
+    def replay(self, name, changes):
+        for change in changes:
+            self.change(logged_taggings_changes(change))
+
+    def evaluate(self, groups, excluded):
+        """Returns the sorted ids of elements matching every group (an OR of tag ids) and no excluded tag."""
+        self.ensure_fresh()
+        with self.lock:
+            empty = array("q")
+            result = intersect([union([self.postings.get(tag_id, empty) for tag_id in group]) for group in groups])
+            if excluded:
+                hidden = set().union(*(self.postings.get(tag_id, empty) for tag_id in excluded))
+                return [element_id for element_id in result if element_id not in hidden]
+            return list(result)
+
+
+tag_index = TagIndex()
+
+
+def warm_up():
+    if tag_index.is_enabled():
+        tag_index.build()
+
+
+@receiver(taggings_changed)
+def update_tag_index(sender, changes, version, **kwargs):
+    if tag_index.is_enabled():
+        tag_index.apply_on_commit(version, tag_index.change, changes)
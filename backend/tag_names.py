@@ -0,0 +1,103 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from backend.models import Element, Tag, Tagging
+from backend.signals import taggings_changed
+
+# Stays below SQLite's limit of 999 query parameters.
+BATCH_SIZE = 900
+
+
+def is_enabled():
+    return getattr(settings, "ELEMENT_TAG_NAMES_ENABLED", False)
+
+
+def encode(names):
+    return json.dumps(names, ensure_ascii=False, separators=(",", ":"))
+
+
+def element_tag_names(element_ids):
+    """Returns {element id: names of its tags in alphabetical order} in one query."""
+    names = {}
+    rows = Tag.objects.filter(element__in=element_ids).order_by("name").values_list("element__id", "name")
+    for element_id, name in rows:
+        names.setdefault(element_id, []).append(name)
+    return names
+
+
+def stored_tag_names(rows):
+    """Returns {element id: names} of the element value rows whose tag_names can be trusted."""
+    if not is_enabled():
+        return {}
+    return {row["id"]: json.loads(row["tag_names"]) for row in rows if row.get("tag_names") is not None}
+
+
+def initial_tag_names():
+    """Element.tag_names of an element created without tags, its taggings notify when it gets some."""
+    return encode([]) if is_enabled() else None
+
+
+def refresh_tag_names(element_ids):
+    """Writes Element.tag_names of the elements from their taggings, two queries per BATCH_SIZE elements."""
+    element_ids = sorted(set(element_ids))
+    for start in range(0, len(element_ids), BATCH_SIZE):
+        batch = element_ids[start:start + BATCH_SIZE]
+        names = element_tag_names(batch)
+        Element.objects.bulk_update(
+            [Element(pk=element_id, tag_names=encode(names.get(element_id, []))) for element_id in batch], ["tag_names"]
+        )
+
+
+def check_tag_names(repair=False, batch_size=BATCH_SIZE):
+    """
+    Compares Element.tag_names of every element with its taggings in id ordered batches, and rewrites
+    the ones that differ when repair is set. Returns (checked elements, inconsistent elements).
+    """
+    checked = inconsistent = 0
+    last = 0
+    while True:
+        rows = list(Element.objects.filter(pk__gt=last).order_by("pk").values_list("id", "tag_names")[:batch_size])
+        if not rows:
+            return checked, inconsistent
+        names = element_tag_names([element_id for element_id, stored in rows])
+        stale = [element_id for element_id, stored in rows if stored != encode(names.get(element_id, []))]
+        if repair and stale:
+            # Recomputed in the transaction that writes them, the taggings may have changed since.
+            with transaction.atomic():
+                refresh_tag_names(stale)
+        checked += len(rows)
+        inconsistent += len(stale)
+        last = rows[-1][0]
+
+
+@receiver(taggings_changed)
+def update_tag_names(sender, changes, **kwargs):
+    """Rewrites the names of the changed elements in the transaction that changed their taggings."""
+    if is_enabled():
+        refresh_tag_names([element_id for element_id, before, after in changes])
+
+
+def tagged_element_ids(tag):
+    return list(Tagging.objects.filter(tag=tag).values_list("element_id", flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def rename_tag_names(sender, instance, created, raw=False, **kwargs):
+    if is_enabled() and not created and not raw:
+        refresh_tag_names(tagged_element_ids(instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_elements(sender, instance, **kwargs):
+    if is_enabled():
+        instance.tagged_element_ids = tagged_element_ids(instance)
+
+
+@receiver(post_delete, sender=Tag)
+def forget_deleted_tag_names(sender, instance, **kwargs):
+    if is_enabled():
+        refresh_tag_names(getattr(instance, "tagged_element_ids", ()))
@@ -0,0 +1,64 @@
+from django.db import transaction
+
+from backend.models import Element, Tag, Tagging, normalize_tag_name
+from backend.signals import notify_tags_created, notify_taggings_changed, notifying_in_bulk
+
+
+def split_tag_changes(tags_data):
+    """
+    Splits serialized tags into names to add and names to remove, a later entry for the same tag wins,
+    names are compared through their normalized key.
+    """
+    to_delete = {}
+    for tag in tags_data:
+        to_delete[normalize_tag_name(tag["name"])] = (tag["name"], bool(tag.get("to_delete", False)))
+    changes = to_delete.values()
+    return [name for name, delete in changes if not delete], [name for name, delete in changes if delete]
+
+
+def resolve_or_create_tags(names, known=None):
+    """
+    Returns {name: tag id} for every name, inserting the missing tags. The inserts ignore conflicts
+    on the unique key, so concurrent writers creating the same tag both end up with the same row, and
+    names differing only in case share the row spelled like the first of them. Known ids must come from
+    the database, not from backend.tag_cache, whose ids may be of tags other workers deleted since.
+    """
+    names = set(names)
+    ids = dict(known) if known is not None else Tag.objects.ids_for_names(names)
+    missing = names - set(ids)
+    if missing:
+        spellings = {}
+        for name in sorted(missing):
+            spellings.setdefault(normalize_tag_name(name), name)
+        Tag.objects.bulk_create([Tag(name=name) for name in spellings.values()], ignore_conflicts=True)
+        created = Tag.objects.filter(key__in=list(spellings)).values_list("id", "key", "name")
+        notify_tags_created({tag_id: name for tag_id, key, name in created})
+        keys = {key: tag_id for tag_id, key, name in created}
+        for key in set(spellings) - set(keys):
+            # The database's collation matched a tag stored under another key, like "café" for "cafe" on MySQL.
+            keys[key] = Tag.objects.filter(key=key).values_list("id", flat=True).get()
+        ids.update((name, keys[normalize_tag_name(name)]) for name in missing)
+    return ids
+
+
+def set_element_tags(element, added_names=(), removed_names=(), before=None):
+    """
+    Applies a tag diff to the element in a constant number of queries, whatever the number of tags. Writers of
+    the same element's tags queue up on its row, so each diffs against the taggings the previous one left.
+    """
+    added_names, removed_names = set(added_names), set(removed_names)
+    with transaction.atomic():
+        if before is None:
+            list(Element.objects.select_for_update().filter(pk=element.pk).values_list("pk", flat=True))
+            before = frozenset(Tagging.objects.filter(element=element).values_list("tag_id", flat=True))
+        ids = Tag.objects.ids_for_names(added_names | removed_names)
+        removed = {ids[name] for name in removed_names if name in ids} & before
+        ids = resolve_or_create_tags(added_names, known=ids)
+        added = {ids[name] for name in added_names}
+        if removed:
+            with notifying_in_bulk():
+                Tagging.objects.filter(element=element, tag_id__in=removed).delete()
+        Tagging.objects.bulk_create(
+            [Tagging(element=element, tag_id=tag_id) for tag_id in added - before], ignore_conflicts=True
+        )
+        notify_taggings_changed(element.id, before, (before - removed) | added)
@@ -4,6 +4,7 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 from backend.models import Element, Tag, Tagging
+from backend.tag_cache import tag_id_cache
 
 
 def set_credentials(client, username, password="Qwerty1234!"):
@@ -27,6 +28,9 @@ def get_user_and_client(username, password="Qwerty1234!", is_staff=False):
 class UserTestCase(TestCase):
     def setUp(self) -> None:
         super(UserTestCase, self).setUp()
+        # Cached tag ids would outlive the rolled back rows of earlier tests.
+        tag_id_cache.clear()
+        tag_id_cache.reset_stats()
         self.user, self.client = get_user_and_client("user1")
         self.userOther, self.clientOther = get_user_and_client("user2")
         self.admin, self.clientAdmin = get_user_and_client(username="admin", is_staff=True)
@@ -67,3 +71,13 @@ class ElementTestCase(UserTestCase):
         self.assertEqual(len(json["tags"]), element.tags.count())
         for tag in json["tags"]:
             self.assertIsNotNone(element.tags.filter(name=tag["name"]).first())
+
+    def create_elements(self, count, tags_per_element=3, user=None):
+        elements = []
+        for i in range(count):
+            element = Element.objects.create(title="Element " + str(i), user=user or self.user)
+            for j in range(tags_per_element):
+                tag, created = Tag.objects.get_or_create(name="tag " + str((i + j) % 10))
+                Tagging.objects.create(tag=tag, element=element)
+            elements.append(element)
+        return elements
@@ -1,7 +1,57 @@
+import asyncio
+import csv
+import datetime
+import decimal
+import importlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from backend.models import Element, Tag
+from django.utils.translation import gettext_lazy
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from backend.asgi import PooledASGIHandler
+from backend.authentication import token_cache
+from backend.autocomplete import tag_prefix_index
+from backend.benchmark import SyntheticDataset, percentile
+from backend.cache import response_cache
+from backend.export import iter_elements
+from backend.instrumentation import reset_metrics
+from backend.models import Element, ElementSignature, Tag, TagCooccurrence, Tagging
+from backend.related import related_tags
+from backend.renderers import FastJSONRenderer
+from backend.routers import ReplicaMiddleware, choose_replica, read_alias, replica_health, replica_pins
+from backend.search import token_index
+from backend.serializers import ElementSerializer
+from backend.similar import pack, signature, similarity_index
+from backend.tag_cache import ids_for_names, tag_id_cache
+from backend.tag_index import tag_index
+from backend.tag_names import check_tag_names
+from backend.tagging import set_element_tags
 from backend.test_mixins import UserTestCase, ElementTestCase
+from backend.versions import TAGGINGS, bump_version
+from backend.views import ElementViewSet
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 
 
 class TestUserViewSet(UserTestCase):
@@ -202,3 +252,1463 @@ class TestMeViewset(UserTestCase):
     def test_doesnt_work_if_incorrect_token(self):
         response = self.clientUnauthenticated.post(reverse("me-list"), data={"key": "1"})
         self.assertEqual(response.status_code, 404)
+
+
+class TestElementQueryBudget(ElementTestCase):
+    def test_list_queries_dont_grow_with_page_size(self):
+        with self.assertNumQueries(3):
+            self.clientUnauthenticated.get(reverse("element-list"))
+        self.create_elements(20)
+        with self.assertNumQueries(3):
+            response = self.clientUnauthenticated.get(reverse("element-list"))
+        self.assertEqual(len(response.json()["results"]), 21)
+        for item in response.json()["results"]:
+            self.assert_json_is_element(item, Element.objects.get(pk=item["id"]))
+
+    def test_retrieve_queries(self):
+        with self.assertNumQueries(2):
+            response = self.clientUnauthenticated.get(reverse("element-detail", kwargs={"pk": self.element.pk}))
+        self.assert_json_is_element(response.json(), self.element)
+
+    def test_create_response_is_hydrated(self):
+        response = self.client.post(reverse("element-list"), self.data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assert_json_to_user(response.json()["user"], self.user)
+        self.assert_json_is_element(response.json(), Element.objects.get(pk=response.json()["id"]))
+
+    def test_update_response_is_hydrated(self):
+        response = self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.element.pk}),
+            data={"tags": [{"name": "new tag"}]},
+            format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["tags"]), 2)
+        self.assert_json_is_element(response.json(), self.element)
+
+
+class TestElementTagFilters(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestElementTagFilters, self).setUp()
+        self.elements = self.create_elements(10)
+
+    def get_ids(self, query):
+        response = self.clientUnauthenticated.get(reverse("element-list") + "?" + query)
+        self.assertEqual(response.status_code, 200)
+        return {json["id"] for json in response.json()["results"]}
+
+    def tagged_with(self, *names):
+        return {element.id for element in Element.objects.all() if set(names) <= set(element.tags.values_list("name", flat=True))}
+
+    def test_and_filter(self):
+        self.assertEqual(self.get_ids("tags=tag 1,tag 2"), self.tagged_with("tag 1", "tag 2"))
+        self.assertEqual(self.get_ids("tags=tag 1,tag 2,tag 3"), self.tagged_with("tag 1", "tag 2", "tag 3"))
+        self.assertEqual(len(self.get_ids("tags=tag 1,tag 2,tag 3")), 1)
+
+    def test_or_filter(self):
+        expected = self.tagged_with("tag 1") | self.tagged_with("tag 5")
+        self.assertEqual(self.get_ids("tags=tag 1,tag 5&or=true"), expected)
+        self.assertEqual(self.get_ids("tags=tag 1|tag 5"), expected)
+
+    def test_mixed_filter(self):
+        expected = (self.tagged_with("tag 1") | self.tagged_with("tag 5")) & self.tagged_with("tag 3")
+        self.assertEqual(self.get_ids("tags=tag 1|tag 5,tag 3"), expected)
+
+    def test_not_filter(self):
+        expected = self.tagged_with("tag 2") - self.tagged_with("tag 3")
+        self.assertEqual(self.get_ids("tags=tag 2&not=tag 3"), expected)
+        self.assertEqual(self.get_ids("not=some tag"), {element.id for element in self.elements})
+
+    def test_unknown_tag_matches_nothing(self):
+        self.assertEqual(self.get_ids("tags=tag 1,missing"), set())
+        self.assertEqual(self.get_ids("tags=tag 1|missing"), self.tagged_with("tag 1"))
+
+    def test_queries_dont_grow_with_tag_count(self):
+        with self.assertNumQueries(4):
+            self.get_ids("tags=tag 1")
+        with self.assertNumQueries(4):
+            self.get_ids("tags=tag 1,tag 2,tag 3&not=tag 7,tag 8,tag 9")
+
+
+@override_settings(TAG_INDEX_ENABLED=True)
+class TestTagIndex(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestTagIndex, self).setUp()
+        self.elements = self.create_elements(10)
+        self.ids = Tag.objects.ids_for_names("tag " + str(i) for i in range(10))
+        tag_index.clear()
+        self.addCleanup(tag_index.clear)
+
+    def get_ids(self, query):
+        response = self.clientUnauthenticated.get(reverse("element-list") + "?" + query)
+        self.assertEqual(response.status_code, 200)
+        return [json["id"] for json in response.json()["results"]]
+
+    def test_index_matches_sql_filters(self):
+        for query in ["tags=tag 1,tag 2", "tags=tag 1|tag 5,tag 3", "tags=tag 2&not=tag 3", "tags=tag 4,tag 5&or=true",
+                      "tags=missing", "tags=tag 1,missing"]:
+            with override_settings(TAG_INDEX_ENABLED=False):
+                expected = self.get_ids(query)
+            self.assertEqual(self.get_ids(query), sorted(expected), query)
+
+    def test_index_only_hydrates_the_page(self):
+        tag_index.build()
+        with self.assertNumQueries(4):
+            response = self.clientUnauthenticated.get(reverse("element-list") + "?tags=tag 1|tag 2|tag 3&limit=2")
+        self.assertEqual(response.json()["count"], 5)
+        self.assertEqual(len(response.json()["results"]), 2)
+        for item in response.json()["results"]:
+            self.assert_json_is_element(item, Element.objects.get(pk=item["id"]))
+
+    def test_index_sees_updates_and_deletes(self):
+        self.assertEqual(self.get_ids("tags=tag 1,tag 5"), [])
+        response = self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.elements[0].pk}),
+            data={"tags": [{"name": "tag 5"}]},
+            format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_ids("tags=tag 1,tag 5"), [self.elements[0].pk])
+        self.client.delete(reverse("element-detail", kwargs={"pk": self.elements[0].pk}))
+        self.assertEqual(self.get_ids("tags=tag 1,tag 5"), [])
+
+    def test_apply_is_incremental(self):
+        tag_index.build()
+        version = tag_index.version
+        tag = frozenset([self.ids["tag 9"]])
+        tag_index.apply(version + 1, tag_index.change, [(self.element.pk, frozenset(), tag)])
+        self.assertIn(self.element.pk, tag_index.postings[self.ids["tag 9"]])
+        tag_index.apply(version + 2, tag_index.change, [(self.element.pk, tag, frozenset())])
+        self.assertNotIn(self.element.pk, tag_index.postings[self.ids["tag 9"]])
+        # A gap is left for the next query to replay from the log.
+        tag_index.apply(version + 4, tag_index.change, [(self.element.pk, frozenset(), tag)])
+        self.assertEqual(tag_index.version, version + 2)
+        self.assertNotIn(self.element.pk, tag_index.postings[self.ids["tag 9"]])
+
+    def test_replays_the_changes_of_other_processes(self):
+        tag_index.build()
+        # Writes of the test never commit, so the index only learns about them from the log like any other process.
+        with mock.patch.object(tag_index, "load") as load:
+            self.client.patch(reverse("element-detail", kwargs={"pk": self.elements[0].pk}),
+                              data={"tags": [{"name": "tag 5"}]}, format="json")
+            self.client.post(reverse("element-list"), {"title": "New", "tags": [{"name": "tag 1"}, {"name": "tag 5"}]},
+                             format="json")
+            self.client.delete(reverse("element-detail", kwargs={"pk": self.elements[1].pk}))
+            with override_settings(TAG_INDEX_ENABLED=False):
+                expected = self.get_ids("tags=tag 1,tag 5")
+            self.assertEqual(len(expected), 2)
+            self.assertEqual(self.get_ids("tags=tag 1,tag 5"), expected)
+            load.assert_not_called()
+            # A version bumped without a logged change can't be replayed.
+            bump_version(TAGGINGS)
+            self.get_ids("tags=tag 1")
+            load.assert_called_once()
+
+
+class TestCursorPagination(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestCursorPagination, self).setUp()
+        self.create_elements(10)
+
+    def walk(self, url, queries):
+        results = []
+        while url:
+            with self.assertNumQueries(queries):
+                response = self.clientUnauthenticated.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.json())
+            results += response.json()["results"]
+            url = response.json()["next"]
+        return results
+
+    def test_walks_elements_without_counting(self):
+        results = self.walk(reverse("element-list") + "?cursor=&limit=3", 2)
+        self.assertEqual([json["id"] for json in results], sorted(Element.objects.values_list("id", flat=True)))
+
+    def test_works_with_tag_filters(self):
+        # The tag names are resolved once, then served by the tag id cache.
+        self.assertEqual(len(ids_for_names(["tag 1", "tag 2"])), 2)
+        results = self.walk(reverse("element-list") + "?cursor=&limit=1&tags=tag 1|tag 2", 2)
+        expected = Element.objects.filter(tags__name__in=["tag 1", "tag 2"]).distinct().values_list("id", flat=True)
+        self.assertEqual([json["id"] for json in results], sorted(expected))
+
+    def test_walks_tags_and_users(self):
+        results = self.walk(reverse("tags-list") + "?cursor=&limit=4", 1)
+        self.assertEqual([json["name"] for json in results], list(Tag.objects.order_by("id").values_list("name", flat=True)))
+        results = self.walk(reverse("user-list") + "?cursor=&limit=2", 1)
+        self.assertEqual(len(results), 3)
+
+
+class TestCountModes(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestCountModes, self).setUp()
+        self.create_elements(10)
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+
+    def get(self, query):
+        with CaptureQueriesContext(connection) as context:
+            response = self.clientUnauthenticated.get(reverse("element-list") + "?" + query)
+        self.assertEqual(response.status_code, 200)
+        self.counted = any(query["sql"].startswith("SELECT COUNT(*)") for query in context.captured_queries)
+        return response.json()
+
+    def test_none_skips_the_count(self):
+        json = self.get("count=none&limit=4")
+        self.assertFalse(self.counted)
+        self.assertIsNone(json["count"])
+        self.assertNotIn("approximate", json)
+        self.assertEqual(len(json["results"]), 4)
+        self.assertIn("offset=4", json["next"])
+        self.assertIsNone(self.get("count=none&limit=4&offset=8")["next"])
+
+    def test_last_page_counts_for_free(self):
+        json = self.get("count=estimate")
+        self.assertFalse(self.counted)
+        self.assertEqual((json["count"], json["approximate"], json["next"]), (11, False, None))
+
+    @override_settings(COUNT_ESTIMATE_EXACT_LIMIT=3, COUNT_ESTIMATE_SAMPLE_SIZE=4)
+    def test_estimate_extrapolates_from_the_latest_rows(self):
+        json = self.get("count=estimate&limit=2")
+        self.assertEqual((json["count"], json["approximate"]), (11, True))
+        json = self.get("count=estimate&limit=2&tags=tag 1|tag 2")
+        self.assertTrue(json["approximate"])
+        self.assertGreater(json["count"], 3)
+        json = self.get("count=estimate&limit=2&tags=tag 1")
+        self.assertEqual((json["count"], json["approximate"]), (3, False))
+
+    def test_cached_reuses_the_count_of_the_same_filters(self):
+        json = self.get("count=cached&limit=2&tags=tag 1|tag 2")
+        self.assertEqual((json["count"], json["approximate"]), (4, False))
+        self.create_elements(1)
+        json = self.get("tags=tag 2|tag 1&limit=3&count=cached")
+        self.assertFalse(self.counted)
+        self.assertEqual((json["count"], json["approximate"]), (4, True))
+        self.assertEqual(self.get("count=exact&limit=2&tags=tag 1|tag 2")["count"], 5)
+
+    def test_default_per_endpoint(self):
+        with override_settings(PAGINATION_COUNT_MODES={"element": "none"}):
+            self.assertIsNone(self.get("limit=2")["count"])
+            self.assertEqual(self.get("limit=2&count=exact")["count"], 11)
+        response = self.clientUnauthenticated.get(reverse("tags-list") + "?count=none&limit=5")
+        self.assertIsNone(response.json()["count"])
+        self.assertEqual(len(response.json()["results"]), 5)
+        response = self.clientUnauthenticated.get(reverse("element-list") + "?count=some")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestElementTagWrites(ElementTestCase):
+    def create_with_tags(self, count):
+        data = dict(self.data, tags=[{"name": "bulk tag " + str(i)} for i in range(count)])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse("element-list"), data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["tags"]), count)
+        return len(context.captured_queries)
+
+    def update_tags(self, element, tags):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                reverse("element-detail", kwargs={"pk": element.pk}), data={"tags": tags}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_create_queries_dont_grow_with_tag_count(self):
+        self.create_with_tags(1)
+        self.assertEqual(self.create_with_tags(2), self.create_with_tags(30))
+
+    def test_update_queries_dont_grow_with_tag_count(self):
+        self.update_tags(self.element, [{"name": "c"}])
+        few = self.update_tags(self.element, [{"name": "a"}, {"name": "some tag", "to_delete": True}])
+        many = self.update_tags(
+            self.element, [{"name": "b" + str(i)} for i in range(30)] + [{"name": "a", "to_delete": True}]
+        )
+        self.assertEqual(few, many)
+        self.assertEqual(set(self.element.tags.values_list("name", flat=True)), {"c"} | {"b" + str(i) for i in range(30)})
+
+    def test_existing_tags_are_reused(self):
+        self.update_tags(self.element, [{"name": "some tag"}, {"name": "other"}, {"name": "other"}])
+        self.assertEqual(Tag.objects.filter(name="some tag").count(), 1)
+        self.assertEqual(self.element.tags.count(), 2)
+
+    def test_taggings_are_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tagging.objects.create(tag=self.tag, element=self.element)
+        self.assertEqual(Tagging.objects.filter(tag=self.tag, element=self.element).count(), 1)
+
+    def test_writers_lock_the_element(self):
+        with CaptureQueriesContext(connection) as context:
+            set_element_tags(self.element, ["other"])
+        # SQLite leaves FOR UPDATE out, its writers are serialized anyway.
+        self.assertTrue(context.captured_queries[1]["sql"].startswith('SELECT "backend_element"."id" FROM "backend_element"'))
+        # A writer that missed a concurrent insert of the same tagging doesn't fail on the unique constraint.
+        element = Element.objects.create(title="untagged")
+        Tagging.objects.bulk_create([Tagging(element=element, tag=self.tag)])
+        set_element_tags(element, [self.tag.name], before=frozenset())
+        self.assertEqual(Tagging.objects.filter(element=element).count(), 1)
+
+    def test_update_is_atomic(self):
+        response = self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.element.pk}),
+            data={"tags": [{"name": "new tag"}], "title": "x" * 501},
+            format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Tag.objects.filter(name="new tag").exists())
+
+
+class TestUniqueTaggingsMigration(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def test_deletes_duplicates_before_the_constraint(self):
+        self.addCleanup(self.migrate, ("backend", "0015_version_change"))
+        models = self.migrate(("backend", "0009_tag_element_count"))
+        Tag, Element, Tagging = (models.get_model("backend", name) for name in ("Tag", "Element", "Tagging"))
+        first, second = Tag.objects.create(name="first", element_count=3), Tag.objects.create(name="second")
+        elements = [Element.objects.create(title=str(i)) for i in range(2)]
+        Tagging.objects.bulk_create([
+            Tagging(element=elements[0], tag=first), Tagging(element=elements[0], tag=first),
+            Tagging(element=elements[0], tag=second), Tagging(element=elements[1], tag=first),
+            Tagging(element=elements[0], tag=first),
+        ])
+        kept = list(Tagging.objects.order_by("id").values_list("id", flat=True))
+        migration = importlib.import_module("backend.migrations.0010_tagging_unique_indexes")
+        migration.delete_duplicate_taggings(models, connection.schema_editor())
+        self.assertEqual(list(Tagging.objects.order_by("id").values_list("id", flat=True)),
+                         [kept[0], kept[2], kept[3]])
+        self.assertEqual(Tag.objects.get(name="first").element_count, 2)
+        self.migrate(("backend", "0010_tagging_unique_indexes"))
+        with self.assertRaises(IntegrityError):
+            Tagging.objects.create(element_id=elements[1].pk, tag_id=first.pk)
+
+
+class TestTagKeys(ElementTestCase):
+    def test_names_differing_in_case_are_one_tag(self):
+        response = self.client.post(reverse("element-list"), dict(self.data, tags=[
+            {"name": "Some Tag"}, {"name": "Horror"}, {"name": "HORROR"}]), format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(Tag.objects.get(key="horror").name, "HORROR")
+        element = Element.objects.get(pk=response.json()["id"])
+        self.assertEqual(set(element.tags.values_list("name", flat=True)), {"some tag", "HORROR"})
+        self.assertEqual(Tag.objects.get(name="some tag").element_count, 2)
+        response = self.client.patch(reverse("element-detail", kwargs={"pk": element.pk}), data={
+            "tags": [{"name": "horror", "to_delete": True}, {"name": "SOME TAG", "to_delete": True}, {"name": "Some tag"}]
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(element.tags.values_list("name", flat=True)), ["some tag"])
+
+    def test_lookups_go_through_the_key(self):
+        self.assertEqual(self.clientUnauthenticated.get(reverse("tags-detail", kwargs={"pk": "SOME Tag"})).json()["name"],
+                         "some tag")
+        for query in ({"tags": "Some Tag"}, {"tags__name": "SOME TAG"}, {"tags": "missing|SOME TAG"}):
+            response = self.clientUnauthenticated.get(reverse("element-list"), query)
+            self.assertEqual([element["id"] for element in response.json()["results"]], [self.element.pk], query)
+        self.assertEqual(Tag.objects.ids_for_names(["Some tag", "missing"]), {"Some tag": self.tag.pk})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tag.objects.create(name="SOME TAG")
+
+    def test_migration_merges_duplicates(self):
+        migration = importlib.import_module("backend.migrations.0013_tag_key")
+        elements = self.create_elements(3)
+        # Duplicates from before the key: "Tag 1" and "TAG 2" have keys of their own.
+        for name in ("Tag 1", "TAG 2"):
+            tag = Tag.objects.create(name=name + " x")
+            Tag.objects.filter(pk=tag.pk).update(name=name)
+        Tagging.objects.create(element=elements[0], tag=Tag.objects.get(name="Tag 1"))
+        Tagging.objects.create(element=elements[2], tag=Tag.objects.get(name="Tag 1"))
+        Tagging.objects.create(element=self.element, tag=Tag.objects.get(name="TAG 2"))
+        migration.merge_duplicate_tags(apps, connection.schema_editor())
+        self.assertFalse(Tag.objects.filter(name__in=["Tag 1", "TAG 2"]).exists())
+        self.assertEqual(set(Tag.objects.values_list("key", flat=True)), set(Tag.objects.values_list("name", flat=True)))
+        tag_1 = Tag.objects.get(name="tag 1")
+        self.assertEqual(set(tag_1.element_set.values_list("pk", flat=True)), {elements[0].pk, elements[1].pk, elements[2].pk})
+        self.assertEqual(tag_1.element_count, 3)
+        self.assertEqual(Tag.objects.get(name="tag 2").element_count, 4)
+        self.assertEqual(related_tags(Tag.objects.get(name="some tag"), 10), [{"name": "tag 2", "count": 1, "score": 1.0}])
+        self.assertEqual(ElementSignature.objects.get(element_id=self.element.pk).minhashes,
+                         pack(signature({self.tag.pk, Tag.objects.get(name="tag 2").pk})))
+
+
+class TestTagIdCache(ElementTestCase):
+    def filter_ids(self, tags):
+        with CaptureQueriesContext(connection) as context:
+            response = self.clientUnauthenticated.get(reverse("element-list"), {"tags": tags})
+        return [element["id"] for element in response.json()["results"]], len(context.captured_queries)
+
+    def test_resolves_popular_tags_without_queries(self):
+        ids, cold = self.filter_ids("Some Tag")
+        self.assertEqual(ids, [self.element.pk])
+        ids, warm = self.filter_ids("some tag")
+        self.assertEqual(ids, [self.element.pk])
+        self.assertEqual(warm, cold - 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(ids_for_names(["SOME TAG"]), {"SOME TAG": self.tag.pk})
+        stats = self.clientAdmin.get(reverse("cache-stats")).json()["tag_ids"]
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.6667)
+
+    def test_missing_tags_are_cached_until_created(self):
+        self.assertEqual(self.filter_ids("horror")[0], [])
+        with self.assertNumQueries(0):
+            self.assertEqual(ids_for_names(["Horror"]), {})
+        self.assertEqual(self.clientUnauthenticated.get(reverse("tags-detail", kwargs={"pk": "horror"})).status_code, 404)
+        self.assertEqual(tag_id_cache.stats()["negative_hits"], 2)
+        response = self.client.patch(reverse("element-detail", kwargs={"pk": self.element.pk}),
+                                     data={"tags": [{"name": "Horror"}]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.filter_ids("horror")[0], [self.element.pk])
+        self.assertEqual(self.clientUnauthenticated.get(reverse("tags-detail", kwargs={"pk": "horror"})).json()["name"],
+                         "Horror")
+
+    def test_tags_loaded_from_fixtures_are_seen(self):
+        self.assertEqual(self.filter_ids("horror")[0], [])
+        # As loaddata saves, without tags_created.
+        tag = Tag(name="Horror", key="horror")
+        tag.save_base(raw=True)
+        Tagging.objects.create(tag=tag, element=self.element)
+        self.assertEqual(self.filter_ids("horror")[0], [self.element.pk])
+
+    def test_stale_missing_entries_dont_break_writes(self):
+        tag_id_cache.set_many({"horror": None})
+        # Created by another worker, whose invalidation never reaches this process.
+        horror = Tag.objects.create(name="horror")
+        tag_id_cache.set_many({"horror": None})
+        response = self.client.patch(reverse("element-detail", kwargs={"pk": self.element.pk}),
+                                     data={"tags": [{"name": "horror"}]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Tag.objects.filter(key="horror").count(), 1)
+        self.assertTrue(self.element.tags.filter(pk=horror.pk).exists())
+        with self.settings(TAG_ID_CACHE_NEGATIVE_TIMEOUT=0):
+            tag_id_cache.set_many({"horror": None})
+            time.sleep(0.01)
+            self.assertEqual(ids_for_names(["horror"]), {"horror": horror.pk})
+
+    def test_writes_dont_trust_cached_ids(self):
+        self.assertEqual(ids_for_names(["some tag"]), {"some tag": self.tag.pk})
+        deleted = self.tag.pk
+        self.tag.delete()
+        # Deleted by another worker, whose invalidation never reaches this process.
+        tag_id_cache.set_many({"some tag": deleted})
+        response = self.client.post(reverse("element-list"), {"title": "Tagged", "tags": [{"name": "some tag"}]},
+                                    format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(Tag.objects.get(key="some tag").pk, deleted)
+        response = self.client.post(reverse("element-batch"), [
+            {"op": "create", "data": {"title": "Batched", "tags": [{"name": "some tag"}]}}], format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleted_and_renamed_tags_are_forgotten(self):
+        self.assertEqual(ids_for_names(["some tag"]), {"some tag": self.tag.pk})
+        self.tag.name = "renamed"
+        self.tag.save()
+        self.assertEqual(ids_for_names(["some tag", "renamed"]), {"renamed": self.tag.pk})
+        self.tag.delete()
+        self.assertEqual(ids_for_names(["renamed"]), {})
+
+    def test_is_bounded_and_thread_safe(self):
+        with self.settings(TAG_ID_CACHE_SIZE=50):
+
+            def work(offset):
+                for i in range(500):
+                    key = "tag %d" % ((offset + i) % 80)
+                    if not tag_id_cache.get_many([key]):
+                        tag_id_cache.set_many({key: i})
+            threads = [threading.Thread(target=work, args=(offset,)) for offset in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            stats = tag_id_cache.stats()
+            self.assertEqual(stats["size"], 50)
+            self.assertEqual(stats["hits"] + stats["misses"], 8 * 500)
+        with self.settings(TAG_ID_CACHE_SIZE=0), self.assertNumQueries(2):
+            ids_for_names(["some tag"])
+            ids_for_names(["some tag"])
+
+
+class TestSearch(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestSearch, self).setUp()
+        self.horror = Element.objects.create(title="Horror night", description="A scary scary film", user=self.user)
+        self.comedy = Element.objects.create(title="Comedy", description="A funny film, not scary", user=self.user)
+        self.other = Element.objects.create(title="Documentary", description="Facts", user=self.user)
+        Tagging.objects.create(tag=self.tag, element=self.comedy)
+        token_index.clear()
+        self.addCleanup(token_index.clear)
+
+    def search(self, query):
+        response = self.clientUnauthenticated.get(reverse("element-list") + "?" + query)
+        self.assertEqual(response.status_code, 200)
+        return [json["id"] for json in response.json()["results"]]
+
+    def test_database_backend_requires_every_term(self):
+        self.assertEqual(set(self.search("search=scary film")), {self.horror.pk, self.comedy.pk})
+        self.assertEqual(self.search("search=funny scary"), [self.comedy.pk])
+
+    @override_settings(SEARCH_BACKEND="backend.search.LocalSearchBackend")
+    def test_local_backend_ranks_by_relevance(self):
+        self.assertEqual(self.search("search=scary"), [self.horror.pk, self.comedy.pk])
+        self.assertEqual(self.search("search=FUNNY scary"), [self.comedy.pk])
+        self.assertEqual(self.search("search=missing"), [])
+
+    @override_settings(SEARCH_BACKEND="backend.search.LocalSearchBackend")
+    def test_local_backend_combines_with_tags(self):
+        self.assertEqual(self.search("search=scary&tags=" + self.tag.name), [self.comedy.pk])
+
+    @override_settings(SEARCH_BACKEND="backend.search.LocalSearchBackend")
+    def test_local_backend_sees_writes(self):
+        self.assertEqual(self.search("search=facts"), [self.other.pk])
+        response = self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.other.pk}), data={"description": "Scary facts"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.search("search=scary facts"), [self.other.pk])
+        self.client.delete(reverse("element-detail", kwargs={"pk": self.other.pk}))
+        self.assertEqual(self.search("search=facts"), [])
+
+    @override_settings(SEARCH_INDEX_CHECK_INTERVAL=60)
+    def test_token_index_changes_incrementally(self):
+        token_index.build()
+        version = token_index.version
+        token_index.apply(version + 1, token_index.change, self.other.pk, "brand new words")
+        self.assertEqual(token_index.rank(["brand"]), [self.other.pk])
+        self.assertEqual(token_index.rank(["facts"]), [])
+
+    @override_settings(SEARCH_BACKEND="backend.search.LocalSearchBackend")
+    def test_token_index_replays_the_changes_of_other_processes(self):
+        token_index.build()
+        with mock.patch.object(token_index, "load") as load:
+            self.client.patch(reverse("element-detail", kwargs={"pk": self.other.pk}), data={"title": "Scary"},
+                              format="json")
+            self.client.delete(reverse("element-detail", kwargs={"pk": self.horror.pk}))
+            self.assertEqual(self.search("search=scary"), [self.other.pk, self.comedy.pk])
+            load.assert_not_called()
+
+
+class TestTagCountsAndFacets(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestTagCountsAndFacets, self).setUp()
+        self.elements = self.create_elements(10)
+
+    def assert_counts_are_correct(self):
+        for tag in Tag.objects.all():
+            self.assertEqual(tag.element_count, tag.tagging_set.count(), tag.name)
+
+    def test_counts_follow_writes(self):
+        self.assert_counts_are_correct()
+        self.client.post(reverse("element-list"), self.data, format="json")
+        self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.elements[0].pk}),
+            data={"tags": [{"name": "tag 9"}, {"name": "tag 0", "to_delete": True}]},
+            format="json"
+        )
+        self.assert_counts_are_correct()
+        self.client.delete(reverse("element-detail", kwargs={"pk": self.elements[1].pk}))
+        self.assert_counts_are_correct()
+
+    def test_tags_sorted_by_popularity(self):
+        self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.element.pk}), data={"tags": [{"name": "tag 5"}]}, format="json"
+        )
+        response = self.clientUnauthenticated.get(reverse("tags-list") + "?ordering=-element_count")
+        results = response.json()["results"]
+        self.assertEqual(results[0], {"name": "tag 5", "to_delete": False, "element_count": 4})
+        self.assertEqual([json["element_count"] for json in results], sorted([json["element_count"] for json in results], reverse=True))
+
+    def test_facets_count_co_occurring_tags(self):
+        with self.assertNumQueries(2):
+            response = self.clientUnauthenticated.get(reverse("element-facets") + "?tags=tag 1")
+        self.assertEqual(response.status_code, 200)
+        expected = {"tag 1": 3, "tag 0": 2, "tag 2": 2, "tag 3": 1, "tag 9": 1}
+        self.assertEqual({json["name"]: json["count"] for json in response.json()["results"]}, expected)
+        self.assertEqual(response.json()["results"][0], {"name": "tag 1", "count": 3})
+
+    def test_unfiltered_facets_use_the_counts(self):
+        with self.assertNumQueries(1):
+            response = self.clientUnauthenticated.get(reverse("element-facets") + "?limit=2")
+        self.assertEqual(response.json()["results"], [{"name": "tag 0", "count": 3}, {"name": "tag 1", "count": 3}])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class TestResponseCache(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestResponseCache, self).setUp()
+        response_cache.cache.clear()
+        self.addCleanup(response_cache.cache.clear)
+
+    def get(self, url, cache):
+        response = self.clientUnauthenticated.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], cache)
+        return response.json()
+
+    def test_second_request_is_a_hit(self):
+        first = self.get(reverse("element-list") + "?tags=some tag", "MISS")
+        with self.assertNumQueries(1):
+            second = self.get(reverse("element-list") + "?tags=some tag", "HIT")
+        self.assertEqual(first, second)
+        self.assertEqual(response_cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_equivalent_queries_share_an_entry(self):
+        self.get(reverse("element-list") + "?tags=a|some tag,b&limit=5&offset=0", "MISS")
+        self.get(reverse("element-list") + "?offset=0&limit=5&tags=b,some tag|a", "HIT")
+        self.get(reverse("element-list") + "?offset=0&limit=5&tags=b,some tag", "MISS")
+
+    def test_writes_invalidate(self):
+        self.get(reverse("element-list"), "MISS")
+        self.get(reverse("tags-list"), "MISS")
+        self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.element.pk}), data={"tags": [{"name": "new tag"}]}, format="json"
+        )
+        self.assertEqual(len(self.get(reverse("element-list"), "MISS")["results"][0]["tags"]), 2)
+        self.assertEqual(self.get(reverse("tags-list"), "MISS")["count"], 2)
+        self.client.patch(reverse("element-detail", kwargs={"pk": self.element.pk}), data={"title": "t"}, format="json")
+        self.assertEqual(self.get(reverse("element-list"), "MISS")["results"][0]["title"], "t")
+        self.get(reverse("tags-list"), "HIT")
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertEqual(self.get(reverse("element-list"), "MISS")["results"][0]["user"]["username"], "renamed")
+
+    def test_only_username_changes_invalidate(self):
+        self.get(reverse("element-list"), "MISS")
+        self.assertTrue(self.client.login(username="user1", password="Qwerty1234!"))
+        self.user.email = "user1@example.com"
+        self.user.save()
+        self.get(reverse("element-list"), "HIT")
+
+    def test_versions_are_left_alone_without_consumers(self):
+        url = reverse("element-detail", kwargs={"pk": self.element.pk})
+
+        def bumps(context):
+            return [query for query in context.captured_queries
+                    if query["sql"].startswith("UPDATE") and "backend_version" in query["sql"]]
+        with self.settings(RESPONSE_CACHE_ENABLED=False), CaptureQueriesContext(connection) as context:
+            self.client.patch(url, data={"title": "t"}, format="json")
+        self.assertEqual(bumps(context), [])
+        with CaptureQueriesContext(connection) as context:
+            self.client.patch(url, data={"title": "u"}, format="json")
+        self.assertEqual(len(bumps(context)), 1)
+
+    def test_stats_are_admin_only(self):
+        self.assertEqual(self.client.get(reverse("cache-stats")).status_code, 403)
+        stats = self.clientAdmin.get(reverse("cache-stats")).json()
+        self.assertEqual(stats["responses"], {"hits": 0, "misses": 0})
+        self.assertEqual(set(stats["tag_ids"]), {"size", "hits", "negative_hits", "misses", "hit_rate"})
+
+
+@override_settings(TAG_COMPLETION_INDEX_ENABLED=True)
+class TestTagCompletion(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestTagCompletion, self).setUp()
+        self.create_elements(10)
+        for name, count in [("Horror", 3), ("horse", 1), ("hot", 2), ("house", 0)]:
+            tag = Tag.objects.create(name=name)
+            for element in Element.objects.all()[:count]:
+                Tagging.objects.create(tag=tag, element=element)
+        tag_prefix_index.clear()
+        self.addCleanup(tag_prefix_index.clear)
+
+    def complete(self, query):
+        response = self.clientUnauthenticated.get(reverse("tags-complete") + "?" + query)
+        self.assertEqual(response.status_code, 200)
+        return [(json["name"], json["element_count"]) for json in response.json()["results"]]
+
+    def test_ranks_matches_by_usage(self):
+        self.assertEqual(self.complete("q=ho"), [("Horror", 3), ("hot", 2), ("horse", 1), ("house", 0)])
+        self.assertEqual(self.complete("q=hor&limit=1"), [("Horror", 3)])
+        self.assertEqual(self.complete("q=HORS"), [("horse", 1)])
+        self.assertEqual(self.complete("q=x"), [])
+
+    def test_follows_new_tags_and_counts(self):
+        tag_prefix_index.build()
+        version = tag_prefix_index.version
+        tag = Tag(id=10 ** 6, name="hotel")
+        tag_prefix_index.apply(version + 1, tag_prefix_index.add, {tag.id: tag.name})
+        tag_prefix_index.adjust_counts({tag.id: 4})
+        with override_settings(TAG_COMPLETION_CHECK_INTERVAL=60):
+            self.assertEqual(tag_prefix_index.complete("h", 2), [("hotel", 4), ("Horror", 3)])
+            tag_prefix_index.adjust_counts({tag.id: -3})
+            self.assertEqual(tag_prefix_index.complete("h", 2), [("Horror", 3), ("hot", 2)])
+            self.assertEqual(tag_prefix_index.complete("hote", 2), [("hotel", 1)])
+
+    def test_follows_the_counts_of_other_processes(self):
+        tag_prefix_index.build()
+        horror = Element.objects.filter(tags__name="Horror").first()
+        with mock.patch.object(tag_prefix_index, "load") as load:
+            self.client.patch(reverse("element-detail", kwargs={"pk": horror.pk}), data={"tags": [{"name": "house"}]},
+                              format="json")
+            self.assertEqual(self.complete("q=hou"), [("house", 1)])
+            self.client.delete(reverse("element-detail", kwargs={"pk": horror.pk}))
+            self.assertEqual(self.complete("q=ho"), [("Horror", 2), ("hot", 1), ("horse", 0), ("house", 0)])
+            load.assert_not_called()
+
+    def test_sees_tags_created_by_elements(self):
+        self.assertEqual(self.complete("q=stra"), [])
+        self.client.post(reverse("element-list"), self.data, format="json")
+        self.assertEqual(self.complete("q=stra"), [("strange", 1)])
+
+    def test_database_answers_without_the_index(self):
+        queries = ["q=ho", "q=hor&limit=1", "q=HORS", "q=x"]
+        expected = [self.complete(query) for query in queries]
+        with override_settings(TAG_COMPLETION_INDEX_ENABLED=False):
+            self.assertEqual([self.complete(query) for query in queries], expected)
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(reverse("element-list"), self.data, format="json")
+            self.assertFalse([query for query in context.captured_queries
+                              if query["sql"].startswith("UPDATE") and "backend_version" in query["sql"]])
+
+
+class TestRelatedTags(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestRelatedTags, self).setUp()
+        # Element i is tagged tag i, tag i+1 and tag i+2 (modulo 10).
+        self.elements = self.create_elements(10)
+
+    def related(self, name, query=""):
+        response = self.clientUnauthenticated.get(reverse("tags-related", kwargs={"pk": name}) + query)
+        self.assertEqual(response.status_code, 200)
+        return [(tag["name"], tag["count"], tag["score"]) for tag in response.json()["results"]]
+
+    def all_related(self):
+        return {name: self.related(name) for name in Tag.objects.values_list("name", flat=True)}
+
+    def test_ranks_by_shared_elements(self):
+        self.assertEqual(self.related("tag 0"), [
+            ("tag 1", 2, 0.6667), ("tag 9", 2, 0.6667), ("tag 2", 1, 0.3333), ("tag 8", 1, 0.3333),
+        ])
+        self.assertEqual(self.related("tag 0", "?limit=1"), [("tag 1", 2, 0.6667)])
+        self.assertEqual(self.related("some tag"), [])
+
+    def test_follows_writes_and_matches_rebuild(self):
+        response = self.client.patch(
+            reverse("element-detail", kwargs={"pk": self.elements[0].pk}),
+            data={"tags": [{"name": "tag 5"}, {"name": "tag 1", "to_delete": True}]},
+            format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.related("tag 0")[:2], [("tag 9", 2, 0.6667), ("tag 1", 1, 0.3333)])
+        self.assertIn(("tag 0", 1, 0.25), self.related("tag 5"))
+        self.client.delete(reverse("element-detail", kwargs={"pk": self.elements[1].pk}))
+        self.client.post(reverse("element-list"), dict(self.data, tags=[{"name": "tag 0"}, {"name": "new"}]),
+                         format="json")
+        related = self.all_related()
+        self.assertEqual(related["new"], [("tag 0", 1, 1.0)])
+        output = io.StringIO()
+        call_command("rebuild_tag_cooccurrences", stdout=output)
+        self.assertIn("Stored", output.getvalue())
+        self.assertEqual(self.all_related(), related)
+
+    @override_settings(SIMILAR_INDEX_ENABLED=True)
+    def test_follows_tagging_deletes(self):
+        Tagging.objects.get(element=self.elements[0], tag__name="tag 1").delete()
+        Tagging.objects.filter(element=self.elements[3], tag__name__in=["tag 4", "tag 5"]).delete()
+        Tag.objects.get(name="tag 9").delete()
+        for tag in Tag.objects.all():
+            self.assertEqual(tag.element_count, tag.tagging_set.count(), tag.name)
+        self.assertEqual(ElementSignature.objects.get(element_id=self.elements[3].pk).minhashes,
+                         pack(signature({Tag.objects.get(name="tag 3").pk})))
+        related = self.all_related()
+        call_command("rebuild_tag_cooccurrences", stdout=io.StringIO())
+        self.assertEqual(self.all_related(), related)
+
+    def test_unknown_tag(self):
+        response = self.clientUnauthenticated.get(reverse("tags-related", kwargs={"pk": "missing"}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SIMILAR_INDEX_ENABLED=True, SIMILAR_BANDS=32, SIMILAR_ROWS=1)
+class TestSimilarElements(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestSimilarElements, self).setUp()
+        # Element i is tagged tag i, tag i+1 and tag i+2 (modulo 10).
+        self.elements = self.create_elements(10)
+        similarity_index.clear()
+        self.addCleanup(similarity_index.clear)
+
+    def similar(self, element):
+        response = self.clientUnauthenticated.get(reverse("element-similar", kwargs={"pk": element.pk}))
+        self.assertEqual(response.status_code, 200)
+        return [(json["id"], json["similarity"]) for json in response.json()["results"]]
+
+    def test_returns_most_similar_first(self):
+        first = self.elements[0]
+        self.assertEqual(self.similar(first), [
+            (self.elements[1].pk, 0.5), (self.elements[9].pk, 0.5), (self.elements[2].pk, 0.2), (self.elements[8].pk, 0.2),
+        ])
+        response = self.clientUnauthenticated.get(reverse("element-similar", kwargs={"pk": first.pk}) + "?limit=1")
+        json = response.json()["results"][0]
+        self.assertEqual(json.pop("similarity"), 0.5)
+        self.assert_json_is_element(json, self.elements[1])
+        self.assertEqual(self.similar(self.element), [])
+
+    def test_follows_writes_and_matches_rebuild(self):
+        first, fifth = self.elements[0], self.elements[5]
+        similarity_index.build()
+        response = self.client.patch(reverse("element-detail", kwargs={"pk": fifth.pk}), data={"tags": [
+            {"name": "tag 0"}, {"name": "tag 1"}, {"name": "tag 2"},
+            {"name": "tag 5", "to_delete": True}, {"name": "tag 6", "to_delete": True}, {"name": "tag 7", "to_delete": True},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.similar(first)[0], (fifth.pk, 1.0))
+        self.client.delete(reverse("element-detail", kwargs={"pk": fifth.pk}))
+        self.assertNotIn(fifth.pk, [pk for pk, score in self.similar(first)])
+        signatures = dict(ElementSignature.objects.values_list("element_id", "minhashes"))
+        self.assertEqual(len(signatures), 10)
+        output = io.StringIO()
+        call_command("rebuild_similar_index", stdout=output)
+        self.assertIn("Stored the signatures of 10 elements.", output.getvalue())
+        self.assertEqual(dict(ElementSignature.objects.values_list("element_id", "minhashes")), signatures)
+
+    def test_queries_are_constant(self):
+        self.similar(self.elements[0])
+        with self.assertNumQueries(5):
+            self.similar(self.elements[0])
+
+    def test_keeps_only_band_keys(self):
+        similarity_index.build()
+        self.assertEqual(len(similarity_index.keys[self.elements[0].pk]), 32)
+        self.assertFalse(hasattr(similarity_index, "signatures"))
+
+    def test_database_candidates_without_the_index(self):
+        expected = self.similar(self.elements[0])
+        with override_settings(SIMILAR_INDEX_ENABLED=False):
+            self.assertEqual(self.similar(self.elements[0]), expected)
+            ElementSignature.objects.all().delete()
+            self.client.patch(reverse("element-detail", kwargs={"pk": self.elements[0].pk}),
+                              data={"tags": [{"name": "tag 5"}]}, format="json")
+            self.assertFalse(ElementSignature.objects.exists())
+
+    def test_unknown_element(self):
+        response = self.clientUnauthenticated.get(reverse("element-similar", kwargs={"pk": 1000}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestExport(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestExport, self).setUp()
+        self.elements = self.create_elements(5)
+
+    def expected(self, elements):
+        return [{"id": element.id, "title": element.title, "description": element.description, "user": element.user_id,
+                 "tags": list(element.tags.order_by("id").values_list("name", flat=True))} for element in elements]
+
+    def test_streams_ndjson(self):
+        response = self.clientUnauthenticated.get(reverse("element-export"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected(Element.objects.order_by("id")))
+
+    def test_streams_filtered_csv(self):
+        response = self.clientUnauthenticated.get(reverse("element-export") + "?as=csv&tags=tag 2")
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ["id", "title", "description", "user", "tags"])
+        expected = self.expected(Element.objects.filter(tags__name="tag 2").order_by("id"))
+        self.assertEqual([int(row[0]) for row in rows[1:]], [element["id"] for element in expected])
+        self.assertEqual([row[4].split("|") for row in rows[1:]], [element["tags"] for element in expected])
+
+    def test_rejects_unknown_format(self):
+        self.assertEqual(self.clientUnauthenticated.get(reverse("element-export") + "?as=xml").status_code, 400)
+
+    def test_chunks_use_constant_queries(self):
+        with self.assertNumQueries(2 * 3 + 1):
+            list(iter_elements(Element.objects.all(), chunk_size=2))
+
+    def test_command_applies_filters(self):
+        output = io.StringIO()
+        call_command("export_elements", "--tags", "tag 2", "--not", "tag 3", stdout=output)
+        expected = self.expected(Element.objects.filter(tags__name="tag 2").exclude(tags__name="tag 3").order_by("id"))
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], expected)
+
+
+class TestImport(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestImport, self).setUp()
+        self.lines = [
+            json.dumps({"title": "First", "description": "d", "tags": ["some tag", "imported"]}),
+            "not json",
+            json.dumps({"title": "x" * 501}),
+            "",
+            json.dumps({"title": "Second", "tags": [{"name": " imported"}, {"name": "other\n"}]}),
+            json.dumps({"title": "Third"}),
+        ]
+
+    def post(self, client, lines, query=""):
+        return client.post(reverse("element-import-elements") + query, data="\n".join(lines),
+                           content_type="application/x-ndjson")
+
+    def test_imports_valid_records_and_reports_errors(self):
+        response = self.post(self.client, self.lines, "?batch_size=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 3)
+        self.assertEqual([error["line"] for error in response.json()["errors"]], [2, 3])
+        self.assertIn("title", response.json()["errors"][1]["errors"])
+        first = Element.objects.get(title="First")
+        self.assertEqual(first.user, self.user)
+        self.assertEqual(set(first.tags.values_list("name", flat=True)), {"some tag", "imported"})
+        self.assertEqual(set(Element.objects.get(title="Second").tags.values_list("name", flat=True)), {"imported", "other"})
+        self.assertEqual(Element.objects.get(title="Third").tags.count(), 0)
+        self.assertEqual(Tag.objects.get(name="imported").element_count, 2)
+        self.assertEqual(Tag.objects.get(name="some tag").element_count, 2)
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertFalse(Element.objects.filter(tag_names__startswith="import:").exists())
+
+    def test_needs_authentication(self):
+        self.assertEqual(self.post(self.clientUnauthenticated, self.lines).status_code, 401)
+        self.assertEqual(Element.objects.count(), 1)
+
+    def test_queries_per_batch_are_constant(self):
+        lines = [json.dumps({"title": str(i), "tags": ["t" + str(i % 7), "t" + str(i % 3)]}) for i in range(300)]
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.client, lines[:30], "?batch_size=1000")
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.client, lines, "?batch_size=1000")
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries) + 2)
+        self.assertEqual(Element.objects.count(), 331)
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), "elements.ndjson")
+        with open(path, "w") as file:
+            file.write("\n".join(self.lines))
+        output, errors = io.StringIO(), io.StringIO()
+        call_command("import_elements", path, "--user", self.user.username, stdout=output, stderr=errors)
+        self.assertIn("Created 3 elements, skipped 2 records.", output.getvalue())
+        self.assertIn("line 2:", errors.getvalue())
+
+
+class TestElementBatch(ElementTestCase):
+    def post(self, operations, client=None):
+        return (client or self.client).post(reverse("element-batch"), operations, format="json")
+
+    def test_applies_every_operation(self):
+        doomed = Element.objects.create(title="Doomed", user=self.user)
+        Tagging.objects.create(tag=self.tag, element=doomed)
+        response = self.post([
+            {"op": "create", "data": {"title": "Created", "tags": [{"name": "some tag"}, {"name": "new tag"}]}},
+            {"op": "update", "id": self.element.pk, "data": {
+                "title": "Renamed", "tags": [{"name": "new tag"}, {"name": "some tag", "to_delete": True}]}},
+            {"op": "delete", "id": doomed.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [201, 200, 204])
+        created = Element.objects.get(title="Created")
+        self.assertEqual(created.user, self.user)
+        self.assert_json_is_element(results[0]["element"], created)
+        self.element.refresh_from_db()
+        self.assertEqual(self.element.title, "Renamed")
+        self.assertEqual(list(self.element.tags.values_list("name", flat=True)), ["new tag"])
+        self.assertEqual(results[1]["element"]["tags"], [{"name": "new tag", "to_delete": False}])
+        self.assertFalse(Element.objects.filter(pk=doomed.pk).exists())
+        self.assertEqual(results[2], {"op": "delete", "status": 204, "id": doomed.pk})
+        self.assertEqual(Tag.objects.get(name="some tag").element_count, 1)
+        self.assertEqual(Tag.objects.get(name="new tag").element_count, 2)
+        self.assertFalse(ElementSignature.objects.filter(element_id=doomed.pk).exists())
+
+    @override_settings(SEARCH_BACKEND="backend.search.LocalSearchBackend")
+    def test_search_index_follows_without_rebuilding(self):
+        doomed = Element.objects.create(title="Doomed film", user=self.user)
+        token_index.build()
+        self.addCleanup(token_index.clear)
+        with mock.patch.object(token_index, "load") as load:
+            self.post([
+                {"op": "create", "data": {"title": "Created film"}},
+                {"op": "update", "id": self.element.pk, "data": {"title": "Renamed film"}},
+                {"op": "delete", "id": doomed.pk},
+            ])
+            self.client.post(reverse("element-import-elements"), data=json.dumps({"title": "Imported film"}),
+                             content_type="application/x-ndjson")
+            self.assertEqual(set(token_index.rank(["film"])),
+                             set(Element.objects.filter(title__contains="film").values_list("id", flat=True)))
+            self.assertEqual(len(token_index.rank(["film"])), 3)
+            load.assert_not_called()
+
+    def test_fails_as_a_whole(self):
+        other = Element.objects.create(title="Not mine", user=self.userOther)
+        response = self.post([
+            {"op": "create", "data": {"title": "Created", "tags": [{"name": "new tag"}]}},
+            {"op": "update", "id": other.pk, "data": {"title": "Mine now"}},
+            {"op": "delete", "id": other.pk},
+            {"op": "delete", "id": 12345},
+            {"op": "update", "id": self.element.pk, "data": {"title": "x" * 501}},
+            {"op": "move"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [424, 403, 400, 404, 400, 400])
+        self.assertEqual(results[1]["errors"], {"detail": "You don't have permission to update it!"})
+        self.assertIn("title", results[4]["errors"])
+        self.assertFalse(Element.objects.filter(title="Created").exists())
+        self.assertFalse(Tag.objects.filter(name="new tag").exists())
+        self.assertEqual(Element.objects.get(pk=other.pk).title, "Not mine")
+
+    def test_rejects_other_users_deletions_and_bad_requests(self):
+        response = self.post([{"op": "delete", "id": self.element.pk}], client=self.clientOther)
+        self.assertEqual(response.json()["results"][0]["status"], 403)
+        self.assertTrue(Element.objects.filter(pk=self.element.pk).exists())
+        self.assertEqual(self.post({"op": "delete", "id": self.element.pk}).status_code, 400)
+        self.assertEqual(self.post([], client=self.clientUnauthenticated).status_code, 401)
+        with self.settings(ELEMENT_BATCH_MAX_OPERATIONS=2):
+            self.assertEqual(self.post([{"op": "create", "data": {}}] * 3).status_code, 400)
+
+    def test_queries_dont_grow_with_operations(self):
+        elements = self.create_elements(40)
+
+        def operations(start, count):
+            return [
+                {"op": "update", "id": element.pk, "data": {"title": "Updated", "tags": [
+                    {"name": "tag " + str(i % 10)}, {"name": "batch " + str(i % 4)}, {"name": "tag 0", "to_delete": True}
+                ]}}
+                for i, element in enumerate(elements[start:start + count])
+            ] + [{"op": "create", "data": {"tags": [{"name": "batch " + str(i)}]}} for i in range(count)] + [
+                {"op": "delete", "id": element.pk} for element in elements[start + 30:start + 30 + count // 3]
+            ]
+        self.post(operations(0, 1))
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.post(operations(1, 3)).status_code, 200)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.post(operations(4, 24)).status_code, 200)
+        # Only the count updates grow, with the number of distinct count changes.
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries) + 10)
+        output = io.StringIO()
+        related = {name: list(TagCooccurrence.objects.filter(tag__name=name, count__gt=0).order_by("other_id")
+                              .values_list("other_id", "count")) for name in Tag.objects.values_list("name", flat=True)}
+        call_command("rebuild_tag_cooccurrences", stdout=output)
+        self.assertEqual(related, {name: list(TagCooccurrence.objects.filter(tag__name=name).order_by("other_id")
+                                              .values_list("other_id", "count"))
+                                   for name in Tag.objects.values_list("name", flat=True)})
+
+
+class TestTokenCache(UserTestCase):
+    def setUp(self) -> None:
+        super(TestTokenCache, self).setUp()
+        token_cache.clear()
+        self.key = Token.objects.get(user=self.user).key
+        self.url = reverse("user-detail", kwargs={"pk": self.user.pk})
+
+    def token_queries(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in queries.captured_queries if "authtoken_token" in query["sql"]]
+
+    def test_token_is_looked_up_once(self):
+        self.assertEqual(len(self.token_queries(self.client, self.url)), 1)
+        self.assertEqual(len(self.token_queries(self.client, self.url)), 0)
+
+    def test_me_uses_the_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("me-list"), data={"key": self.key})
+        self.assertEqual(response.status_code, 201)
+        self.assert_json_to_user(response.json(), self.user)
+        # Authentication and the view each read the revocation version, the token and its user come from the cache.
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertFalse(any("authtoken_token" in query["sql"] for query in queries.captured_queries))
+
+    def test_other_workers_revocations_invalidate(self):
+        self.client.get(self.url)
+        stale = token_cache.entries[self.key]
+        Token.objects.filter(key=self.key).delete()
+        # The entry of another worker, which never saw the invalidation.
+        token_cache.entries[self.key] = stale
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_cached_instances_are_independent(self):
+        self.client.get(self.url)
+        token = token_cache.get(self.key)
+        token.user = self.userOther
+        token.user.username = "changed"
+        self.assertEqual(token_cache.get(self.key).user.username, "user1")
+        self.assertEqual(token_cache.get(self.key).user.pk, self.user.pk)
+
+    def test_logout_invalidates(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.post(reverse("rest_logout")).status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_token_deletion_invalidates(self):
+        self.client.get(self.url)
+        Token.objects.filter(key=self.key).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation_invalidates(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_password_change_invalidates(self):
+        self.client.get(self.url)
+        self.assertIsNotNone(token_cache.get(self.key))
+        response = self.client.put(self.url, data={"username": "user1", "password": "Changed1234!"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(token_cache.get(self.key))
+
+    @override_settings(TOKEN_CACHE_SIZE=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [token.key for token in Token.objects.order_by("user_id")]
+        for client in (self.client, self.clientOther, self.client, self.clientAdmin):
+            client.get(self.url)
+        self.assertIsNotNone(token_cache.get(keys[0]))
+        self.assertIsNone(token_cache.get(keys[1]))
+        self.assertIsNotNone(token_cache.get(keys[2]))
+
+    @override_settings(TOKEN_CACHE_TIMEOUT=-1)
+    def test_entries_expire(self):
+        self.client.get(self.url)
+        self.assertIsNone(token_cache.get(self.key))
+        self.assertEqual(len(self.token_queries(self.client, self.url)), 1)
+
+    @override_settings(TOKEN_REVOCATION_CACHE_ALIAS="revocations", CACHES=dict(settings.CACHES, revocations={
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tempfile.mkdtemp()}))
+    def test_revocation_counter_in_a_shared_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse(any("authtoken_token" in query["sql"] or "backend_version" in query["sql"]
+                             for query in queries.captured_queries))
+        stale = token_cache.entries[self.key]
+        Token.objects.filter(key=self.key).delete()
+        token_cache.entries[self.key] = stale
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        # An evicted counter restarts above the values entries were read at.
+        token_cache.entries[self.key] = stale
+        caches["revocations"].clear()
+        self.assertIsNone(token_cache.get(self.key))
+
+    @override_settings(TOKEN_CACHE_ALIAS="default")
+    def test_shared_cache(self):
+        self.client.get(self.url)
+        self.assertEqual(len(self.token_queries(self.client, self.url)), 0)
+        Token.objects.filter(key=self.key).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class TestSyntheticDataset(TestCase):
+    def generate(self, seed):
+        get_user_model().objects.all().delete()
+        Tag.objects.all().delete()
+        SyntheticDataset(users=3, elements=50, tags=20, seed=seed).generate()
+        return sorted(Tagging.objects.values_list("element__title", "element__description", "tag__name"))
+
+    def test_is_reproducible(self):
+        first = self.generate(seed=1)
+        self.assertEqual(first, self.generate(seed=1))
+        self.assertNotEqual(first, self.generate(seed=2))
+        self.assertEqual(Element.objects.count(), 50)
+        self.assertEqual(Token.objects.count(), 3)
+
+    def test_tag_popularity_is_skewed(self):
+        self.generate(seed=1)
+        counts = dict(Tag.objects.values_list("name", "element_count"))
+        self.assertEqual(sum(counts.values()), Tagging.objects.count())
+        self.assertGreater(counts["tag 0"], counts["tag 19"])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+class TestInstrumentation(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestInstrumentation, self).setUp()
+        reset_metrics()
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.clientUnauthenticated.get(reverse("element-list"))
+        timing = dict(entry.split(";", 1) for entry in response["Server-Timing"].split(", "))
+        self.assertIn('desc="%d queries"' % len(queries.captured_queries), timing["db"])
+        self.assertEqual(set(timing), {"db", "serialize", "render", "total"})
+
+    def test_metrics(self):
+        self.clientUnauthenticated.get(reverse("element-list"))
+        self.clientUnauthenticated.get(reverse("element-list"))
+        response = self.clientUnauthenticated.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE db_queries_per_request histogram", lines)
+        self.assertIn('db_queries_per_request_bucket{view="element-list",le="+Inf"} 2', lines)
+        self.assertIn('http_request_duration_seconds_count{view="element-list",method="GET",status="200"} 2', lines)
+        self.assertIn('serialize_duration_seconds_count{view="element-list"} 2', lines)
+        self.assertTrue(any(line.startswith('response_size_bytes_sum{view="element-list"}') for line in lines))
+
+    @override_settings(SLOW_QUERY_SAMPLE_RATE=1.0, SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_are_logged_when_sampled(self):
+        with self.assertLogs("backend.slow_queries", "WARNING") as logs:
+            self.clientUnauthenticated.get(reverse("element-list"))
+        self.assertIn("Slow query in element-list", logs.output[0])
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_can_be_disabled(self):
+        response = self.clientUnauthenticated.get(reverse("element-list"))
+        self.assertNotIn("Server-Timing", response)
+
+
+class TestFastElementList(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestFastElementList, self).setUp()
+        self.create_elements(30)
+        Element.objects.create(title="Ünïcode \u2028 \"quoted\"\n", description="<b>&</b>", user=None)
+        self.element.description = "emoji \U0001F3AC"
+        self.element.save()
+
+    def expected(self, elements, count):
+        elements = elements.select_related("user").prefetch_related(Prefetch("tags", Tag.objects.order_by("name")))
+        data = OrderedDict([("count", count), ("next", None), ("previous", None),
+                            ("results", ElementSerializer(elements, many=True).data)])
+        return JSONRenderer().render(data)
+
+    def test_list_is_byte_compatible(self):
+        response = self.clientUnauthenticated.get(reverse("element-list"))
+        self.assertEqual(response.content, self.expected(Element.objects.all(), 32))
+        with mock.patch("backend.renderers.orjson", None):
+            response = self.clientUnauthenticated.get(reverse("element-list"))
+        self.assertEqual(response.content, self.expected(Element.objects.all(), 32))
+
+    @override_settings(TAG_INDEX_ENABLED=True)
+    def test_tag_index_list_is_byte_compatible(self):
+        response = self.clientUnauthenticated.get(reverse("element-list") + "?tags=tag 1")
+        elements = Element.objects.filter(tags__name="tag 1").order_by("id")
+        self.assertEqual(response.content, self.expected(elements, elements.count()))
+
+    def test_renderer_matches_json_renderer(self):
+        data = OrderedDict([
+            ("text", "é \u2028 \u2029 \x7f \"\\"), ("lazy", gettext_lazy("Invalid token.")), (1, [True, None]),
+            ("date", datetime.datetime(2020, 5, 24, 22, 57, 1, 5)), ("decimal", decimal.Decimal("1.10")),
+            ("big", 2 ** 70),
+        ])
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, "application/json; indent=4"),
+                         JSONRenderer().render(data, "application/json; indent=4"))
+
+
+@override_settings(ELEMENT_TAG_NAMES_ENABLED=True)
+class TestStoredTagNames(ElementTestCase):
+    def setUp(self) -> None:
+        super(TestStoredTagNames, self).setUp()
+        self.elements = self.create_elements(10)
+        call_command("check_tag_names", "--repair", stdout=io.StringIO())
+        response_cache.cache.clear()
+        self.addCleanup(response_cache.cache.clear)
+
+    def assert_consistent(self):
+        self.assertEqual(check_tag_names(), (Element.objects.count(), 0))
+
+    def test_lists_and_pages_skip_the_taggings(self):
+        Element.objects.create(title="Untagged", tag_names=None)
+        for url in (reverse("element-list"), reverse("element-detail", kwargs={"pk": self.element.pk})):
+            with CaptureQueriesContext(connection) as context:
+                stored = self.clientUnauthenticated.get(url).content
+            tagging_queries = [query for query in context.captured_queries if "backend_tagging" in query["sql"]]
+            # Only the element without stored names needs the taggings.
+            self.assertEqual(len(tagging_queries), 1 if url == reverse("element-list") else 0)
+            with self.settings(ELEMENT_TAG_NAMES_ENABLED=False):
+                self.assertEqual(self.clientUnauthenticated.get(url).content, stored)
+        response = self.clientUnauthenticated.get(reverse("element-detail", kwargs={"pk": 12345}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_writes_keep_the_names(self):
+        response = self.client.post(reverse("element-list"), self.data, format="json")
+        created = Element.objects.get(pk=response.json()["id"])
+        self.assertEqual(json.loads(created.tag_names), ["strange", "wow"])
+        self.client.post(reverse("element-list"), {"title": "No tags"}, format="json")
+        self.client.patch(reverse("element-detail", kwargs={"pk": self.elements[0].pk}), data={
+            "tags": [{"name": "Zebra"}, {"name": "tag 1", "to_delete": True}]}, format="json")
+        self.client.delete(reverse("element-detail", kwargs={"pk": self.elements[1].pk}))
+        self.client.post(reverse("element-batch"), [
+            {"op": "update", "id": self.elements[2].pk, "data": {"tags": [{"name": "alpha"}]}},
+            {"op": "create", "data": {"title": "Batched", "tags": [{"name": "beta"}]}},
+            {"op": "delete", "id": self.elements[3].pk},
+        ], format="json")
+        self.client.post(reverse("element-import-elements"), data=json.dumps({"title": "Imported", "tags": ["gamma"]}),
+                         content_type="application/x-ndjson")
+        self.assert_consistent()
+        self.assertEqual(json.loads(Element.objects.get(pk=self.elements[0].pk).tag_names), ["Zebra", "tag 0", "tag 2"])
+        self.assertEqual(Element.objects.get(title="No tags").tag_names, "[]")
+        tag = Tag.objects.get(name="tag 2")
+        tag.name = "renamed"
+        tag.save()
+        Tag.objects.get(name="tag 3").delete()
+        self.assert_consistent()
+
+    def test_saves_keep_django_semantics(self):
+        element = Element.objects.get(pk=self.elements[4].pk)
+        Element.objects.filter(pk=element.pk).delete()
+        element.save()
+        self.assertEqual(Element.objects.get(pk=element.pk).tag_names, element.tag_names)
+
+    def test_command_checks_and_repairs(self):
+        Element.objects.filter(pk=self.elements[0].pk).update(tag_names='["wrong"]')
+        Element.objects.filter(pk=self.elements[1].pk).update(tag_names=None)
+        with self.assertRaisesMessage(CommandError, "2 of 11 elements have stale tag names"):
+            call_command("check_tag_names", "--batch-size", "4", stdout=io.StringIO())
+        output = io.StringIO()
+        call_command("check_tag_names", "--repair", "--batch-size", "4", stdout=output)
+        self.assertIn("Checked 11 elements, repaired 2.", output.getvalue())
+        self.assert_consistent()
+
+    def test_stored_names_are_ignored_when_disabled(self):
+        Element.objects.filter(pk=self.element.pk).update(tag_names='["stale"]')
+        with self.settings(ELEMENT_TAG_NAMES_ENABLED=False):
+            response = self.clientUnauthenticated.get(reverse("element-detail", kwargs={"pk": self.element.pk}))
+            self.assertEqual(response.json()["tags"], [{"name": "some tag", "to_delete": False}])
+            self.client.patch(reverse("element-detail", kwargs={"pk": self.element.pk}), data={
+                "tags": [{"name": "other"}]}, format="json")
+        self.assertEqual(Element.objects.get(pk=self.element.pk).tag_names, '["stale"]')
+
+
+async def asgi_request(handler, path, method="GET", query_string=b""):
+    communicator = ApplicationCommunicator(handler, {
+        "type": "http", "method": method, "path": path, "query_string": query_string,
+        "headers": [(b"host", b"testserver")],
+    })
+    await communicator.send_input({"type": "http.request", "body": b""})
+    start = await communicator.receive_output(5)
+    body = b""
+    while True:
+        message = await communicator.receive_output(5)
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return start["status"], body
+
+
+def thread_name_after(seconds):
+    def get_response(handler, request):
+        time.sleep(seconds)
+        return HttpResponse(threading.current_thread().name)
+
+    return get_response
+
+
+PIN_CACHE_DIRECTORY = tempfile.mkdtemp()
+
+
+@override_settings(REPLICA_DATABASES={"replica": 1}, REPLICA_PIN_CACHE_ALIAS="pins", CACHES=dict(settings.CACHES, pins={
+    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": PIN_CACHE_DIRECTORY}))
+class TestReplicaRouting(ElementTestCase):
+    """Runs against a second, empty test database standing in for the replica."""
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpClass(cls):
+        settings_dict = dict(connections.databases["default"])
+        settings_dict["TEST"] = {} if connection.vendor == "sqlite" else {"NAME": settings_dict["NAME"] + "_replica"}
+        connections.databases["replica"] = settings_dict
+        connections["replica"].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        super(TestReplicaRouting, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestReplicaRouting, cls).tearDownClass()
+        connections["replica"].creation.destroy_test_db(connections["replica"].settings_dict["NAME"], verbosity=0)
+        del connections.databases["replica"]
+        if hasattr(connections._connections, "replica"):
+            delattr(connections._connections, "replica")
+
+    def setUp(self) -> None:
+        super(TestReplicaRouting, self).setUp()
+        replica_pins.cache.clear()
+        self.addCleanup(replica_pins.cache.clear)
+        replica_health.reset()
+        self.addCleanup(replica_health.reset)
+
+    def count(self, client):
+        response = client.get(reverse("element-list"))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["count"]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.count(self.clientUnauthenticated), 0)
+        Element.objects.using("replica").create(title="Replicated")
+        # Tokens are only on the primary, where authentication looks them up.
+        self.assertEqual(self.count(self.client), 1)
+        with override_settings(REPLICA_DATABASES={}):
+            self.assertEqual(self.count(self.clientUnauthenticated), 1)
+
+    def test_writers_read_their_writes(self):
+        response = self.client.post(reverse("element-list"), self.data, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.count(self.client), 2)
+        self.assertEqual(self.count(self.clientOther), 0)
+        # The pin expired.
+        replica_pins.cache.clear()
+        self.assertEqual(self.count(self.client), 0)
+
+    def test_pins_need_a_shared_cache(self):
+        for alias in (None, "default"):
+            with override_settings(REPLICA_PIN_CACHE_ALIAS=alias):
+                with self.assertRaises(ImproperlyConfigured):
+                    ReplicaMiddleware(lambda request: HttpResponse())
+        with override_settings(REPLICA_DATABASES={}, REPLICA_PIN_CACHE_ALIAS=None):
+            ReplicaMiddleware(lambda request: HttpResponse())
+
+    def test_weighted_balancing(self):
+        random.seed(0)
+        with override_settings(REPLICA_DATABASES={"replica": 3, "default": 1, "off": 0}):
+            picks = [choose_replica() for _ in range(2000)]
+        self.assertEqual(set(picks), {"replica", "default"})
+        self.assertAlmostEqual(picks.count("replica") / len(picks), 0.75, delta=0.05)
+
+    def test_failing_replicas_are_left_out(self):
+        with mock.patch.object(connections["replica"], "ensure_connection", side_effect=OperationalError):
+            self.assertEqual(self.count(self.clientUnauthenticated), 1)
+        self.assertFalse(replica_health.is_up("replica"))
+        self.assertEqual(self.count(self.clientUnauthenticated), 1)
+        replica_health.reset()
+        aliases = []
+        list_elements = ElementViewSet.list
+
+        def flaky_list(view, request, *args, **kwargs):
+            aliases.append(read_alias.get())
+            if len(aliases) == 1:
+                raise OperationalError("Lost connection to server during query")
+            return list_elements(view, request, *args, **kwargs)
+
+        with mock.patch.object(ElementViewSet, "list", flaky_list):
+            self.assertEqual(self.count(self.clientUnauthenticated), 1)
+        self.assertEqual(aliases, ["replica", None])
+        self.assertFalse(replica_health.is_up("replica"))
+
+
+class TestPooledASGIHandler(TransactionTestCase):
+    @override_settings(ASGI_READ_THREADS=8, ASGI_WRITE_THREADS=1)
+    def test_slow_reads_run_concurrently(self):
+        handler = PooledASGIHandler()
+
+        async def requests():
+            return await asyncio.gather(*[asgi_request(handler, "/api/elements/") for _ in range(8)])
+
+        with mock.patch("django.core.handlers.base.BaseHandler.get_response", thread_name_after(0.3)):
+            started = time.perf_counter()
+            responses = async_to_sync(requests)()
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 8 * 0.3 / 2)
+        self.assertTrue(all(status == 200 and body.startswith(b"asgi-read") for status, body in responses))
+
+    def test_writes_use_their_own_pool(self):
+        handler = PooledASGIHandler()
+        with mock.patch("django.core.handlers.base.BaseHandler.get_response", thread_name_after(0)):
+            self.assertTrue(async_to_sync(asgi_request)(handler, "/api/elements/", "POST")[1].startswith(b"asgi-write"))
+            self.assertTrue(async_to_sync(asgi_request)(handler, "/api/me/", "POST")[1].startswith(b"asgi-read"))
+
+    def test_serves_the_views(self):
+        Element.objects.create(title="Async element")
+        handler = PooledASGIHandler()
+        status, body = async_to_sync(asgi_request)(handler, "/api/elements/")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["results"][0]["title"], "Async element")
+        status, body = async_to_sync(asgi_request)(handler, "/api/elements/export/", query_string=b"as=csv")
+        self.assertEqual(status, 200)
+        self.assertIn(b"Async element", body)
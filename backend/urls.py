@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from backend.views import UserViewSet, ElementViewSet, TagViewSet, MeViewSet
+from backend.views import UserViewSet, ElementViewSet, TagViewSet, MeViewSet, cache_stats
 
 router = DefaultRouter()
 router.register(r"users", UserViewSet, basename="user")
@@ -10,4 +10,5 @@ router.register(r"me", MeViewSet, basename="me")
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("cache/stats/", cache_stats, name="cache-stats"),
 ]
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from backend.models import Version, VersionChange
+from backend.routers import use_primary
+
+TAGGINGS = "taggings"
+ELEMENTS = "elements"
+TAGS = "tags"
+USERS = "users"
+TOKENS = "tokens"
+
+# {version name: [callables telling whether a consumer of the counter is enabled]}
+consumers = {}
+
+
+def track_versions(is_enabled, *names):
+    """Registers a consumer of the counters, which are only bumped while one of their consumers is enabled."""
+    for name in names:
+        consumers.setdefault(name, []).append(is_enabled)
+
+
+def is_tracked(name):
+    return any(is_enabled() for is_enabled in consumers.get(name, ()))
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+def get_versions(names):
+    versions = dict(Version.objects.filter(name__in=names).values_list("name", "value"))
+    return {name: versions.get(name, 0) for name in names}
+
+
+def bump_version(name, change=None):
+    """
+    Increments the shared counter and returns its new value, as seen by the current transaction. A change,
+    any JSON serializable value, is logged with the new value for the indexes of other processes to replay.
+    Returns None without touching the counter when nothing consumes it: writers don't contend on its row.
+    """
+    if not is_tracked(name):
+        return None
+    if not Version.objects.filter(name=name).update(value=F("value") + 1):
+        try:
+            with transaction.atomic():
+                Version.objects.create(name=name, value=1)
+        except IntegrityError:
+            Version.objects.filter(name=name).update(value=F("value") + 1)
+    version = get_version(name)
+    if change is not None:
+        VersionChange.objects.create(name=name, version=version, data=json.dumps(change, separators=(",", ":")))
+        kept = getattr(settings, "VERSION_CHANGES_KEPT", 10000)
+        if version % 100 == 0:
+            VersionChange.objects.filter(name=name, version__lte=version - kept).delete()
+    return version
+
+
+def logged_changes(name, after, until):
+    """
+    Returns the changes logged with the versions after `after` up to `until` in order, None when one
+    of them has none: it was bumped without a change, or so long ago its change was dropped.
+    """
+    if until - after > getattr(settings, "VERSION_CHANGES_KEPT", 10000):
+        return None
+    rows = VersionChange.objects.filter(name=name, version__gt=after, version__lte=until).order_by("version")
+    changes = [json.loads(data) for data in rows.values_list("data", flat=True)]
+    return changes if len(changes) == until - after else None
+
+
+class VersionedIndex:
+    """
+    Base for process local indexes kept in step with shared version counters: version_name and the
+    followed_version_names whose changes the index also depends on.
+    Changes made by this process are applied incrementally once committed, changes made by
+    other processes show up as a version gap that the next query closes by replaying the changes
+    logged with the missing versions. Only a gap the log can't close rebuilds the index.
+    """
+    version_name = None
+    followed_version_names = ()
+    check_interval_setting = None
+
+    def __init__(self):
+        self.versions = {}
+        self.checked_at = 0
+        self.lock = threading.RLock()
+        self.reset()
+        track_versions(self.is_enabled, *self.version_names)
+
+    @property
+    def version_names(self):
+        return (self.version_name,) + tuple(self.followed_version_names)
+
+    @property
+    def version(self):
+        return self.versions.get(self.version_name)
+
+    def is_enabled(self):
+        return True
+
+    def reset(self):
+        raise NotImplementedError
+
+    def load(self):
+        raise NotImplementedError
+
+    def replay(self, name, changes):
+        """
+        Applies the changes logged by bump_version with one of the index's version names, in order.
+        Indexes that don't implement it are rebuilt instead.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        with self.lock:
+            self.reset()
+            self.versions = {}
+
+    def build(self):
+        with self.lock, use_primary():
+            versions = get_versions(self.version_names)
+            self.reset()
+            self.load()
+            self.versions = versions
+            self.checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        interval = getattr(settings, self.check_interval_setting, 0) if self.check_interval_setting else 0
+        # The primary, as replicas may lag behind the changes this process already applied.
+        with self.lock, use_primary():
+            if self.versions and time.monotonic() - self.checked_at < interval:
+                return
+            if not self.versions:
+                self.build()
+                return
+            for name, version in get_versions(self.version_names).items():
+                if version != self.versions[name] and not self.catch_up(name, version):
+                    self.build()
+                    return
+            self.checked_at = time.monotonic()
+
+    def catch_up(self, name, version):
+        """Replays the logged changes of the name up to version, returns False when they aren't all logged."""
+        if type(self).replay is VersionedIndex.replay or version < self.versions[name]:
+            return False
+        changes = logged_changes(name, self.versions[name], version)
+        if changes is None:
+            return False
+        self.replay(name, changes)
+        self.versions[name] = version
+        return True
+
+    def apply(self, version, change, *args, name=None):
+        name = name or self.version_name
+        with self.lock:
+            current = self.versions.get(name)
+            # Versions up to the index's own were replayed from the log or loaded already.
+            if current is None or version is None or version <= current:
+                return
+            if version != current + 1:
+                # Another process wrote in between, the next query replays its changes and this one.
+                self.checked_at = 0
+                return
+            change(*args)
+            self.versions[name] = version
+
+    def apply_on_commit(self, version, change, *args, name=None):
+        transaction.on_commit(lambda: self.apply(version, change, *args, name=name))
@@ -1,19 +1,48 @@
 import django_filters
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, filters, mixins
-from rest_framework.authtoken.models import Token
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
-from rest_framework.pagination import LimitOffsetPagination
-from rest_framework.permissions import BasePermission, SAFE_METHODS
+from rest_framework.permissions import BasePermission, IsAdminUser, IsAuthenticated, SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import GenericViewSet
 
+from backend.authentication import get_token
+from backend.autocomplete import complete_tags
+from backend.batch import apply_batch
+from backend.cache import cache_response, response_cache
+from backend.export import CONTENT_TYPES, export_lines
+from backend.filters import ElementFilterSet, TagExpression, TagExpressionFilter, all_tag_facets, tag_facets
+from backend.importer import import_elements
+from backend.instrumentation import export_metrics
 from backend.models import Element, Tag
-from backend.serializers import ElementSerializer, UserSerializer, TagSerializer
+from backend.parsers import NDJSONParser
+from backend.related import related_tags
+from backend.search import FullTextSearchFilter
+from backend.serializers import (
+    ELEMENT_ROW_FIELDS, ElementRowSerializer, ElementSerializer, TagDetailSerializer, UserSerializer,
+)
+from backend.similar import similar_elements
+from backend.tag_cache import ids_for_names, tag_id_cache
+from backend.tag_index import tag_index
+from backend.versions import ELEMENTS, TAGGINGS, TAGS, USERS
 
 User = get_user_model()
 
 
+def positive_int(value, default, maximum):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(value, maximum) if value > 0 else default
+
+
 class IsTheUser(BasePermission):
     def has_object_permission(self, request, view, obj):
         return bool(
@@ -29,58 +58,167 @@ class IsAuthenticatedOrReadOnly(BasePermission):
         )
 
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    return Response({"responses": response_cache.stats(), "tag_ids": tag_id_cache.stats()})
+
+
+def metrics(request):
+    """Prometheus text exposition of this process' request histograms."""
+    return HttpResponse(export_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 class MeViewSet(mixins.CreateModelMixin, GenericViewSet):
     def create(self, request, *args, **kwargs):
-        token = get_object_or_404(Token.objects, key=request.data["key"])
+        token = get_token(request.data["key"])
+        if token is None:
+            raise Http404
         serializer = UserSerializer(token.user)
         return Response(serializer.data, 201)
 
 
-class TagViewSet(viewsets.ViewSet):
+class TagViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
     queryset = Tag.objects.all()
-
-    def list(self, request):
-        if self.queryset.count() > 0:
-            paginator = LimitOffsetPagination()
-            result_page = paginator.paginate_queryset(self.queryset, request)
-            serializer = TagSerializer(result_page, many=True)
-            return paginator.get_paginated_response(serializer.data)
-        return Response({})
-
-    def retrieve(self, request, pk=None):
-        tag = get_object_or_404(self.queryset, name=pk)
-        serializer = TagSerializer(tag)
-        return Response(serializer.data)
+    serializer_class = TagDetailSerializer
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ["element_count", "name", "id"]
+    lookup_field = "key"
+    lookup_url_kwarg = "pk"
+    cursor_ordering = "id"
+
+    @cache_response(TAGS, TAGGINGS)
+    def list(self, request, *args, **kwargs):
+        response = super(TagViewSet, self).list(request, *args, **kwargs)
+        if response.data.get("count") == 0:
+            return Response({})
+        return response
+
+    def get_object(self):
+        # Names are matched through their normalized key, so /api/tags/Horror/ finds the tag horror.
+        name = self.kwargs[self.lookup_url_kwarg]
+        tag_id = ids_for_names([name]).get(name)
+        if tag_id is None:
+            raise Http404
+        tag = get_object_or_404(self.get_queryset(), pk=tag_id)
+        self.check_object_permissions(self.request, tag)
+        return tag
+
+    @action(detail=True)
+    def related(self, request, pk=None):
+        limit = positive_int(request.query_params.get("limit"), default=10, maximum=100)
+        return Response({"results": related_tags(self.get_object(), limit)})
+
+    @action(detail=False)
+    def complete(self, request):
+        limit = positive_int(request.query_params.get("limit"), default=10, maximum=100)
+        matches = complete_tags(request.query_params.get("q", ""), limit)
+        return Response({"results": [{"name": name, "element_count": count} for name, count in matches]})
 
 
 class ElementViewSet(viewsets.ModelViewSet):
-    queryset = Element.objects.all()
+    queryset = Element.objects.select_related("user").prefetch_related(Prefetch("tags", Tag.objects.order_by("name")))
     serializer_class = ElementSerializer
-    filter_backends = [django_filters.rest_framework.DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ["tags__name", "user", "title"]
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend, FullTextSearchFilter, TagExpressionFilter]
+    filterset_class = ElementFilterSet
     search_fields = ['description', 'title']
     permission_classes = [IsAuthenticatedOrReadOnly]
-    
+    cursor_ordering = "id"
+
+    @cache_response(ELEMENTS, TAGGINGS, TAGS, USERS)
     def list(self, request, *args, **kwargs):
-        limit = request.GET.get('limit', None)
-        if limit and isinstance(limit, int):
-            self.queryset = self.queryset.filter()[:limit]
-        tags = request.GET.get('tags', None)
-        or_operator = request.GET.get('or', False)
-        if tags:
-            tags = str(tags).split(",")
-            if not or_operator:
-                for tag in tags:
-                    self.queryset = self.queryset.filter(tags__name=tag)
-            else:
-                self.queryset = self.queryset.filter(tags__name__in=tags).distinct()
-        return super(ElementViewSet, self).list(request, *args, **kwargs)
+        expression = TagExpression.from_params(request.query_params)
+        if (expression.groups and tag_index.is_enabled() and not self.has_other_filters(request)
+                and not self.paginator.uses_cursor(request)):
+            return self.list_from_tag_index(expression)
+        rows = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*ELEMENT_ROW_FIELDS)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(ElementRowSerializer(list(rows)).data)
+        return self.get_paginated_response(ElementRowSerializer(page).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        rows = self.get_queryset().prefetch_related(None).values(*ELEMENT_ROW_FIELDS)
+        row = get_object_or_404(rows, pk=kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return Response(ElementRowSerializer([row]).data[0])
+
+    def has_other_filters(self, request):
+        names = list(ElementFilterSet.base_filters) + [api_settings.SEARCH_PARAM]
+        return any(name in request.query_params for name in names)
+
+    @action(detail=False)
+    def facets(self, request):
+        limit = positive_int(request.query_params.get("limit"), default=20, maximum=1000)
+        if not TagExpression.from_params(request.query_params) and not self.has_other_filters(request):
+            return Response({"results": all_tag_facets(limit)})
+        return Response({"results": tag_facets(self.filter_queryset(self.get_queryset()), limit)})
+
+    @action(detail=False)
+    def export(self, request):
+        export_format = request.query_params.get("as", "ndjson")
+        if export_format not in CONTENT_TYPES:
+            raise ValidationError(detail="Export format must be one of: " + ", ".join(CONTENT_TYPES))
+        lines = export_lines(self.filter_queryset(self.get_queryset()), export_format)
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[export_format])
+        response["Content-Disposition"] = 'attachment; filename="elements.%s"' % export_format
+        return response
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[NDJSONParser],
+            permission_classes=[IsAuthenticated])
+    def import_elements(self, request):
+        batch_size = positive_int(request.query_params.get("batch_size"), default=1000, maximum=10000)
+        return Response(import_elements(request.data, request.user, batch_size))
+
+    @action(detail=False, methods=["post"], permission_classes=[IsAuthenticated])
+    def batch(self, request):
+        operations = request.data
+        maximum = getattr(settings, "ELEMENT_BATCH_MAX_OPERATIONS", 500)
+        if not isinstance(operations, list):
+            raise ValidationError(detail="Expected a list of operations.")
+        if len(operations) > maximum:
+            raise ValidationError(detail="A batch can't have more than %d operations." % maximum)
+        code, results = apply_batch(operations, request.user, self.get_serializer_context())
+        return Response({"results": results}, status=code)
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        element = get_object_or_404(Element.objects.only("id"), pk=pk)
+        limit = positive_int(request.query_params.get("limit"), default=10, maximum=100)
+        scores = similar_elements(element.pk, limit)
+        ids = [element_id for element_id, score in scores]
+        rows = {row["id"]: row for row in self.get_queryset().filter(pk__in=ids).values(*ELEMENT_ROW_FIELDS)}
+        found = [(rows[element_id], score) for element_id, score in scores if element_id in rows]
+        data = ElementRowSerializer([row for row, score in found]).data
+        for json, (row, score) in zip(data, found):
+            json["similarity"] = round(score, 4)
+        return Response({"results": data})
+
+    def list_from_tag_index(self, expression):
+        groups, excluded = expression.resolve()
+        ids = tag_index.evaluate(groups, excluded) if all(groups) else []
+        page = self.paginate_queryset(ids)
+        if page is not None:
+            ids = page
+        rows = {row["id"]: row for row in self.get_queryset().filter(pk__in=ids).values(*ELEMENT_ROW_FIELDS)}
+        data = ElementRowSerializer([rows[pk] for pk in ids if pk in rows]).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def perform_create(self, serializer):
+        element = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=element.pk)
+
+    def perform_update(self, serializer):
+        element = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=element.pk)
 
 
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsTheUser]
     queryset = User.objects.all()
+    cursor_ordering = "id"
     #
     # def get_queryset(self):
     #     if self.request.user.is_staff:
@@ -0,0 +1,16 @@
+from django.db import connections
+
+from backend import autocomplete, search, similar, tag_index
+
+
+def warm_up_indexes():
+    """
+    Builds the enabled in-memory indexes, so the first requests of a worker don't wait for them. Servers
+    call it once per worker process, see gunicorn.conf.py, anything else builds them on first use.
+    """
+    tag_index.warm_up()
+    search.warm_up()
+    autocomplete.warm_up()
+    similar.warm_up()
+    # The worker's request threads open their own connections.
+    connections.close_all()
@@ -0,0 +1,14 @@
+# Serves MoviesWebsite.asgi with uvicorn workers: each worker process runs an event loop and answers
+# requests from its thread pools (ASGI_READ_THREADS, ASGI_WRITE_THREADS) instead of one at a time.
+# Gunicorn takes the port from $PORT and the number of workers from $WEB_CONCURRENCY.
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 5
+graceful_timeout = 30
+timeout = 60
+
+
+def post_worker_init(worker):
+    # Before the worker's event loop runs, where Django refuses database access.
+    from backend.warm_up import warm_up_indexes
+
+    warm_up_indexes()